@@ -1,8 +1,11 @@
 import ssh
 import hostsystem
+import power
+import workers
 import updatemor
-import ssl
-import hashlib
+import onboard
+import thumbprint
+import rolling
 
 class Cluster:
     """Class to operate on the cluster"""
@@ -46,11 +49,7 @@ class Cluster:
             host_ssh.get_ssl_thumbprint()
         """
 
-        # http://www.vmware.com/support/developer/vc-sdk/visdk25pubs/ReferenceGuide/vim.host.ConnectSpec.html
-        server_cert = ssl.get_server_certificate((host, 443))
-        scsha1 = hashlib.sha1(ssl.PEM_cert_to_DER_cert(server_cert)).hexdigest()
-        fmt = ':'.join([scsha1[i:i+2] for i,j in enumerate(scsha1) if not (i%2)])
-        host_spec.sslThumbprint = fmt
+        host_spec.sslThumbprint = thumbprint.get(host)
 
 
         license = self._server._licenses['esx']
@@ -58,27 +57,79 @@ class Cluster:
                 asConnected=True,license=license)
         if wait:
             tk = self._server.wait_for_task(tk)
+            if thumbprint.is_verify_fault(tk.error):
+                # the cached thumbprint is stale, try once with a new one
+                host_spec.sslThumbprint = thumbprint.get(host,refresh=True)
+                tk = self.mor.AddHost_Task(spec=host_spec,
+                        asConnected=True,license=license)
+                tk = self._server.wait_for_task(tk)
             self.update()
             host_obj = self.get_host(host)
             return host_obj
         else:
             tk = self._server.add_task(tk)
+            tk.add_callback(lambda tk: thumbprint.check_task(tk,host))
             return tk
 
+    def add_hosts(self,hosts,user='root',password='nbv12345',
+            max_parallel=onboard.MAX_PARALLEL,
+            max_workers=workers.MAX_WORKERS,timeout=None):
+        """Add many hosts concurrently, see onboard.add_hosts. Returns a
+        dict with hosts (name -> host object of the added and already
+        present hosts), skipped (names already present) and error
+        (name -> error of the hosts that failed)"""
+        license = self._server._licenses['esx']
+        def add_task(spec):
+            return self.mor.AddHost_Task(spec=spec,asConnected=True,
+                license=license)
+        result = onboard.add_hosts(self._server,self.mor,add_task,hosts,
+                user,password,max_parallel,max_workers,timeout)
+        for name, mor in result['hosts'].items():
+            result['hosts'][name] = hostsystem.Host(self._server,
+                    self._datacenter,mor)
+        return result
+
     def get_host(self,name=None):
         """Returns all host objects or given host object under the
         current cluster"""
         host_list = []
-        # childEntity.host is a list of hosts
-        for host in self.mor.host:
-            if not name or name == host.name:
-                obj = hostsystem.Host(self._server,self._datacenter,host)
-                host_list.append(obj)
-                if name and name == host.name:
-                    break
+        for host in self._server.find_mor('HostSystem',name,self.mor):
+            obj = hostsystem.Host(self._server,self._datacenter,host)
+            host_list.append(obj)
         if name and len(host_list):
             host_list = host_list[0]
         return host_list
 
+    def power_vms(self,operation,names=None,wait=True,
+            max_parallel=power.MAX_PARALLEL,override=False):
+        """Power on, off or suspend the vms in this cluster in one
+        batch, see Host.power_vms"""
+        return power.set_power_state(self._server,operation,self.mor,
+                                     self._datacenter.mor,names,wait,
+                                     max_parallel,override)
+
+    def apply_network_plan(self,plan,max_workers=workers.MAX_WORKERS):
+        """Apply the netplan.NetworkPlan to all the hosts of the cluster
+        concurrently. Returns a dict of host name to the error of the
+        hosts that failed"""
+        errors = {}
+        for host_obj, result, error in plan.apply_many(self.get_host(),
+                                                       max_workers):
+            if error:
+                errors[host_obj.mor.name] = error
+        return errors
+
+    def rolling_maintenance(self,callback=None,parallel=1,min_available=1,
+            evacuate=True,state_file=None,timeout=None):
+        """Take the hosts of the cluster through maintenance mode, parallel
+        hosts at a time while keeping min_available hosts in service.
+        callback(host_obj) is run on each host while it is in maintenance
+        mode. With a state_file a stopped run resumes where it left off.
+        See rolling.RollingMaintenance. Returns the progress dict (done,
+        failed, in_progress, pending host names)"""
+        op = rolling.RollingMaintenance(self,callback,parallel,
+                min_available,evacuate,state_file,timeout)
+        return op.run()
+
     def update(self):
         updatemor.update(self)
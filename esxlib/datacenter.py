@@ -2,9 +2,12 @@ import ssh
 import hostsystem
 import dvswitch
 import cluster
+import power
 import updatemor
-import ssl
-import hashlib
+import onboard
+import thumbprint
+import workers
+import vmquestion
 
 class Datacenter:
     """Class to operate on the datacenter"""
@@ -100,7 +103,13 @@ class Datacenter:
         """Return all clusters under this datacenter as a list of
         cluster objects or given cluster as cluster object"""
         objs = []
-        for obj in self.mor.hostFolder.childEntity:
+        children = None
+        if name:
+            children = self._server.lookup_mor('ComputeResource',name,
+                                               self.mor)
+        if children is None:
+            children = self.mor.hostFolder.childEntity
+        for obj in children:
             if obj.__class__.__name__ != "vim.ClusterComputeResource":
                 continue
             if not name or name == obj.name:
@@ -136,9 +145,15 @@ class Datacenter:
         the given name"""
         self.update()
         objs = []
+        vds_class = "vim.dvs.VmwareDistributedVirtualSwitch"
+        if name and not net_folder:
+            mors = self._server.lookup_mor('DistributedVirtualSwitch',
+                                           name,self.mor)
+            for child in mors or []:
+                if child.__class__.__name__ == vds_class:
+                    return dvswitch.DVS(self._server,child)
         if not net_folder:
             net_folder = self.mor.networkFolder
-        vds_class = "vim.dvs.VmwareDistributedVirtualSwitch"
         for child in net_folder.childEntity:
             if child.__class__.__name__ == 'vim.Folder':
                 # to get children dvswitch inside a folder
@@ -181,24 +196,46 @@ class Datacenter:
             host_ssh.get_ssl_thumbprint()
         """
 
-        # http://www.vmware.com/support/developer/vc-sdk/visdk25pubs/ReferenceGuide/vim.host.ConnectSpec.html
-        server_cert = ssl.get_server_certificate((host, 443))
-        scsha1 = hashlib.sha1(ssl.PEM_cert_to_DER_cert(server_cert)).hexdigest()
-        fmt = ':'.join([scsha1[i:i+2] for i,j in enumerate(scsha1) if not (i%2)])
-        host_spec.sslThumbprint = fmt
+        host_spec.sslThumbprint = thumbprint.get(host)
 
         license = self._server._licenses['esx']
         tk = self.mor.hostFolder.AddStandaloneHost_Task(spec=host_spec,
                 addConnected=True,compResSpec=None,license=license)
         if wait:
             tk = self._server.wait_for_task(tk)
+            if thumbprint.is_verify_fault(tk.error):
+                # the cached thumbprint is stale, try once with a new one
+                host_spec.sslThumbprint = thumbprint.get(host,refresh=True)
+                tk = self.mor.hostFolder.AddStandaloneHost_Task(
+                        spec=host_spec,addConnected=True,compResSpec=None,
+                        license=license)
+                tk = self._server.wait_for_task(tk)
             self.update()
             host_obj = self.get_host(host)
             return host_obj
         else:
             tk = self._server.add_task(tk)
+            tk.add_callback(lambda tk: thumbprint.check_task(tk,host))
             return tk
 
+    def add_hosts(self,hosts,user='root',password='nbv12345',
+            max_parallel=onboard.MAX_PARALLEL,
+            max_workers=workers.MAX_WORKERS,timeout=None):
+        """Add many hosts concurrently, see onboard.add_hosts. Returns a
+        dict with hosts (name -> host object of the added and already
+        present hosts), skipped (names already present) and error
+        (name -> error of the hosts that failed)"""
+        license = self._server._licenses['esx']
+        def add_task(spec):
+            return self.mor.hostFolder.AddStandaloneHost_Task(spec=spec,
+                addConnected=True,compResSpec=None,license=license)
+        result = onboard.add_hosts(self._server,self.mor.hostFolder,
+                add_task,hosts,user,password,max_parallel,max_workers,
+                timeout)
+        for name, mor in result['hosts'].items():
+            result['hosts'][name] = hostsystem.Host(self._server,self,mor)
+        return result
+
     def get_host(self,name=None):
         """Returns all the hosts or given host under this datacenter"""
         # 2 scenarios
@@ -206,22 +243,29 @@ class Datacenter:
         # dc has hosts
         # hosts are under childEntity of the dc hostFolder.
         # each childEntity under hostfolder is compute or cluster
+        # the container view walks all of them in one request
         host_list = []
-        for rsrc in self.mor.hostFolder.childEntity:
-            if rsrc.__class__.__name__ not in\
-                    ['vim.ClusterComputeResource','vim.ComputeResource']:
-                continue
-            # rsrc can be either cluster or compute. cluster or compute
-            # has the hosts under it (compute has 1, cluster many)
-            for host in rsrc.host:
-                if not name or name == host.name:
-                    obj = hostsystem.Host(self._server,self,host)
-                    host_list.append(obj)
-                    if name and name == host.name:
-                        break
+        for host in self._server.find_mor('HostSystem',name,
+                                          self.mor.hostFolder):
+            host_list.append(hostsystem.Host(self._server,self,host))
         if name and len(host_list):
             host_list = host_list[0]
         return host_list
 
+    def power_vms(self,operation,names=None,wait=True,
+            max_parallel=power.MAX_PARALLEL,override=False):
+        """Power on, off or suspend the vms in this datacenter in one
+        batch, see Host.power_vms"""
+        return power.set_power_state(self._server,operation,self.mor,
+                                     self.mor,names,wait,max_parallel,
+                                     override)
+
+    def answer_vm_moved(self,answer='moved',
+            max_workers=workers.MAX_WORKERS):
+        """Answer the pending "moved or copied" question of the vms on
+        all the hosts of this datacenter, see Host.answer_vm_moved"""
+        return vmquestion.answer_moved(self._server,self.mor,answer,
+                                       max_workers)
+
     def update(self):
         updatemor.update(self)
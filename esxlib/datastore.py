@@ -20,33 +20,79 @@ class Datastore:
         self._host.mor.configManager.datastoreSystem.RemoveDatastore(datastore=self.mor)
         pass
 
-    def search(self, pattern, folder=None, refresh=False):
-        if refresh:
-            self.refresh()
+    def start_search(self, pattern, folder=None, recursive=False):
+        """Start the search task for the pattern and return the task
+        mor. If recursive is True, all the sub folders are searched in
+        the same task"""
         spec = self._server.new_spec('HostDatastoreBrowserSearchSpec')
         spec.matchPattern = [pattern]
         dsp = "["+self.mor.name+"]"
         if folder:
             dsp += folder
-        tk = self.mor.browser.SearchDatastore_Task(datastorePath=dsp,
-                searchSpec=spec)
-        tk = self._server.wait_for_task(tk)
-        result = tk.result()
+        if recursive:
+            tk = self.mor.browser.SearchDatastoreSubFolders_Task(
+                datastorePath=dsp, searchSpec=spec)
+        else:
+            tk = self.mor.browser.SearchDatastore_Task(datastorePath=dsp,
+                    searchSpec=spec)
+        return tk
+
+    def search_paths(self, tk_obj, folder=None, recursive=False):
+        """Return the paths found by the completed search task object"""
         paths = []
-        if hasattr(result,'file'):
-            for f in result.file:
-                # if folder is not specified, append space between
-                # resulr folder and path
-                path = result.folderPath
-                if not folder:
+        if tk_obj.state != "success":
+            return paths
+        result = tk_obj.result()
+        if not recursive:
+            if hasattr(result,'file'):
+                for f in result.file:
+                    # if folder is not specified, append space between
+                    # resulr folder and path
+                    path = result.folderPath
+                    if not folder:
+                        path += " "
+                    path += f.path
+                    paths.append(path)
+            return paths
+        # sub folder search returns one result per folder
+        for res in result or []:
+            if not hasattr(res,'file'):
+                continue
+            for f in res.file:
+                path = res.folderPath
+                if path.endswith("]"):
                     path += " "
+                elif not path.endswith("/"):
+                    path += "/"
                 path += f.path
                 paths.append(path)
         return paths
 
+    def search(self, pattern, folder=None, refresh=False, recursive=False):
+        if refresh:
+            self.refresh()
+        tk = self.start_search(pattern, folder, recursive)
+        tk = self._server.wait_for_task(tk)
+        return self.search_paths(tk, folder, recursive)
+
+    def get_vmx_paths(self, refresh=False):
+        """Return the paths of all the vmx files on the datastore from
+        the server's datastore index. The datastore is searched
+        recursively if it is not indexed, the entry expired or refresh
+        is True"""
+        index = self._server.ds_index
+        paths = None
+        if not refresh:
+            paths = index.get(self.get_moid())
+        if paths is None:
+            paths = self.search("*.vmx", recursive=True)
+            index.set(self.get_moid(), paths)
+        return paths
+
     def refresh(self):
         self.mor.RefreshDatastore()
         self.mor.RefreshDatastoreStorageInfo()
+        self._server.ds_index.invalidate(self.get_moid())
         return
 
     def update(self):
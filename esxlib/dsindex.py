@@ -0,0 +1,125 @@
+"""
+Index of the .vmx files found on the datastores.
+
+Looking up a vm folder by name browses every datastore of the host. The
+index keeps the list of .vmx paths of each datastore (keyed by the
+datastore moid), built with one recursive browser search per datastore,
+so that repeated lookups are answered with a dict lookup.
+
+Entries expire after the ttl and are invalidated explicitly when the
+datastore contents change (refresh, create_vm, delete). The index can
+optionally be saved to and loaded from a file, like the dhcp lease
+cache.
+"""
+
+import os
+import pickle
+import threading
+import time
+
+# seconds after which a datastore has to be searched again
+DEFAULT_TTL = 600
+
+
+def vmx_name(path):
+    """Return the vm name of a vmx path if the vmx file is in a folder
+    of the same name e.g. '[ds1] vm1/vm1.vmx' returns vm1, otherwise
+    None"""
+    rel = path.split("]",1)[-1].strip()
+    parts = rel.split("/")
+    if len(parts) < 2 or not parts[-1].endswith(".vmx"):
+        return None
+    name = parts[-1][:-len(".vmx")]
+    if parts[-2] != name:
+        return None
+    return name
+
+
+class DatastoreIndex:
+    """Datastore moid to .vmx paths index"""
+
+    def __init__(self,ttl=DEFAULT_TTL,cache_file=None):
+        self._ttl = ttl
+        self._cache_file = cache_file
+        self._lock = threading.Lock()
+        # moid -> {'time': , 'vmx': [paths], 'names': {name: [paths]}}
+        self._entries = {}
+        if cache_file and os.path.exists(cache_file):
+            self.load()
+
+    def _is_fresh(self,entry):
+        return entry and time.time() - entry['time'] < self._ttl
+
+    def is_fresh(self,moid):
+        """Return True if the datastore has an entry within the ttl"""
+        with self._lock:
+            return bool(self._is_fresh(self._entries.get(moid)))
+
+    def get(self,moid):
+        """Return the vmx paths of the datastore or None if the entry is
+        missing or expired"""
+        with self._lock:
+            entry = self._entries.get(moid)
+            if not self._is_fresh(entry):
+                return None
+            return list(entry['vmx'])
+
+    def set(self,moid,paths):
+        """Store the vmx paths of the datastore"""
+        names = {}
+        for path in paths:
+            name = vmx_name(path)
+            if name:
+                names.setdefault(name,[]).append(path)
+        with self._lock:
+            self._entries[moid] = {'time': time.time(),
+                                   'vmx': list(paths),
+                                   'names': names}
+        if self._cache_file:
+            self.save()
+        return
+
+    def invalidate(self,moid=None):
+        """Drop the entry of the given datastore moid or all the entries
+        if moid is None"""
+        with self._lock:
+            if moid is None:
+                self._entries = {}
+            else:
+                self._entries.pop(moid,None)
+        if self._cache_file:
+            self.save()
+        return
+
+    def find_vmx(self,name,moids=None):
+        """Return the vmx paths of the vm name (vmx file of the same name
+        inside a folder of the same name) on the given datastore moids
+        (all the indexed datastores by default). Expired entries are
+        ignored"""
+        paths = []
+        with self._lock:
+            if moids is None:
+                moids = self._entries.keys()
+            for moid in moids:
+                entry = self._entries.get(moid)
+                if self._is_fresh(entry):
+                    paths.extend(entry['names'].get(name,[]))
+        return paths
+
+    def save(self,cache_file=None):
+        """Save the index to the cache file"""
+        cache_file = cache_file or self._cache_file
+        with self._lock:
+            fd = open(cache_file,"wb")
+            pickle.dump(self._entries,fd)
+            fd.close()
+        return
+
+    def load(self,cache_file=None):
+        """Load the index from the cache file"""
+        cache_file = cache_file or self._cache_file
+        with self._lock:
+            fd = open(cache_file,"rb")
+            self._entries = pickle.load(fd)
+            fd.close()
+        return
@@ -1,11 +1,30 @@
+import contextlib
 import updatemor
 
 class Portgroup:
-    """Class to manage the dvportgroup"""
+    """Class to manage the dvportgroup.
+
+    The setters collect their changes in one pending config spec. Outside
+    of a changes() block the spec is submitted right away, inside it all
+    the changes are merged and submitted as one ReconfigureDVPortgroup_Task
+    when the block exits
+        with pg.changes():
+            pg.set_vlan(10)
+            pg.enable_promisc()
+            pg.rename('pg-10')
+    A spec is only submitted after the previous task of the portgroup has
+    completed (tracked on the server, so it covers every Portgroup object
+    of the same portgroup), with the config version read at that time"""
 
     def __init__(self,dvs_obj,pg_mor):
         self._dvs = dvs_obj
         self.mor = pg_mor
+        # spec collecting the changes not yet submitted
+        self._pending = None
+        # nesting depth of changes() blocks
+        self._batch = 0
+        # last reconfigure task of the portgroup
+        self.task = None
 
     def get_moid(self, stringify=True):
         moid = self.mor._moId
@@ -19,116 +38,172 @@ class Portgroup:
         tk = self._dvs._server.wait_for_task(tk)
         return tk
 
+    @contextlib.contextmanager
+    def changes(self,wait=True):
+        """Merge the changes made in the with block into one spec and
+        submit it when the block exits. The task is available as
+        self.task"""
+        self._batch += 1
+        try:
+            yield self
+        except:
+            self._batch -= 1
+            if not self._batch:
+                self.discard()
+            raise
+        self._batch -= 1
+        if not self._batch:
+            self.commit(wait)
+
+    def discard(self):
+        """Drop the changes not yet submitted"""
+        self._pending = None
+
+    def _get_spec(self):
+        if self._pending is None:
+            self._pending = self._dvs._server.new_spec('DVPortgroupConfigSpec')
+        return self._pending
+
+    def _port_config(self):
+        spec = self._get_spec()
+        if not spec.defaultPortConfig:
+            spec.defaultPortConfig = self._dvs._server.new_spec('VMwareDVSPortSetting')
+        return spec.defaultPortConfig
+
+    def _security_policy(self):
+        port_config = self._port_config()
+        if not port_config.securityPolicy:
+            port_config.securityPolicy = self._dvs._server.new_spec('DVSSecurityPolicy')
+            port_config.securityPolicy.inherited = False
+        return port_config.securityPolicy
+
+    def _bool_policy(self,value):
+        policy = self._dvs._server.new_spec('BoolPolicy')
+        if value:
+            policy.value = True
+        else:
+            policy.value = False
+        policy.inherited = False
+        return policy
+
+    def _wait_previous(self):
+        """Wait for the previous reconfigure task of the portgroup, so the
+        config version read for the next spec is current"""
+        tk = self._dvs._server.pg_tasks.get(self.get_moid())
+        if tk and tk.end_time is None:
+            self._dvs._server.wait_for_task(tk)
+        return
+
+    def _submit(self,config_version=None,wait=False):
+        """Send the pending spec and return the task object or None if
+        there is nothing to send. If wait is False the task is added to
+        the server's task list"""
+        if self._pending is None:
+            return None
+        server = self._dvs._server
+        spec = self._pending
+        self._pending = None
+        self._wait_previous()
+        if config_version is None:
+            config_version = server.get_property(self.mor,
+                    'config.configVersion')
+        spec.configVersion = config_version
+        tk = self.mor.ReconfigureDVPortgroup_Task(spec=spec)
+        if wait:
+            tk = server._get_task_obj(tk)
+        else:
+            tk = server.add_task(tk)
+        self.task = tk
+        server.pg_tasks[self.get_moid()] = tk
+        return tk
+
+    def commit(self,wait=False,retries=3):
+        """Submit the pending changes as one task. Returns the task
+        object or None if nothing was pending. If wait is True and the
+        portgroup was changed by someone else in the meantime
+        (ConcurrentAccess), the spec is sent again with the new config
+        version up to retries times"""
+        spec = self._pending
+        tk = self._submit(wait=wait)
+        if tk is None or not wait:
+            return tk
+        for i in range(retries+1):
+            tk = self._dvs._server.wait_for_task(tk)
+            if tk.error.__class__.__name__ != 'vim.fault.ConcurrentAccess' or\
+                    i == retries:
+                break
+            print "Config version of %s changed, retrying" % self.mor.name
+            self._pending = spec
+            tk = self._submit(wait=True)
+        self.update()
+        return tk
+
+    def _apply(self,wait=False):
+        """Submit the change right away unless inside changes()"""
+        if self._batch:
+            return None
+        return self.commit(wait)
+
     def set_vlan(self,vlan):
         """Set vlan to the given vlan id on the portgroup"""
-        spec = self._dvs._server.new_spec('DVPortgroupConfigSpec')
-        spec.configVersion = self.mor.config.configVersion
-        spec.defaultPortConfig = self._dvs._server.new_spec('VMwareDVSPortSetting')
-        spec.defaultPortConfig.vlan = self._dvs._server.new_spec('VmwareDistributedVirtualSwitchVlanIdSpec')
-        spec.defaultPortConfig.vlan.vlanId = vlan
-        spec.defaultPortConfig.vlan.inherited = False
-        self.mor.ReconfigureDVPortgroup_Task(spec=spec)
-        self.update()
+        port_config = self._port_config()
+        port_config.vlan = self._dvs._server.new_spec('VmwareDistributedVirtualSwitchVlanIdSpec')
+        port_config.vlan.vlanId = vlan
+        port_config.vlan.inherited = False
+        self._apply()
         return
 
     def set_uplink_port_vlan_range(self,vlan_range):
         """Set vlan rtange on the current uplink portgroup to the give id. The id is
         dictionary of start and end vlan range """
-        spec = self._dvs._server.new_spec('DVPortgroupConfigSpec')
-        spec.configVersion = self.mor.config.configVersion
-        spec.defaultPortConfig = self._dvs._server.new_spec('VMwareDVSPortSetting')
-        spec.defaultPortConfig.vlan = self._dvs._server.new_spec('VmwareDistributedVirtualSwitchTrunkVlanSpec')
-        spec.defaultPortConfig.vlan.vlanId = vlan_range
-        spec.defaultPortConfig.vlan.inherited = False
-        self.mor.ReconfigureDVPortgroup_Task(spec=spec)
-        self.update()
+        port_config = self._port_config()
+        port_config.vlan = self._dvs._server.new_spec('VmwareDistributedVirtualSwitchTrunkVlanSpec')
+        port_config.vlan.vlanId = vlan_range
+        port_config.vlan.inherited = False
+        self._apply()
         return
 
     def rename(self,name):
         """Rename the current portgroup"""
-        spec = self._dvs._server.new_spec('DVPortgroupConfigSpec')
+        spec = self._get_spec()
         spec.name = name
-        spec.configVersion = self.mor.config.configVersion
-        self.mor.ReconfigureDVPortgroup_Task(spec=spec)
-        self.update()
+        self._apply()
         return
 
     def _set_promisc(self,value):
-        spec = self._dvs._server.new_spec('DVPortgroupConfigSpec')
-        spec.configVersion = self.mor.config.configVersion
-        spec.defaultPortConfig = self._dvs._server.new_spec('VMwareDVSPortSetting')
-        spec.defaultPortConfig.securityPolicy = self._dvs._server.new_spec('DVSSecurityPolicy')
-        spec.defaultPortConfig.securityPolicy.inherited = False
-        spec.defaultPortConfig.securityPolicy.allowPromiscuous = self._dvs._server.new_spec('BoolPolicy')
-        if value:
-            spec.defaultPortConfig.securityPolicy.allowPromiscuous.value = True
-        else:
-            spec.defaultPortConfig.securityPolicy.allowPromiscuous.value = False
-        spec.defaultPortConfig.securityPolicy.allowPromiscuous.inherited = False
-        self.mor.ReconfigureDVPortgroup_Task(spec=spec)
-        self.update()
+        policy = self._security_policy()
+        policy.allowPromiscuous = self._bool_policy(value)
+        self._apply()
         return
 
     def _set_security(self,value):
-        spec = self._dvs._server.new_spec('DVPortgroupConfigSpec')
-        spec.configVersion = self.mor.config.configVersion
-        spec.defaultPortConfig = self._dvs._server.new_spec('VMwareDVSPortSetting')
-        spec.defaultPortConfig.securityPolicy = self._dvs._server.new_spec('DVSSecurityPolicy')
-        spec.defaultPortConfig.securityPolicy.inherited = False
-        spec.defaultPortConfig.securityPolicy.allowPromiscuous = self._dvs._server.new_spec('BoolPolicy')
-        spec.defaultPortConfig.securityPolicy.macChanges = self._dvs._server.new_spec('BoolPolicy')
-        spec.defaultPortConfig.securityPolicy.forgedTransmits = self._dvs._server.new_spec('BoolPolicy')
-        if value:
-            spec.defaultPortConfig.securityPolicy.allowPromiscuous.value = True
-            spec.defaultPortConfig.securityPolicy.macChanges.value = True
-            spec.defaultPortConfig.securityPolicy.forgedTransmits.value = True
-        else:
-            spec.defaultPortConfig.securityPolicy.allowPromiscuous.value = False
-            spec.defaultPortConfig.securityPolicy.macChanges.value = False
-            spec.defaultPortConfig.securityPolicy.forgedTransmits.value = False
-
-        spec.defaultPortConfig.securityPolicy.allowPromiscuous.inherited = False
-        spec.defaultPortConfig.securityPolicy.macChanges.inherited = False
-        spec.defaultPortConfig.securityPolicy.forgedTransmits.inherited = False
-        self.mor.ReconfigureDVPortgroup_Task(spec=spec)
-        self.update()
+        policy = self._security_policy()
+        policy.allowPromiscuous = self._bool_policy(value)
+        policy.macChanges = self._bool_policy(value)
+        policy.forgedTransmits = self._bool_policy(value)
+        self._apply()
         return
 
     def enable_mac_hash_lb(self):
         """Enable lb based on mac hash on the current portgroup"""
-        spec = self._dvs._server.new_spec('DVPortgroupConfigSpec')
-        spec.configVersion = self.mor.config.configVersion
-        spec.defaultPortConfig = self._dvs._server.new_spec('VMwareDVSPortSetting')
-        spec.defaultPortConfig.uplinkTeamingPolicy = self._dvs._server.new_spec('VmwareUplinkPortTeamingPolicy')
-        spec.defaultPortConfig.uplinkTeamingPolicy.policy = self._dvs._server.new_spec('StringPolicy')
-        spec.defaultPortConfig.uplinkTeamingPolicy.policy.value = 'loadbalance_srcmac'
-        self.mor.ReconfigureDVPortgroup_Task(spec=spec)
-        self.update()
+        port_config = self._port_config()
+        port_config.uplinkTeamingPolicy = self._dvs._server.new_spec('VmwareUplinkPortTeamingPolicy')
+        port_config.uplinkTeamingPolicy.policy = self._dvs._server.new_spec('StringPolicy')
+        port_config.uplinkTeamingPolicy.policy.value = 'loadbalance_srcmac'
+        self._apply()
         return
- 
+
     def set_pg_type(self,value, wait=True):
         self.update()
-        spec = self._dvs._server.new_spec('DVPortgroupConfigSpec')
-        spec.configVersion = self.mor.config.configVersion
+        spec = self._get_spec()
         spec.type = value
-        tk = self.mor.ReconfigureDVPortgroup_Task(spec=spec)
-        if wait:
-            tk = self._dvs._server.wait_for_task(tk)
-        else:
-            tk = self._dvs._server.add_task(tk)
-        return tk
+        return self._apply(wait)
 
     def set_num_ports(self,value, wait=True):
         self.update()
-        spec = self._dvs._server.new_spec('DVPortgroupConfigSpec')
-        spec.configVersion = self.mor.config.configVersion
+        spec = self._get_spec()
         spec.numPorts = value
-        tk = self.mor.ReconfigureDVPortgroup_Task(spec=spec)
-        if wait:
-            tk = self._dvs._server.wait_for_task(tk)
-        else:
-            tk = self._dvs._server.add_task(tk)
-        return tk
+        return self._apply(wait)
 
     def enable_promisc(self):
         """Enable promiscuous mode on the current portgroup"""
@@ -145,7 +220,6 @@ class Portgroup:
     def disable_security_policy(self):
         """Disable security policy on the current portgroup"""
         self._set_security(False)
-    
+
     def update(self):
         updatemor.update(self)
-
@@ -1,4 +1,5 @@
 import dvportgroup
+import inventory
 import updatemor
 
 class DVS:
@@ -23,7 +24,7 @@ class DVS:
             tk = self._server.add_task(tk)
         return tk
 
-    def host_operation(self,operation,host_obj,nic):
+    def _host_spec(self,operation,host_obj,nic):
         hspec = self._server.new_spec('DistributedVirtualSwitchHostMemberConfigSpec')
         hspec.host = host_obj.mor
         hspec.operation = operation
@@ -34,15 +35,45 @@ class DVS:
             pnic_spec = self._server.new_spec('DistributedVirtualSwitchHostMemberPnicSpec')
             pnic_spec.pnicDevice = n
             hspec.backing.pnicSpec.append(pnic_spec)
-        self.update() # without this, the next ReconfigureDvs_Task may fail
-        dvs_spec = self._server.new_spec('DVSConfigSpec')
-        dvs_spec.configVersion = self.mor.config.configVersion
-        dvs_spec.host = [hspec]
-        tk = self.mor.ReconfigureDvs_Task(spec=dvs_spec)
-        tk = self._server.wait_for_task(tk)
+        return hspec
+
+    def get_config_version(self):
+        """Return the current config version of the switch, served from
+        the server's property cache if enabled"""
+        return self._server.get_property(self.mor,'config.configVersion')
+
+    def host_operations(self,ops,retries=3):
+        """Add, edit or remove many hosts in one ReconfigureDvs_Task. ops
+        is a list of (host_obj, nic or list of nics, operation) where
+        operation is add, edit or remove. If the switch was changed by
+        someone else in the meantime (ConcurrentAccess), the config
+        version is read again and the task retried up to retries times.
+        Returns the task object"""
+        hspecs = []
+        for host_obj, nic, operation in ops:
+            hspecs.append(self._host_spec(operation,host_obj,nic))
+        for i in range(retries+1):
+            dvs_spec = self._server.new_spec('DVSConfigSpec')
+            dvs_spec.configVersion = self.get_config_version()
+            dvs_spec.host = hspecs
+            try:
+                tk = self.mor.ReconfigureDvs_Task(spec=dvs_spec)
+            except Exception as e:
+                if e.__class__.__name__ != 'vim.fault.ConcurrentAccess' or\
+                        i == retries:
+                    raise
+                continue
+            tk = self._server.wait_for_task(tk)
+            if tk.error.__class__.__name__ != 'vim.fault.ConcurrentAccess':
+                break
+            print "Config version of %s changed, retrying" % self.mor.name
         self.update() # without this, the next ReconfigureDvs_Task would fail
         return tk
 
+    def host_operation(self,operation,host_obj,nic):
+        tk = self.host_operations([(host_obj,nic,operation)])
+        return tk
+
     def add_host_nic(self,host_obj,nic=[]):
         """Add the host_obj and attach nic to the switch"""
         tk = self.host_operation("add", host_obj, nic)
@@ -102,19 +133,44 @@ class DVS:
         self.update() # without this, the next ReconfigureDvs_Task would fail
         return tk
 
-    def add_port_group(self,name,num_ports=128,vlan=None,wait=True):
-        """Add portgroup of the given name to the switch. If wait=True
-        then return the portgroup object, otherwise return the task"""
+    def _bool_policy(self,value):
+        policy = self._server.new_spec('BoolPolicy')
+        policy.value = bool(value)
+        policy.inherited = False
+        return policy
+
+    def _port_group_spec(self,name,num_ports=128,vlan=None,
+            pg_type="earlyBinding",promisc=None,security=None):
+        """Return the portgroup config spec. promisc sets promiscuous
+        mode, security sets promiscuous mode, mac changes and forged
+        transmits together. None leaves them inherited"""
         spec = self._server.new_spec('DVPortgroupConfigSpec')
         spec.name = name
         spec.numPorts = num_ports
-        spec.type = "earlyBinding"
-        if vlan:
+        spec.type = pg_type
+        if vlan or promisc is not None or security is not None:
             spec.defaultPortConfig = self._server.new_spec('VMwareDVSPortSetting')
+        if vlan:
             spec.defaultPortConfig.vlan = self._server.new_spec('VmwareDistributedVirtualSwitchVlanIdSpec')
             spec.defaultPortConfig.vlan.vlanId = vlan
             spec.defaultPortConfig.vlan.inherited = False
-        tk = self.mor.AddDVPortgroup_Task(spec=spec)
+        if promisc is not None or security is not None:
+            policy = self._server.new_spec('DVSSecurityPolicy')
+            policy.inherited = False
+            if security is not None:
+                policy.allowPromiscuous = self._bool_policy(security)
+                policy.macChanges = self._bool_policy(security)
+                policy.forgedTransmits = self._bool_policy(security)
+            if promisc is not None:
+                policy.allowPromiscuous = self._bool_policy(promisc)
+            spec.defaultPortConfig.securityPolicy = policy
+        return spec
+
+    def add_port_group(self,name,num_ports=128,vlan=None,wait=True):
+        """Add portgroup of the given name to the switch. If wait=True
+        then return the portgroup object, otherwise return the task"""
+        spec = self._port_group_spec(name,num_ports,vlan)
+        tk = self.mor.AddDVPortgroup_Task(spec=[spec])
         if wait:
             tk = self._server.wait_for_task(tk)
             return self.get_port_group(name)
@@ -122,10 +178,110 @@ class DVS:
             tk = self._server.add_task(tk)
             return tk
 
+    def add_port_groups(self,pg_list,chunk_size=100,wait=True):
+        """Add many portgroups. pg_list is a list of dicts with the keys
+        name and optionally num_ports, vlan, pg_type, promisc, security
+        (see _port_group_spec). The specs are sent chunk_size at a time
+        in AddDVPortgroup_Task calls that run concurrently. If wait=True
+        return (created, failed), a dict of name to portgroup object of
+        the requested portgroups found on the switch and a dict of name
+        to the error of the chunk task of the ones that are missing.
+        Otherwise return the list of tasks"""
+        specs = [self._port_group_spec(**pg) for pg in pg_list]
+        tasks = []
+        for i in range(0,len(specs),chunk_size):
+            tk = self.mor.AddDVPortgroup_Task(spec=specs[i:i+chunk_size])
+            tasks.append(tk)
+        if not wait:
+            return [self._server.add_task(t) for t in tasks]
+        tk_objs = [self._server._get_task_obj(t) for t in tasks]
+        self._server.wait_for_tasks(tk_objs)
+        self.update()
+        existing = self.get_port_groups()
+        created = {}
+        failed = {}
+        for i, tk in enumerate(tk_objs):
+            for spec in specs[i*chunk_size:(i+1)*chunk_size]:
+                if spec.name in existing:
+                    created[spec.name] = existing[spec.name]
+                elif tk.state == "success":
+                    failed[spec.name] = "Not found after the task succeeded"
+                else:
+                    failed[spec.name] = tk.error or "Task did not complete"
+        return (created, failed)
+
+    def get_port_groups(self):
+        """Return a dict of name to portgroup object of all the
+        portgroups of the switch, fetched in one request"""
+        objs = {}
+        for obj in inventory.get_children(self._server,self.mor,
+                'portgroup','dvs.DistributedVirtualPortgroup'):
+            objs[obj['name']] = dvportgroup.Portgroup(self,obj['mor'])
+        return objs
+
+    def commit_port_groups(self,pg_list,wait=True,retries=3):
+        """Submit the pending changes (see Portgroup.changes) of many
+        portgroup objects of the switch. The config versions of all the
+        portgroups are read in one request and the tasks run concurrently.
+        If wait is True, the specs of the portgroups changed by someone
+        else in the meantime (ConcurrentAccess) are sent again with the
+        new config version up to retries times, like Portgroup.commit.
+        Returns the list of task objects"""
+        busy = []
+        for pg in pg_list:
+            tk = self._server.pg_tasks.get(pg.get_moid())
+            if tk and tk.end_time is None:
+                busy.append(tk)
+        if busy:
+            # the config versions are only current once these are done
+            self._server.wait_for_tasks(busy)
+        versions = {}
+        for obj in inventory.get_children(self._server,self.mor,
+                'portgroup','dvs.DistributedVirtualPortgroup',
+                ['config.configVersion']):
+            versions[obj['moid']] = obj['config.configVersion']
+        tasks = []
+        # (portgroup, spec) of each task, to send the spec again
+        sent = []
+        for pg in pg_list:
+            spec = pg._pending
+            tk = pg._submit(versions.get(pg.get_moid()))
+            if tk is not None:
+                tasks.append(tk)
+                sent.append((pg, spec))
+        if not wait or not tasks:
+            return tasks
+        self._server.wait_for_tasks(tasks)
+        for i in range(retries):
+            again = [idx for idx, tk in enumerate(tasks)
+                     if tk.error.__class__.__name__ ==
+                     'vim.fault.ConcurrentAccess']
+            if not again:
+                break
+            for idx in again:
+                pg, spec = sent[idx]
+                print "Config version of %s changed, retrying" % pg.mor.name
+                pg._pending = spec
+                tasks[idx] = pg._submit(wait=True)
+            self._server.wait_for_tasks([tasks[idx] for idx in again])
+        self.update()
+        for tk in tasks:
+            if tk.state != "success":
+                print "Failed to reconfigure portgroup", tk.error
+        return tasks
+
     def get_port_group(self,name=None):
         """Return all the portgroup objects or the given port group
         object under the current switch"""
         objs = []
+        if name:
+            mors = self._server.lookup_mor('dvs.DistributedVirtualPortgroup',
+                                           name)
+            for pg in mors or []:
+                dvs_mor = self._server.index.get(pg,
+                        'config.distributedVirtualSwitch')
+                if dvs_mor and str(dvs_mor._moId) == self.get_moid():
+                    return dvportgroup.Portgroup(self,pg)
         for pg in self.mor.portgroup:
             if not name or name == pg.name:
                 objs.append(dvportgroup.Portgroup(self,pg))
@@ -0,0 +1,64 @@
+"""
+Run a shell command on many hosts at once.
+
+The command runs on at most max_workers hosts at a time, each over a
+pooled ssh session (see sshpool) so hosts already connected to skip the
+login. Results are yielded as each host finishes
+
+    for host_obj, status, out, err in fanout.run(dc_obj, 'esxcli ...'):
+        ...
+
+status is the exit status of the command or None if it could not be
+run (connect failure, timeout), err then holds the error. Only the
+first max_output bytes of stdout and stderr are kept per host.
+"""
+
+import time
+
+import ssh
+import workers
+
+
+def get_hosts(targets):
+    """Return the host objects of the targets. A target is a host object
+    or anything with get_host, e.g. a datacenter or cluster object"""
+    if not isinstance(targets, (list, tuple)):
+        targets = [targets]
+    hosts = []
+    for target in targets:
+        if hasattr(target,'get_host'):
+            hosts.extend(target.get_host())
+        else:
+            hosts.append(target)
+    return hosts
+
+
+def _run_one(host_obj,cmd,user,password,timeout,max_output):
+    """Check out a session and run cmd, timeout covers the connect and
+    the command together"""
+    deadline = None
+    if timeout is not None:
+        deadline = time.time() + timeout
+    with ssh.session(host_obj.mor.name,user,password,timeout) as client:
+        if deadline is not None:
+            timeout = max(0,deadline - time.time())
+        return client.run(cmd,timeout,max_output)
+
+
+def run(targets,cmd,user='root',password='nbv12345',
+        max_workers=workers.MAX_WORKERS,timeout=None,
+        max_output=ssh.MAX_OUTPUT):
+    """Run cmd on the hosts of the targets (see get_hosts) with at most
+    max_workers at a time. timeout (seconds) applies to each host and
+    covers the session checkout, the connect and the command. This
+    is a generator that yields (host_obj, exit status, stdout, stderr)
+    as each host completes"""
+    func = lambda host_obj: _run_one(host_obj,cmd,user,password,timeout,
+                                     max_output)
+    for host_obj, result, error in workers.run_parallel(func,
+            get_hosts(targets),max_workers):
+        if error:
+            yield host_obj, None, "", str(error)
+        else:
+            status, out, err = result
+            yield host_obj, status, out, err
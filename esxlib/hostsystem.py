@@ -5,6 +5,9 @@ import datastore
 import time
 import updatemor
 import ssh
+import power
+import workers
+import vmquestion
 
 class Host:
     """Class for the host system"""
@@ -23,18 +26,24 @@ class Host:
             moid = str(moid)
         return moid
 
+    def get_property(self,prop,max_age=None):
+        """Return the property path (e.g. runtime.connectionState) of the
+        host, from the server's property cache if enabled"""
+        return self._server.get_property(self.mor,prop,max_age)
+
     def shell_cmd(self, cmd, user='root', password='nbv12345'):
         if not self.user_name:
             self.user_name = user
         if not self.password:
             self.password = password
-        if not self.ssh_handle:
-            self.ssh_handle = ssh.Client(self.mor.name, user, password)
 
+        # the session comes from the process wide pool, so it outlives
+        # this object and is shared with other Host objects of the host
         op = []
-        out,err = self.ssh_handle.execute(cmd)
-        out_op = out.read()
-        err_op = err.read()
+        with ssh.session(self.mor.name, user, password) as client:
+            out,err = client.execute(cmd)
+            out_op = out.read()
+            err_op = err.read()
         if out_op:
             op.append(out_op)
         if err_op:
@@ -89,16 +98,36 @@ class Host:
         """Return all the vm objects or a given vm object under this
         host""" 
         vm_objs = []
-        for vm in self.mor.vm:
-            if not name or name == vm.name:
-                obj = virtualmachine.VirtualMachine(self._server,vm)
-                vm_objs.append(obj)
-                if name and name == vm.name:
-                    break;
+        for vm in self._server.find_mor('VirtualMachine',name,self.mor):
+            obj = virtualmachine.VirtualMachine(self._server,vm)
+            vm_objs.append(obj)
         if name and len(vm_objs):
             vm_objs = vm_objs[0]
         return vm_objs
 
+    def power_vms(self,operation,names=None,wait=True,
+            max_parallel=power.MAX_PARALLEL,override=False):
+        """Power on ('on'), off ('off') or suspend ('suspend') all the vms
+        on this host (or only the ones in the names list) in one
+        batch. Power states are read in one property fetch and the vms
+        already in that state are skipped. Power off and suspend run at
+        most max_parallel tasks at a time. Returns a dict of the skipped,
+        successful and failed (name -> error) vm names and the drs
+        recommendations (name -> list) of the vms left off in manual drs
+        clusters. If override is True, power on also powers on the vms
+        of manual drs clusters instead of returning recommendations"""
+        return power.set_power_state(self._server,operation,self.mor,
+                                     self._datacenter.mor,names,wait,
+                                     max_parallel,override)
+
+    def answer_vm_moved(self,answer='moved',
+            max_workers=workers.MAX_WORKERS):
+        """Answer the pending "moved or copied" question of the vms on
+        this host with answer (moved or copied). Returns a dict with the
+        names answered and the errors (name -> error)"""
+        return vmquestion.answer_moved(self._server,self.mor,answer,
+                                       max_workers)
+
     def register_vm(self,name_or_path,wait=True):
         """Register a vm into the host. The vm can be provided either as
         a name or the path. If the name is provided, then its assumed to
@@ -108,12 +137,11 @@ class Host:
         path = name_or_path
         if not name_or_path.startswith("["):
             name = name_or_path
-            # name provided
-            paths = self.search_datastore(name)
+            # name provided, look it up in the datastore index
+            paths = self.find_vmx(name)
             if not paths:
-                paths = self.search_datastore(name, refresh=True)
+                paths = self.find_vmx(name, refresh=True)
             path = paths[0]
-            path += "/" + name + ".vmx"
         # register this under the datacenter's vmfolder
         tk = self._datacenter.mor.vmFolder.RegisterVM_Task(path=path,
                 host=self.mor,asTemplate=False,
@@ -158,11 +186,26 @@ class Host:
             objs = objs[0]
         return objs
 
+    def apply_network_plan(self,plan):
+        """Apply the netplan.NetworkPlan to this host in one
+        UpdateNetworkConfig call. Returns the HostNetworkConfigResult or
+        None if the host already matches the plan"""
+        return plan.apply(self)
+
     def get_network(self,name=None):
         """Return the network mors under the current host. There is no
         network object. It returns the standard mor to the network"""
         objs = []
-        for i in self.mor.network:
+        networks = self.mor.network
+        if name:
+            mors = self._server.lookup_mor('Network',name)
+            if mors is not None:
+                # the index has the names, only check they are on the host
+                moids = [str(i._moId) for i in networks]
+                for i in mors:
+                    if str(i._moId) in moids:
+                        return i
+        for i in networks:
             if not name or name == i.name:
                 objs.append(i)
                 if name and name == i.name:
@@ -195,7 +238,16 @@ class Host:
     def get_datastore(self,label=None):
         """Return all datastore objects or a given datastore object"""
         objs = []
-        for ds in self.mor.configManager.datastoreSystem.datastore:
+        ds_list = self.mor.configManager.datastoreSystem.datastore
+        if label:
+            mors = self._server.lookup_mor('Datastore',label)
+            if mors is not None:
+                # the index has the names, only check they are on the host
+                moids = [str(ds._moId) for ds in ds_list]
+                for ds in mors:
+                    if str(ds._moId) in moids:
+                        return datastore.Datastore(self._server,self,ds)
+        for ds in ds_list:
             if not label or ds.name == label:
                 objs.append(datastore.Datastore(self._server,self,ds))
                 if label and ds.name == label:
@@ -204,15 +256,89 @@ class Host:
             objs = objs[0]
         return objs
 
-    def search_datastore(self,pattern,folder=None,refresh=False):
+    def _search_datastores(self,ds_list,pattern,folder=None,
+            max_workers=workers.MAX_WORKERS,recursive=False):
+        """Search the pattern on the given datastore objects with at
+        most max_workers search tasks in flight. Returns a dict of the
+        index in ds_list to the list of paths, the datastores whose
+        search failed are left out"""
+        workers.check_max_workers(max_workers)
+        results = {}
+        in_flight = {}
+        pending = range(len(ds_list))
+        group = self._server.task_group()
+        try:
+            while pending or in_flight:
+                while pending and len(in_flight) < max_workers:
+                    idx = pending.pop(0)
+                    tk = ds_list[idx].start_search(pattern,folder,recursive)
+                    tk_obj = group.add(tk)
+                    in_flight[tk_obj.get_moid()] = idx
+                for tk_obj in group.wait_any():
+                    idx = in_flight.pop(tk_obj.get_moid())
+                    if tk_obj.state != "success":
+                        # left out, so it is not indexed as empty
+                        print "Failed to search datastore",\
+                            ds_list[idx].mor.name, tk_obj.error
+                        continue
+                    results[idx] = ds_list[idx].search_paths(tk_obj,folder,
+                                                             recursive)
+        finally:
+            group.close()
+        return results
+
+    def _refresh_datastores(self,ds_list,max_workers=workers.MAX_WORKERS):
+        """Refresh the datastores in parallel. Returns a dict of the moid
+        to the error of the datastores that failed to refresh"""
+        errors = {}
+        for ds, res, err in workers.run_parallel(
+                lambda ds: ds.refresh(), ds_list, max_workers):
+            if err is not None:
+                print "Failed to refresh datastore", ds.mor.name, err
+                errors[ds.get_moid()] = err
+        return errors
+
+    def search_datastore(self,pattern,folder=None,refresh=False,
+            max_workers=workers.MAX_WORKERS,recursive=False):
         """Search for the pattern in all the datastores and return the
-        results as paths. Optionally can specify the parent folder"""
+        results as paths. Optionally can specify the parent folder.
+        The searches run concurrently, at most max_workers search tasks
+        are in flight. If recursive is True, the sub folders are
+        searched as well"""
+        ds_list = self.get_datastore()
+        if refresh:
+            self._refresh_datastores(ds_list,max_workers)
+        results = self._search_datastores(ds_list,pattern,folder,
+                                          max_workers,recursive)
+        # keep the results in the datastore order
         paths = []
-        for ds in self.get_datastore():
-            file_list = ds.search(pattern, folder, refresh)
-            paths.extend(file_list)
+        for idx in sorted(results):
+            paths.extend(results[idx])
         return paths
 
+    def index_datastores(self,refresh=False,
+            max_workers=workers.MAX_WORKERS):
+        """Build the server's datastore index for the datastores of this
+        host. Only the datastores that are not indexed or expired are
+        searched (recursively for *.vmx), all of them if refresh is
+        True. Returns the list of datastore moids"""
+        index = self._server.ds_index
+        ds_list = self.get_datastore()
+        if refresh:
+            self._refresh_datastores(ds_list,max_workers)
+        stale = [ds for ds in ds_list if not index.is_fresh(ds.get_moid())]
+        results = self._search_datastores(stale,"*.vmx",None,max_workers,
+                                          recursive=True)
+        for idx, paths in results.items():
+            index.set(stale[idx].get_moid(),paths)
+        return [ds.get_moid() for ds in ds_list]
+
+    def find_vmx(self,name,refresh=False):
+        """Return the vmx paths of the vm name (name/name.vmx) on the
+        datastores of this host, looked up in the datastore index"""
+        moids = self.index_datastores(refresh)
+        return self._server.ds_index.find_vmx(name,moids)
+
     def enable_vmotion(self):
         nic = self.mor.configManager.virtualNicManager
         nic.SelectVnicForNicType(nicType='vmotion',device='vmk0')
@@ -236,17 +362,24 @@ class Host:
         tk = self._datacenter.mor.vmFolder.CreateVM_Task(config=spec,
                 pool=self.mor.parent.resourcePool,host=self.mor)
         if wait:
-            tk = self._server.wait_for_task(tk)
-            self.update()
+            tk = self._server._get_task_obj(tk)
         else:
             tk = self._server.add_task(tk)
+        # invalidate once the vm files exist, see VirtualMachine.delete
+        moid = datastore_obj.get_moid()
+        tk.add_callback(lambda tk: self._server.ds_index.invalidate(moid))
+        if wait:
+            tk = self._server.wait_for_task(tk)
+            self.update()
         return tk
 
     def update(self):
         updatemor.update(self)
 
-    def exit_maintenance_mode(self,wait=True):
-        tk = self.mor.ExitMaintenanceMode_Task(timeout=90)
+    def exit_maintenance_mode(self,wait=True,timeout=90):
+        """timeout (seconds) after which the task fails if the host
+        could not exit maintenance mode, None or 0 waits forever"""
+        tk = self.mor.ExitMaintenanceMode_Task(timeout=timeout or 0)
         if wait:
             tk = self._server.wait_for_task(tk)
             self.update()
@@ -254,8 +387,10 @@ class Host:
             tk = self._server.add_task(tk)
         return tk
 
-    def enter_maintenance_mode(self,wait=True):
-        tk = self.mor.EnterMaintenanceMode_Task(timeout=90)
+    def enter_maintenance_mode(self,wait=True,timeout=90):
+        """timeout (seconds) after which the task fails if the host
+        could not enter maintenance mode, None or 0 waits forever"""
+        tk = self.mor.EnterMaintenanceMode_Task(timeout=timeout or 0)
         if wait:
             tk = self._server.wait_for_task(tk)
             self.update()
@@ -268,7 +403,7 @@ class Host:
         Get all the pnics found for this host
         """
         pnics = []
-        if self.mor.runtime.connectionState != "connected":
+        if self.get_property('runtime.connectionState') != "connected":
             return pnics
 
         config = self.mor.config
@@ -0,0 +1,182 @@
+"""
+Bulk inventory retrieval using the PropertyCollector.
+
+Walking childEntity/host/vm and reading .name on every managed object
+costs one round trip per object. The helpers here create a
+ContainerView over the given container and fetch the requested
+properties of every object of a type with RetrievePropertiesEx, paging
+through the results with ContinueRetrievePropertiesEx.
+
+Each object is returned as a dict with the keys
+    mor    - the managed object
+    moid   - the managed object id string
+    name   - name of the object
+    parent - parent managed object
+and one key per requested property path (e.g. 'runtime.powerState').
+Properties that are not set on the object are returned as None
+"""
+
+from pyVmomi import vim, vmodl
+
+# number of objects returned per page by RetrievePropertiesEx
+PAGE_SIZE = 1000
+
+# properties fetched for every object
+BASE_PROPERTIES = ['name', 'parent']
+
+
+def get_type(type_name):
+    """Return the vim type for the given name. The name can be given
+    with or without the vim. prefix e.g. VirtualMachine, vim.HostSystem,
+    dvs.DistributedVirtualPortgroup"""
+    if not isinstance(type_name, basestring):
+        return type_name
+    if type_name.startswith('vim.'):
+        type_name = type_name[4:]
+    obj = vim
+    for part in type_name.split('.'):
+        obj = getattr(obj, part)
+    return obj
+
+
+def to_dict(obj_content, properties=None):
+    """Convert the ObjectContent returned by the property collector
+    into the inventory dict"""
+    item = {}
+    for prop in BASE_PROPERTIES:
+        item[prop] = None
+    if properties:
+        for prop in properties:
+            item[prop] = None
+    item['mor'] = obj_content.obj
+    item['moid'] = str(obj_content.obj._moId)
+    for prop in obj_content.propSet:
+        item[prop.name] = prop.val
+    return item
+
+
+def retrieve(server_obj, filter_spec, properties=None,
+             page_size=PAGE_SIZE):
+    """Run the filter spec on the property collector and return the
+    list of inventory dicts. The results are paged by page_size"""
+    pc = server_obj.mor.content.propertyCollector
+    options = vmodl.query.PropertyCollector.RetrieveOptions()
+    options.maxObjects = page_size
+    objs = []
+    result = pc.RetrievePropertiesEx(specSet=[filter_spec],
+                                     options=options)
+    while result:
+        for obj_content in result.objects:
+            objs.append(to_dict(obj_content, properties))
+        if not result.token:
+            break
+        result = pc.ContinueRetrievePropertiesEx(token=result.token)
+    return objs
+
+
+def container_filter_spec(view_mor, type_props):
+    """Return the filter spec that selects all the objects of the
+    container view. type_props is a dict of vim type to list of
+    property paths"""
+    pc = vmodl.query.PropertyCollector
+    tspec = pc.TraversalSpec()
+    tspec.name = 'traverseView'
+    tspec.path = 'view'
+    tspec.skip = False
+    tspec.type = vim.view.ContainerView
+
+    ospec = pc.ObjectSpec()
+    ospec.obj = view_mor
+    ospec.skip = True
+    ospec.selectSet = [tspec]
+
+    fspec = pc.FilterSpec()
+    fspec.objectSet = [ospec]
+    fspec.propSet = []
+    for vim_type, props in type_props.items():
+        pspec = pc.PropertySpec()
+        pspec.type = vim_type
+        pspec.all = False
+        pspec.pathSet = list(props)
+        fspec.propSet.append(pspec)
+    return fspec
+
+
+def create_view(server_obj, types, container=None, recursive=True):
+    """Create a container view of the given vim types under the
+    container mor (root folder by default)"""
+    content = server_obj.mor.content
+    if container is None:
+        container = content.rootFolder
+    return content.viewManager.CreateContainerView(container=container,
+                                                   type=types,
+                                                   recursive=recursive)
+
+
+def get_objects(server_obj, type_name, properties=None, container=None,
+                recursive=True, page_size=PAGE_SIZE):
+    """Return the inventory dicts of all the objects of type_name under
+    the container mor (root folder by default). properties is the list
+    of additional property paths to fetch along with name and parent"""
+    if properties is None:
+        properties = []
+    vim_type = get_type(type_name)
+    props = BASE_PROPERTIES + [p for p in properties
+                               if p not in BASE_PROPERTIES]
+    view = create_view(server_obj, [vim_type], container, recursive)
+    try:
+        fspec = container_filter_spec(view, {vim_type: props})
+        objs = retrieve(server_obj, fspec, properties, page_size)
+    finally:
+        view.Destroy()
+    return objs
+
+
+def get_properties(server_obj, mor, properties):
+    """Return a dict of the given property paths of a single managed
+    object in one round trip"""
+    pc = vmodl.query.PropertyCollector
+    ospec = pc.ObjectSpec()
+    ospec.obj = mor
+    ospec.skip = False
+    pspec = pc.PropertySpec()
+    pspec.type = mor.__class__
+    pspec.all = False
+    pspec.pathSet = list(properties)
+    fspec = pc.FilterSpec()
+    fspec.objectSet = [ospec]
+    fspec.propSet = [pspec]
+    objs = retrieve(server_obj, fspec, properties)
+    if not objs:
+        return {}
+    return objs[0]
+
+
+def get_children(server_obj, mor, path, type_name, properties=None,
+                 page_size=PAGE_SIZE):
+    """Return the inventory dicts of the objects referenced by the
+    property path of the mor (e.g. the portgroup property of a dvswitch)
+    in one request"""
+    if properties is None:
+        properties = []
+    pc = vmodl.query.PropertyCollector
+    tspec = pc.TraversalSpec()
+    tspec.name = 'traverseChildren'
+    tspec.path = path
+    tspec.skip = False
+    tspec.type = mor.__class__
+
+    ospec = pc.ObjectSpec()
+    ospec.obj = mor
+    ospec.skip = True
+    ospec.selectSet = [tspec]
+
+    pspec = pc.PropertySpec()
+    pspec.type = get_type(type_name)
+    pspec.all = False
+    pspec.pathSet = BASE_PROPERTIES + [p for p in properties
+                                       if p not in BASE_PROPERTIES]
+    fspec = pc.FilterSpec()
+    fspec.objectSet = [ospec]
+    fspec.propSet = [pspec]
+    return retrieve(server_obj, fspec, properties, page_size)
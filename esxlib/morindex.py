@@ -0,0 +1,157 @@
+"""
+Name and moid lookup index of the inventory.
+
+The index maps (type name, object name) and moid to the managed object
+so that the get_* methods can find objects by name locally instead of
+reading .name of every candidate. It is filled by the initial update of
+a PropertyWatcher (one bulk fetch of all the indexed objects) and kept
+up to date by the background update stream.
+
+A lookup that finds nothing returns None, so the callers fall back to
+scanning the inventory (the object may have been created moments ago
+and the update not received yet).
+"""
+
+import threading
+
+import inventory
+import watcher
+
+# indexed types and the properties kept for each of them. parent is
+# used to answer the container checks locally
+INDEX_PROPERTIES = {
+    'Folder': ['name', 'parent'],
+    'Datacenter': ['name', 'parent'],
+    'ComputeResource': ['name', 'parent'],
+    'HostSystem': ['name', 'parent'],
+    'VirtualMachine': ['name', 'parent', 'runtime.host'],
+    'Datastore': ['name', 'parent'],
+    'Network': ['name', 'parent'],
+    'dvs.DistributedVirtualPortgroup': ['name', 'parent',
+                                        'config.distributedVirtualSwitch'],
+    'DistributedVirtualSwitch': ['name', 'parent'],
+}
+
+# seconds to wait for the initial contents
+READY_TIMEOUT = 300
+
+
+class MorIndex:
+    """Index of the managed objects of a server by name and moid"""
+
+    def __init__(self,server_obj,type_props=None):
+        self._server = server_obj
+        if type_props is None:
+            type_props = INDEX_PROPERTIES
+        self._type_props = type_props
+        self._types = {}
+        for type_name in type_props:
+            self._types[type_name] = inventory.get_type(type_name)
+        self._lock = threading.Lock()
+        # moid -> dict of mor, types and the indexed properties
+        self._objs = {}
+        # (type name, name) -> set of moids
+        self._names = {}
+        self._watcher = None
+
+    def start(self,timeout=READY_TIMEOUT):
+        """Start the update stream and wait for the initial contents.
+        Returns True if the index is ready"""
+        self._watcher = watcher.PropertyWatcher(self._server,
+                                                self._type_props,
+                                                self._on_update)
+        self._watcher.start()
+        self._watcher.ready.wait(timeout)
+        return self.is_ready()
+
+    def stop(self):
+        if self._watcher:
+            self._watcher.stop()
+            self._watcher = None
+        return
+
+    def is_ready(self):
+        """Return True if the index is filled and kept up to date"""
+        return bool(self._watcher and self._watcher.is_ready())
+
+    def _remove_names(self,moid,obj):
+        for type_name in obj['types']:
+            key = (type_name,obj.get('name'))
+            moids = self._names.get(key)
+            if moids:
+                moids.discard(moid)
+                if not moids:
+                    del self._names[key]
+
+    def _on_update(self,kind,mor,changes):
+        moid = str(mor._moId)
+        with self._lock:
+            obj = self._objs.get(moid)
+            if kind == 'leave':
+                if obj:
+                    self._remove_names(moid,obj)
+                    del self._objs[moid]
+                return
+            if not obj:
+                types = [type_name for type_name, vim_type
+                         in self._types.items()
+                         if isinstance(mor,vim_type)]
+                obj = {'mor': mor, 'types': types}
+                self._objs[moid] = obj
+            elif 'name' in changes:
+                self._remove_names(moid,obj)
+            obj.update(changes)
+            if kind == 'enter' or 'name' in changes:
+                for type_name in obj['types']:
+                    key = (type_name,obj.get('name'))
+                    self._names.setdefault(key,set()).add(moid)
+        return
+
+    def get_mor(self,moid):
+        """Return the managed object of the given moid or None"""
+        with self._lock:
+            obj = self._objs.get(str(moid))
+        if obj:
+            return obj['mor']
+        return None
+
+    def get(self,mor,prop):
+        """Return the indexed property of the managed object"""
+        with self._lock:
+            obj = self._objs.get(str(mor._moId),{})
+            return obj.get(prop)
+
+    def in_container(self,mor,container):
+        """Check locally if the managed object is under the container
+        mor. Virtual machines are under a host if they run on it"""
+        cmoid = str(container._moId)
+        with self._lock:
+            obj = self._objs.get(str(mor._moId))
+            if obj and 'runtime.host' in obj and\
+                    container.__class__.__name__ == 'vim.HostSystem':
+                host = obj['runtime.host']
+                return bool(host) and str(host._moId) == cmoid
+            while obj:
+                parent = obj.get('parent')
+                if not parent:
+                    return False
+                if str(parent._moId) == cmoid:
+                    return True
+                obj = self._objs.get(str(parent._moId))
+        return False
+
+    def lookup(self,type_name,name,container=None):
+        """Return the list of managed objects of the type with the given
+        name (under the container mor if given). Returns None if the
+        index is not ready or nothing was found, so that the caller can
+        fall back to a scan"""
+        if not self.is_ready() or type_name not in self._types:
+            return None
+        with self._lock:
+            moids = list(self._names.get((type_name,name),[]))
+            mors = [self._objs[moid]['mor'] for moid in moids]
+        if container is not None:
+            mors = [mor for mor in mors if self.in_container(mor,container)]
+        if not mors:
+            return None
+        return mors
@@ -0,0 +1,191 @@
+"""
+Declarative standard networking of a host.
+
+Creating vswitches and portgroups one networkSystem call at a time costs
+a round trip per change and another one to rescan networkConfig after
+it. A NetworkPlan describes the vswitches and portgroups a host should
+have
+
+    plan = netplan.NetworkPlan()
+    plan.add_vswitch('vSwitch1', num_ports=120, uplinks=['vmnic1'])
+    plan.add_port_group('vlan-10', 'vSwitch1', vlan_id=10)
+    plan.add_port_group('vlan-11', 'vSwitch1', vlan_id=11, promisc=True)
+    plan.apply(host_obj)
+
+and is compared against one read of the host's networkConfig. Only the
+missing or different entries are sent, all of them in one
+UpdateNetworkConfig call with changeMode modify. Entries that exist on
+the host but are not in the plan are left alone.
+"""
+
+import copy
+import workers
+
+
+class NetworkPlan:
+    """Desired vswitches and portgroups of a host"""
+
+    def __init__(self):
+        # name -> settings, in the order they were added
+        self.vswitches = {}
+        self.portgroups = {}
+        self._vswitch_order = []
+        self._portgroup_order = []
+
+    def add_vswitch(self,name,num_ports=120,uplinks=None,promisc=None):
+        """Add a vswitch to the plan. num_ports is the port count
+        without the 8 ports esx reserves for uplinks (see
+        Host.add_vswitch), uplinks is the list of host nic names.
+        promisc None leaves the setting of the host alone"""
+        if name not in self.vswitches:
+            self._vswitch_order.append(name)
+        self.vswitches[name] = {'num_ports': num_ports + 8,
+                                'uplinks': list(uplinks or []),
+                                'promisc': promisc}
+        return
+
+    def add_port_group(self,name,vswitch_name,vlan_id=0,promisc=None):
+        """Add a portgroup on the vswitch to the plan"""
+        if name not in self.portgroups:
+            self._portgroup_order.append(name)
+        self.portgroups[name] = {'vswitch': vswitch_name,
+                                 'vlan_id': vlan_id,
+                                 'promisc': promisc}
+        return
+
+    def _security(self,server_obj,policy,promisc):
+        if promisc is None:
+            return
+        if not policy.security:
+            policy.security = server_obj.new_spec('HostNetworkSecurityPolicy')
+        policy.security.allowPromiscuous = promisc
+        return
+
+    def _get_promisc(self,spec):
+        policy = getattr(spec,'policy',None)
+        security = getattr(policy,'security',None)
+        return getattr(security,'allowPromiscuous',None)
+
+    def _get_uplinks(self,spec):
+        bridge = getattr(spec,'bridge',None)
+        return list(getattr(bridge,'nicDevice',None) or [])
+
+    def _vswitch_spec(self,server_obj,settings,spec=None):
+        """Return the vswitch spec with the settings applied. spec is the
+        current spec of the vswitch, None for a new one"""
+        if spec is None:
+            spec = server_obj.new_spec('HostVirtualSwitchSpec')
+        else:
+            spec = copy.deepcopy(spec)
+        spec.numPorts = settings['num_ports']
+        if not spec.policy:
+            spec.policy = server_obj.new_spec('HostNetworkPolicy')
+        uplinks = settings['uplinks']
+        if uplinks:
+            spec.bridge = server_obj.new_spec('HostVirtualSwitchBondBridge')
+            spec.bridge.nicDevice = uplinks
+            if not spec.policy.nicTeaming:
+                spec.policy.nicTeaming = server_obj.new_spec('HostNicTeamingPolicy')
+            spec.policy.nicTeaming.nicOrder = server_obj.new_spec('HostNicOrderPolicy')
+            spec.policy.nicTeaming.nicOrder.activeNic = uplinks
+        self._security(server_obj,spec.policy,settings['promisc'])
+        return spec
+
+    def _vswitch_changed(self,settings,spec):
+        if spec.numPorts != settings['num_ports']:
+            return True
+        if settings['uplinks'] and \
+                self._get_uplinks(spec) != settings['uplinks']:
+            return True
+        if settings['promisc'] is not None and \
+                self._get_promisc(spec) != settings['promisc']:
+            return True
+        return False
+
+    def _port_group_spec(self,server_obj,name,settings,spec=None):
+        if spec is None:
+            spec = server_obj.new_spec('HostPortGroupSpec')
+            spec.policy = server_obj.new_spec('HostNetworkPolicy')
+        else:
+            spec = copy.deepcopy(spec)
+        spec.name = name
+        spec.vswitchName = settings['vswitch']
+        spec.vlanId = settings['vlan_id']
+        self._security(server_obj,spec.policy,settings['promisc'])
+        return spec
+
+    def _port_group_changed(self,settings,spec):
+        if spec.vswitchName != settings['vswitch']:
+            return True
+        if spec.vlanId != settings['vlan_id']:
+            return True
+        if settings['promisc'] is not None and \
+                self._get_promisc(spec) != settings['promisc']:
+            return True
+        return False
+
+    def diff(self,server_obj,network_config):
+        """Return the HostNetworkConfig with the changes needed to go from
+        network_config (the host's current networkConfig) to the plan, or
+        None if the host already matches it"""
+        config = server_obj.new_spec('HostNetworkConfig')
+        config.vswitch = []
+        config.portgroup = []
+        current = {}
+        for vs in network_config.vswitch or []:
+            current[vs.name] = vs
+        for name in self._vswitch_order:
+            settings = self.vswitches[name]
+            vs_config = server_obj.new_spec('HostVirtualSwitchConfig')
+            vs_config.name = name
+            if name not in current:
+                vs_config.changeOperation = 'add'
+                vs_config.spec = self._vswitch_spec(server_obj,settings)
+            elif self._vswitch_changed(settings,current[name].spec):
+                vs_config.changeOperation = 'edit'
+                vs_config.spec = self._vswitch_spec(server_obj,settings,
+                                                    current[name].spec)
+            else:
+                continue
+            config.vswitch.append(vs_config)
+        current = {}
+        for pg in network_config.portgroup or []:
+            current[pg.spec.name] = pg
+        for name in self._portgroup_order:
+            settings = self.portgroups[name]
+            pg_config = server_obj.new_spec('HostPortGroupConfig')
+            if name not in current:
+                pg_config.changeOperation = 'add'
+                pg_config.spec = self._port_group_spec(server_obj,name,
+                                                       settings)
+            elif self._port_group_changed(settings,current[name].spec):
+                pg_config.changeOperation = 'edit'
+                pg_config.spec = self._port_group_spec(server_obj,name,
+                        settings,current[name].spec)
+            else:
+                continue
+            config.portgroup.append(pg_config)
+        if not config.vswitch and not config.portgroup:
+            return None
+        return config
+
+    def apply(self,host_obj):
+        """Bring the host's standard networking in line with the plan in
+        one UpdateNetworkConfig call. Returns the HostNetworkConfigResult
+        or None if nothing had to change"""
+        network_system = host_obj.mor.configManager.networkSystem
+        config = self.diff(host_obj._server,network_system.networkConfig)
+        if config is None:
+            return None
+        result = network_system.UpdateNetworkConfig(config=config,
+                                                    changeMode='modify')
+        host_obj.update()
+        return result
+
+    def apply_many(self,hosts,max_workers=workers.MAX_WORKERS):
+        """Apply the plan to many host objects, at most max_workers at a
+        time. This is a generator that yields (host_obj, result, error)
+        as each host completes"""
+        for host_obj, result, error in workers.run_parallel(self.apply,
+                hosts,max_workers):
+            yield host_obj, result, error
@@ -0,0 +1,114 @@
+"""
+Adding many hosts to a datacenter or cluster at once.
+
+The thumbprints of all the hosts are fetched concurrently, then the add
+host tasks are started with at most max_parallel of them in flight and
+reaped as they complete. A host that fails with SSLVerifyFault is tried
+once more with a freshly fetched thumbprint. The hosts already in the
+container are skipped and the added ones are looked up with one
+inventory fetch at the end. A host that fails does not stop the others.
+
+The result is a dict with
+    hosts   - name -> host mor of the added and skipped hosts
+    skipped - names of the hosts that were already present
+    error   - name -> error of the hosts that failed
+"""
+
+import thumbprint
+import workers
+
+# add host tasks in flight
+MAX_PARALLEL = 8
+
+
+def _task_error(tk_obj):
+    if tk_obj.timed_out:
+        return "Timed out"
+    return tk_obj.error
+
+
+def _host_spec(server_obj,host,user,password,ssl_thumbprint):
+    host_spec = server_obj.new_spec('HostConnectSpec')
+    host_spec.force = True
+    host_spec.hostName = host
+    host_spec.userName = user
+    host_spec.password = password
+    host_spec.vmFolder = None
+    host_spec.sslThumbprint = ssl_thumbprint
+    return host_spec
+
+
+def _get_hosts(server_obj,container):
+    hosts = {}
+    for obj in server_obj.get_inventory('HostSystem',container=container):
+        hosts[obj['name']] = obj['mor']
+    return hosts
+
+
+def add_hosts(server_obj,container,add_task,hosts,user='root',
+              password='nbv12345',max_parallel=MAX_PARALLEL,
+              max_workers=workers.MAX_WORKERS,timeout=None):
+    """Add the host names to the container mor. add_task(spec) starts
+    the add host task for a HostConnectSpec and returns the task mor.
+    timeout (seconds) applies to each add host task"""
+    result = {'hosts': {}, 'skipped': [], 'error': {}}
+    existing = _get_hosts(server_obj,container)
+    pending = []
+    for host in hosts:
+        if host in existing:
+            result['hosts'][host] = existing[host]
+            result['skipped'].append(host)
+        elif host not in pending:
+            pending.append(host)
+    if not pending:
+        return result
+    thumbprints, errors = thumbprint.get_many(pending,
+                                              max_workers=max_workers)
+    result['error'].update(errors)
+    pending = [host for host in pending if host in thumbprints]
+    added = []
+    # hosts already retried with a fresh thumbprint
+    retried = set()
+    in_flight = {}
+    group = server_obj.task_group(timeout=timeout)
+    try:
+        while pending or in_flight:
+            while pending and len(in_flight) < max_parallel:
+                host = pending.pop(0)
+                spec = _host_spec(server_obj,host,user,password,
+                                  thumbprints[host])
+                try:
+                    tk = add_task(spec)
+                except Exception as e:
+                    result['error'][host] = e
+                    continue
+                in_flight[group.add(tk).get_moid()] = host
+            if not in_flight:
+                continue
+            for tk_obj in group.wait_any():
+                host = in_flight.pop(tk_obj.get_moid())
+                if tk_obj.state == 'success':
+                    added.append(host)
+                    continue
+                if thumbprint.is_verify_fault(tk_obj.error) and\
+                        host not in retried:
+                    retried.add(host)
+                    try:
+                        thumbprints[host] = thumbprint.get(host,
+                                                           refresh=True)
+                    except Exception as e:
+                        result['error'][host] = e
+                        continue
+                    pending.append(host)
+                    continue
+                result['error'][host] = _task_error(tk_obj)
+    finally:
+        group.close()
+    if added:
+        existing = _get_hosts(server_obj,container)
+        for host in added:
+            if host in existing:
+                result['hosts'][host] = existing[host]
+            else:
+                result['error'][host] = "Host not found after adding it"
+    return result
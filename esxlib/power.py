@@ -0,0 +1,183 @@
+"""
+Power operations on many vms at once.
+
+The power state of every vm under a container (host, cluster,
+datacenter) is read in one property fetch and the vms already in the
+target state are skipped. Power on uses one PowerOnMultiVM_Task per
+datacenter, power off and suspend tasks are started concurrently with at
+most max_parallel of them in flight.
+
+The result is a dict with the vm names that were skipped, powered on/off
+successfully and the ones that failed (name -> error). Vms of manual drs
+clusters are not powered on unless override is set, drs only returns
+recommendations for them. Those are listed under recommended (name ->
+list of ClusterRecommendation), they can be applied with
+ApplyRecommendation on the cluster.
+"""
+
+OPERATIONS = {
+    'on': 'poweredOn',
+    'off': 'poweredOff',
+    'suspend': 'suspended',
+}
+
+# power off/suspend tasks in flight
+MAX_PARALLEL = 16
+
+
+def new_result():
+    return {'skipped': [], 'success': [], 'error': {}, 'recommended': {}}
+
+
+def merge_results(result, other):
+    """Merge the other result dict into result"""
+    result['skipped'].extend(other['skipped'])
+    result['success'].extend(other['success'])
+    result['error'].update(other['error'])
+    result['recommended'].update(other['recommended'])
+    return result
+
+
+def _task_error(tk_obj):
+    if tk_obj.timed_out:
+        return "Timed out"
+    return tk_obj.error
+
+
+def _recommended_vm(recommendation, vms):
+    """Return the moid of the vm (one of vms) the drs recommendation
+    powers on, None if it is not for one of them"""
+    targets = [recommendation.target]
+    targets.extend(getattr(action, 'target', None)
+                   for action in recommendation.action or [])
+    for target in targets:
+        if target is not None and str(target._moId) in vms:
+            return str(target._moId)
+    return None
+
+
+def _power_on(server_obj, dc_mor, vms, wait, override, result):
+    """Power on the vms (moid -> (name, mor)) with one
+    PowerOnMultiVM_Task"""
+    options = []
+    if override:
+        # attempt the power on also in clusters with manual drs, instead
+        # of only returning recommendations
+        option = server_obj.new_spec('OptionValue')
+        option.key = 'OverrideAutomationLevel'
+        option.value = True
+        options.append(option)
+    tk = dc_mor.PowerOnMultiVM_Task(vm=[mor for name, mor in vms.values()],
+                                    option=options)
+    if not wait:
+        server_obj.add_task(tk)
+        return result
+    tk_obj = server_obj.wait_for_task(tk)
+    if tk_obj.state != 'success':
+        for name, mor in vms.values():
+            result['error'][name] = _task_error(tk_obj)
+        return result
+    power_result = tk_obj.result()
+    tasks = {}
+    for attempt in power_result.attempted or []:
+        if attempt.task:
+            tasks[str(attempt.task._moId)] = vms[str(attempt.vm._moId)][0]
+    for not_attempted in power_result.notAttempted or []:
+        name = vms[str(not_attempted.vm._moId)][0]
+        result['error'][name] = not_attempted.fault
+    for recommendation in power_result.recommendations or []:
+        moid = _recommended_vm(recommendation, vms)
+        if moid:
+            name = vms[moid][0]
+            result['recommended'].setdefault(name, []).append(
+                recommendation)
+    group = server_obj.task_group(tasks=[attempt.task for attempt
+                                         in power_result.attempted or []
+                                         if attempt.task])
+    try:
+        for tk_obj in group.as_completed():
+            name = tasks[tk_obj.get_moid()]
+            if tk_obj.state == 'success':
+                result['success'].append(name)
+            else:
+                result['error'][name] = _task_error(tk_obj)
+    finally:
+        group.close()
+    return result
+
+
+def _power_off(server_obj, operation, vms, wait, max_parallel, result):
+    """Power off or suspend the vms (moid -> (name, mor)) concurrently"""
+    pending = vms.values()
+    if not wait:
+        for name, mor in pending:
+            if operation == 'off':
+                server_obj.add_task(mor.PowerOffVM_Task())
+            else:
+                server_obj.add_task(mor.SuspendVM_Task())
+        return result
+    in_flight = {}
+    group = server_obj.task_group()
+    try:
+        while pending or in_flight:
+            while pending and len(in_flight) < max_parallel:
+                name, mor = pending.pop(0)
+                try:
+                    if operation == 'off':
+                        tk = mor.PowerOffVM_Task()
+                    else:
+                        tk = mor.SuspendVM_Task()
+                except Exception as e:
+                    result['error'][name] = e
+                    continue
+                in_flight[group.add(tk).get_moid()] = name
+            if not in_flight:
+                continue
+            for tk_obj in group.wait_any():
+                name = in_flight.pop(tk_obj.get_moid())
+                if tk_obj.state == 'success':
+                    result['success'].append(name)
+                else:
+                    result['error'][name] = _task_error(tk_obj)
+    finally:
+        group.close()
+    return result
+
+
+def set_power_state(server_obj, operation, container, dc_mor, names=None,
+                    wait=True, max_parallel=MAX_PARALLEL, override=False):
+    """Power on ('on'), off ('off') or suspend ('suspend') the vms under
+    the container mor of the datacenter dc_mor. If names is given, only
+    the vms with those names are changed. If wait is False, the tasks
+    are added to the server's task list and only the skipped vms are
+    reported. If override is True, power on overrides the drs automation
+    level of manual clusters"""
+    target = OPERATIONS[operation]
+    result = new_result()
+    objs = server_obj.get_inventory('VirtualMachine',
+                                    ['runtime.powerState',
+                                     'config.template'],
+                                    container)
+    if names is not None:
+        names = set(names)
+    vms = {}
+    for obj in objs:
+        if names is not None and obj['name'] not in names:
+            continue
+        if obj['config.template']:
+            continue
+        if obj['runtime.powerState'] == target:
+            result['skipped'].append(obj['name'])
+            continue
+        if operation == 'suspend' and\
+                obj['runtime.powerState'] != 'poweredOn':
+            # only a running vm can be suspended
+            result['skipped'].append(obj['name'])
+            continue
+        vms[obj['moid']] = (obj['name'], obj['mor'])
+    if not vms:
+        return result
+    if operation == 'on':
+        return _power_on(server_obj, dc_mor, vms, wait, override, result)
+    return _power_off(server_obj, operation, vms, wait, max_parallel,
+                      result)
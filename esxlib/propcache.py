@@ -0,0 +1,153 @@
+"""
+Local cache of selected properties of the inventory.
+
+A PropertyWatcher keeps the cache up to date with WaitForUpdatesEx and
+version strings, so reading a cached property (e.g. runtime.powerState
+of a vm) does not need a round trip. The watcher hears from the server
+at least every watcher.MAX_WAIT seconds, even if nothing changed, which
+bounds how stale the cache can be. A read with a max_age shorter than
+the time since the last reply, or of a property that is not cached, is
+fetched from the server. Completing a task marks its entity dirty, so
+reads of that object go to the server until the watcher has heard from
+the server after the task completed. A task without an entity marks
+the whole cache dirty.
+"""
+
+import threading
+import time
+
+import inventory
+import watcher
+
+# cached types and properties
+CACHE_PROPERTIES = {
+    'VirtualMachine': ['name', 'runtime.powerState', 'runtime.host',
+                       'guest.ipAddress', 'config.changeVersion'],
+    'HostSystem': ['name', 'runtime.connectionState',
+                   'runtime.inMaintenanceMode'],
+    'Datastore': ['name', 'summary.accessible', 'summary.freeSpace'],
+    'DistributedVirtualSwitch': ['name', 'config.configVersion'],
+    'dvs.DistributedVirtualPortgroup': ['name', 'config.configVersion'],
+}
+
+# default staleness bound in seconds
+MAX_AGE = 60
+
+# seconds to wait for the initial contents
+READY_TIMEOUT = 300
+
+
+class PropertyCache:
+    """moid to property values cache kept up to date in the background"""
+
+    def __init__(self,server_obj,type_props=None,max_age=MAX_AGE):
+        self._server = server_obj
+        if type_props is None:
+            type_props = CACHE_PROPERTIES
+        self._type_props = type_props
+        self._types = []
+        for type_name, props in type_props.items():
+            self._types.append((inventory.get_type(type_name),props))
+        self._max_age = max_age
+        self._lock = threading.Lock()
+        # moid -> dict of property path to value
+        self._objs = {}
+        self._watcher = None
+        # time the last task without an entity completed, see mark_dirty
+        self._dirty_time = 0
+        # moid -> time the last task on that object completed
+        self._dirty = {}
+
+    def start(self,timeout=READY_TIMEOUT):
+        """Start the update stream and wait for the initial contents.
+        Returns True if the cache is ready"""
+        self._watcher = watcher.PropertyWatcher(self._server,
+                                                self._type_props,
+                                                self._on_update)
+        self._watcher.start()
+        self._watcher.ready.wait(timeout)
+        return self.is_ready()
+
+    def stop(self):
+        if self._watcher:
+            self._watcher.stop()
+            self._watcher = None
+        return
+
+    def is_ready(self):
+        return bool(self._watcher and self._watcher.is_ready())
+
+    def _on_update(self,kind,mor,changes):
+        moid = str(mor._moId)
+        with self._lock:
+            if kind == 'leave':
+                self._objs.pop(moid,None)
+                return
+            self._objs.setdefault(moid,{}).update(changes)
+        return
+
+    def _tracked(self,mor):
+        """Return the cached property paths of the mor's type"""
+        paths = []
+        for vim_type, props in self._types:
+            if isinstance(mor,vim_type):
+                paths.extend(props)
+        return paths
+
+    def mark_dirty(self,mor=None):
+        """Called when a task on the mor completes. The cached properties
+        of the mor (of all the objects if mor is None) are not used until
+        the watcher has received the changes made by the task"""
+        now = time.time()
+        with self._lock:
+            if mor is None:
+                self._dirty_time = now
+                self._dirty = {}
+            else:
+                self._dirty[str(mor._moId)] = now
+        return
+
+    def _is_dirty(self,moid,last_sync):
+        """Return True if a task on the moid completed after the last
+        reply of the watcher, called with the lock held"""
+        dirty_time = self._dirty.get(moid)
+        if dirty_time is None:
+            return False
+        if dirty_time < last_sync:
+            # the watcher has caught up
+            del self._dirty[moid]
+            return False
+        return True
+
+    def is_fresh(self,max_age=None):
+        """Return True if the cache is within the staleness bound"""
+        if max_age is None:
+            max_age = self._max_age
+        if not self.is_ready():
+            return False
+        last_sync = self._watcher.last_sync
+        if last_sync is None or last_sync <= self._dirty_time:
+            return False
+        return time.time() - last_sync <= max_age
+
+    def get(self,mor,prop,max_age=None):
+        """Return the property of the mor from the cache if it is cached
+        and fresh, otherwise fetch it from the server"""
+        if prop in self._tracked(mor) and self.is_fresh(max_age):
+            moid = str(mor._moId)
+            with self._lock:
+                obj = self._objs.get(moid)
+                if obj is not None and\
+                        not self._is_dirty(moid,self._watcher.last_sync):
+                    return obj.get(prop)
+        return inventory.get_properties(self._server,mor,[prop]).get(prop)
+
+    def refresh(self,mor=None):
+        """Called by the update methods of the esxlib objects. The
+        watcher keeps the cached properties current, so there is nothing
+        to fetch. If the watcher stopped because of an error (e.g. the
+        session expired), a new one is started"""
+        if self._watcher and self._watcher.error:
+            self._objs = {}
+            self.start(timeout=0)
+        return
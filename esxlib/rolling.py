@@ -0,0 +1,231 @@
+"""
+Rolling maintenance of the hosts of a cluster.
+
+The hosts are taken through maintenance a batch at a time:
+    1. the powered on vms of the batch are migrated to the other
+       available hosts, at most max_migrations at a time
+    2. the batch enters maintenance mode
+    3. the callback is run on every host of the batch concurrently
+       (e.g. patch steps with Host.shell_cmd)
+    4. the batch exits maintenance mode
+The batch size is parallel, reduced so that at least min_available
+hosts stay connected and out of maintenance mode.
+
+Progress is kept in a dict with the host names that are done, the ones
+that failed (name -> error string) and the batch in progress. If a
+state file is given, the dict is saved to it after every step and
+loaded from it on start, so a run that stopped on a failure resumes
+with the hosts not yet done. A host whose callback failed is left in
+maintenance mode, the hosts that failed are tried again on resume.
+"""
+
+import os
+import pickle
+
+import hostsystem
+import workers
+
+# vm migrations in flight
+MAX_MIGRATIONS = 8
+
+
+class RollingMaintenance:
+    """Take the hosts of a cluster through maintenance mode in batches"""
+
+    def __init__(self,cluster_obj,callback=None,parallel=1,min_available=1,
+            evacuate=True,state_file=None,timeout=None,
+            max_migrations=MAX_MIGRATIONS):
+        """callback(host_obj) is run while the host is in maintenance
+        mode, an exception marks the host failed. timeout (seconds) is
+        passed to the enter and exit maintenance mode tasks"""
+        self._cluster = cluster_obj
+        self._server = cluster_obj._server
+        self._callback = callback
+        self._parallel = parallel
+        self._min_available = min_available
+        self._evacuate = evacuate
+        self._state_file = state_file
+        self._timeout = timeout
+        self._max_migrations = max_migrations
+        self.state = {'done': [], 'failed': {}, 'in_progress': []}
+        if state_file and os.path.exists(state_file):
+            self.load()
+            # the failed hosts are finished first, they may still be in
+            # maintenance mode
+            for name in self.state['failed']:
+                if name not in self.state['in_progress']:
+                    self.state['in_progress'].append(name)
+            self.state['failed'] = {}
+
+    def save(self):
+        """Save the progress to the state file"""
+        if not self._state_file:
+            return
+        fd = open(self._state_file,"wb")
+        pickle.dump(self.state,fd)
+        fd.close()
+        return
+
+    def load(self):
+        """Load the progress from the state file"""
+        fd = open(self._state_file,"rb")
+        self.state = pickle.load(fd)
+        fd.close()
+        return
+
+    def _get_hosts(self):
+        """Hosts of the cluster with their state, in one fetch"""
+        return self._server.get_inventory('HostSystem',
+                ['runtime.connectionState','runtime.inMaintenanceMode'],
+                self._cluster.mor)
+
+    def _is_available(self,host):
+        return host['runtime.connectionState'] == 'connected' and \
+            not host['runtime.inMaintenanceMode']
+
+    def _next_batch(self,hosts):
+        """Return the hosts to take into maintenance next. A batch left
+        in progress by an earlier run is finished first"""
+        todo = [h for h in hosts if h['name'] not in self.state['done']
+                and h['name'] not in self.state['failed']]
+        in_progress = [h for h in todo
+                       if h['name'] in self.state['in_progress']]
+        if in_progress:
+            return in_progress
+        available = [h for h in hosts if self._is_available(h)]
+        size = min(self._parallel,len(available) - self._min_available)
+        return [h for h in todo if self._is_available(h)][:max(size,0)]
+
+    def _fail(self,name,error):
+        self.state['failed'][name] = str(error)
+        if name in self.state['in_progress']:
+            self.state['in_progress'].remove(name)
+        return
+
+    def _task_error(self,tk_obj):
+        if tk_obj.timed_out:
+            return "Timed out"
+        return tk_obj.error
+
+    def _wait(self,tasks):
+        """Wait for the {task object: host name} tasks and mark the hosts
+        of the failed ones"""
+        if not tasks:
+            return
+        for tk_obj in self._server.wait_for_tasks(tasks.keys()):
+            if tk_obj.state != 'success':
+                self._fail(tasks[tk_obj],self._task_error(tk_obj))
+        return
+
+    def _migrate(self,batch,hosts):
+        """Move the powered on vms of the batch to the available hosts
+        outside the batch, spread round robin"""
+        names = set([h['name'] for h in batch])
+        targets = [h['mor'] for h in hosts
+                   if self._is_available(h) and h['name'] not in names]
+        if not targets:
+            return
+        batch_moids = dict([(h['moid'],h['name']) for h in batch])
+        vms = []
+        for vm in self._server.get_inventory('VirtualMachine',
+                ['runtime.powerState','runtime.host'],self._cluster.mor):
+            if vm['runtime.powerState'] != 'poweredOn' or \
+                    not vm['runtime.host']:
+                continue
+            moid = str(vm['runtime.host']._moId)
+            if moid in batch_moids:
+                vms.append((vm,batch_moids[moid]))
+        in_flight = {}
+        group = self._server.task_group()
+        try:
+            while vms or in_flight:
+                while vms and len(in_flight) < self._max_migrations:
+                    vm, host_name = vms.pop(0)
+                    target = targets[len(vms) % len(targets)]
+                    try:
+                        tk = vm['mor'].MigrateVM_Task(host=target,
+                                priority='defaultPriority')
+                    except Exception as e:
+                        print "Failed to migrate %s: %s" % (vm['name'],e)
+                        continue
+                    in_flight[group.add(tk).get_moid()] = vm['name']
+                if not in_flight:
+                    continue
+                for tk_obj in group.wait_any():
+                    name = in_flight.pop(tk_obj.get_moid())
+                    if tk_obj.state != 'success':
+                        # entering maintenance mode moves or fails on
+                        # the vms still left on the host
+                        print "Failed to migrate %s: %s" % (name,
+                                self._task_error(tk_obj))
+        finally:
+            group.close()
+        return
+
+    def _run_callback(self,host_objs):
+        if not self._callback:
+            return
+        for host_obj, result, error in workers.run_parallel(self._callback,
+                host_objs,len(host_objs)):
+            if error:
+                self._fail(host_obj.mor.name,error)
+        return
+
+    def _run_batch(self,batch,hosts):
+        self.state['in_progress'] = [h['name'] for h in batch]
+        self.save()
+        host_objs = {}
+        for h in batch:
+            host_objs[h['name']] = hostsystem.Host(self._server,
+                    self._cluster._datacenter,h['mor'])
+        if self._evacuate:
+            self._migrate(batch,hosts)
+        tasks = {}
+        for h in batch:
+            if h['runtime.inMaintenanceMode']:
+                continue
+            tk = host_objs[h['name']].enter_maintenance_mode(wait=False,
+                    timeout=self._timeout)
+            tasks[tk] = h['name']
+        self._wait(tasks)
+        self.save()
+        self._run_callback([host_objs[name]
+                            for name in self.state['in_progress']])
+        self.save()
+        tasks = {}
+        for name in self.state['in_progress']:
+            tk = host_objs[name].exit_maintenance_mode(wait=False,
+                    timeout=self._timeout)
+            tasks[tk] = name
+        self._wait(tasks)
+        for name in self.state['in_progress']:
+            self.state['done'].append(name)
+        self.state['in_progress'] = []
+        self.save()
+        return
+
+    def progress(self):
+        """Return the names of the hosts done, failed, in progress and
+        pending"""
+        names = [h['name'] for h in self._get_hosts()]
+        pending = [n for n in names if n not in self.state['done'] and
+                   n not in self.state['failed'] and
+                   n not in self.state['in_progress']]
+        return {'done': list(self.state['done']),
+                'failed': dict(self.state['failed']),
+                'in_progress': list(self.state['in_progress']),
+                'pending': pending}
+
+    def run(self):
+        """Run the batches till all the hosts are done. Stops at the
+        first batch with a failed host or when no batch can be formed
+        without going below min_available. Returns the progress dict"""
+        while True:
+            hosts = self._get_hosts()
+            batch = self._next_batch(hosts)
+            if not batch:
+                break
+            self._run_batch(batch,hosts)
+            if self.state['failed']:
+                break
+        return self.progress()
@@ -5,7 +5,14 @@ from pyVmomi import vim
 import fix_ssl_error
 
 import datacenter
+import dsindex
+import inventory
+import morindex
+import power
+import propcache
 import task
+import taskgroup
+import taskwaiter
 
 
 class Server:
@@ -22,6 +29,15 @@ class Server:
         self._connect()
         # list of all the background tasks (async tasks)
         self._task_list = []
+        # datastore to vmx paths index used by register_vm lookups
+        self.ds_index = dsindex.DatastoreIndex()
+        # name/moid to mor index, see enable_index
+        self.index = None
+        # local property cache, see enable_cache
+        self.cache = None
+        # portgroup moid -> last reconfigure task object, shared by all
+        # the Portgroup objects of the same portgroup
+        self.pg_tasks = {}
 
         # licenses
         self._licenses = {}
@@ -78,16 +94,102 @@ class Server:
         """Return all the datacenter objects as a list or a datacenter
         object of the given name"""
         objs = []
-        dclist = self.mor.content.rootFolder.childEntity
-        for dc in dclist:
-            if not name or name == dc.name:
-                objs.append(datacenter.Datacenter(self,dc))
-                if name and name == dc.name:
-                    break
+        for dc in self.find_mor('Datacenter',name):
+            objs.append(datacenter.Datacenter(self,dc))
         if name and len(objs):
             objs = objs[0]
         return objs
 
+    def power_vms(self,operation,names=None,wait=True,
+            max_parallel=power.MAX_PARALLEL,override=False):
+        """Power on, off or suspend the vms of every datacenter, one
+        batch per datacenter. See Host.power_vms"""
+        result = power.new_result()
+        for dc in self.get_datacenter():
+            power.merge_results(result,dc.power_vms(operation,names,wait,
+                                                    max_parallel,override))
+        return result
+
+    def get_inventory(self,type_name,properties=None,container=None,
+            recursive=True):
+        """Return the name, moid, parent and the given properties of all
+        the objects of type_name (e.g. VirtualMachine, HostSystem) under
+        the container mor (root folder by default) in one paged property
+        collector request. Each object is returned as a dict, see the
+        inventory module"""
+        return inventory.get_objects(self,type_name,properties,
+                                     container,recursive)
+
+    def find_mor(self,type_name,name=None,container=None):
+        """Return the list of mors of type_name under the container
+        (root folder by default). If name is given, only the mors with
+        that name are returned"""
+        if name:
+            mors = self.lookup_mor(type_name,name,container)
+            if mors is not None:
+                return mors
+        mors = []
+        for obj in self.get_inventory(type_name,container=container):
+            if not name or name == obj['name']:
+                mors.append(obj['mor'])
+        return mors
+
+    def enable_index(self,type_props=None,timeout=morindex.READY_TIMEOUT):
+        """Build the name/moid index of the inventory and keep it up to
+        date in the background. Named lookups of the get_* methods are
+        then answered locally. Returns True if the index is ready"""
+        self.disable_index()
+        self.index = morindex.MorIndex(self,type_props)
+        return self.index.start(timeout)
+
+    def disable_index(self):
+        """Stop the name/moid index, lookups go back to scanning"""
+        if self.index:
+            self.index.stop()
+            self.index = None
+        return
+
+    def lookup_mor(self,type_name,name,container=None):
+        """Return the list of mors of type_name with the given name (under
+        the container mor if given) from the index. Returns None if the
+        index is not enabled, not ready or does not know the name, the
+        caller should then scan the inventory"""
+        if not self.index:
+            return None
+        return self.index.lookup(type_name,name,container)
+
+    def get_mor(self,moid):
+        """Return the mor of the given moid from the index or None"""
+        if not self.index or not self.index.is_ready():
+            return None
+        return self.index.get_mor(moid)
+
+    def enable_cache(self,type_props=None,max_age=propcache.MAX_AGE,
+            timeout=propcache.READY_TIMEOUT):
+        """Keep a local cache of the properties of the inventory
+        (propcache.CACHE_PROPERTIES by default) up to date in the
+        background. get_property and the update methods of the esxlib
+        objects are then served from the cache as long as it is not
+        older than max_age seconds. Returns True if the cache is ready"""
+        self.disable_cache()
+        self.cache = propcache.PropertyCache(self,type_props,max_age)
+        return self.cache.start(timeout)
+
+    def disable_cache(self):
+        """Stop the property cache, reads go back to the server"""
+        if self.cache:
+            self.cache.stop()
+            self.cache = None
+        return
+
+    def get_property(self,mor,prop,max_age=None):
+        """Return the property path (e.g. runtime.powerState) of the mor.
+        It is served from the property cache if enabled and fresh,
+        otherwise only that property is fetched from the server"""
+        if self.cache:
+            return self.cache.get(mor,prop,max_age)
+        return inventory.get_properties(self,mor,[prop]).get(prop)
+
     def new_spec(self,spec_name):
         """Create a new spec or data type of the given name"""
         fn = getattr(vim, spec_name)
@@ -103,19 +205,70 @@ class Server:
         self._task_list.append(tk_obj)
         return tk_obj
 
-    def wait_for_task(self,task_mor):
+    def _get_task_obj(self,tk):
+        """Return the task object for the given task mor or object"""
+        if isinstance(tk,task.Task):
+            return tk
+        return task.Task(self,tk)
+
+    def wait_for_tasks(self,tasks,timeout=None,wait_any=False):
+        """Wait for the given tasks (task mors or task objects) to
+        complete. All the tasks are watched by one property collector
+        filter, so every task is picked up as soon as it finishes.
+        timeout (seconds) applies to each task, the tasks that do not
+        complete in time are returned with timed_out set. If wait_any is
+        True, return as soon as any task completes. Returns the list of
+        completed task objects"""
+        tk_objs = [self._get_task_obj(tk) for tk in tasks]
+        waiter = taskwaiter.TaskWaiter(self)
+        try:
+            waiter.add(tk_objs,timeout)
+            if wait_any:
+                done = waiter.wait_any()
+            else:
+                done = waiter.wait_all()
+        finally:
+            waiter.close()
+        return done
+
+    def wait_for_task(self,task_mor,timeout=None):
         """Wait for the give task to complete"""
-        tk_obj = task.Task(self,task_mor)
-        tk_obj.wait()
+        tk_obj = self._get_task_obj(task_mor)
+        self.wait_for_tasks([tk_obj],timeout=timeout)
         return tk_obj
 
-    def wait_for_all_tasks(self):
-        """Wait for all the tasks added to this object to finish"""
-        for tk_obj in self._task_list:
-            tk_obj.wait()
+    def task_group(self,tasks=None,on_success=None,on_error=None,
+            timeout=None):
+        """Return a task group tracking the given tasks. Use its
+        as_completed to get the tasks in the order they finish and wait
+        to get the summary. on_success and on_error are called with each
+        task object as it completes"""
+        return taskgroup.TaskGroup(self,tasks,on_success,on_error,timeout)
+
+    def as_completed(self,tasks,timeout=None):
+        """Generator that yields the given tasks as they complete"""
+        group = self.task_group(tasks)
+        try:
+            for tk_obj in group.as_completed(timeout):
+                yield tk_obj
+        finally:
+            group.close()
 
+    def wait_for_all_tasks(self,timeout=None,on_success=None,
+            on_error=None):
+        """Wait for all the tasks added to this object to finish. The
+        tasks are reaped as they complete, on_success and on_error are
+        called for each of them. Returns the summary of the task group
+        (success, error, vanished, pending task objects and
+        durations)"""
+        group = self.task_group(self._task_list,on_success,on_error,
+                                timeout)
+        try:
+            summary = group.wait()
+        finally:
+            group.close()
         self._task_list = []
-        return
+        return summary
 
 
     def change_fqdn(self, fqdn):
@@ -1,12 +1,35 @@
-#import paramiko
+import paramiko
 import re
+import select
+import socket
+import time
+
+import sshpool
+
+# bytes of stdout and of stderr kept by Client.run
+MAX_OUTPUT = 1024*1024
+
+# bytes read from the channel at a time
+CHUNK_SIZE = 32768
+
+
+def session(host,user,password,timeout=None):
+    """Check out a pooled client of (host, user) for a with block, see
+    sshpool. Read the command output inside the block. timeout (seconds)
+    bounds the wait for a free session and the connect of a new one"""
+    return sshpool.get_pool('ssh').session((host, user),
+            lambda: Client(host,user,password,timeout),timeout)
+
 
 class Client:
     
-    def __init__(self,host,user,password):
+    def __init__(self,host,user,password,timeout=None):
+        """timeout (seconds) applies to the tcp connect, the ssh banner
+        and the authentication"""
         self._host = host
         self._user = user
         self._password = password
+        self._timeout = timeout
         self._client = None
         self._connect()
 
@@ -15,6 +38,58 @@ class Client:
         stdin,stdout,stderr = self._client.exec_command(cmd)
         return (stdout,stderr)
 
+    def run(self,cmd,timeout=None,max_output=MAX_OUTPUT):
+        """Run cmd and return (exit status, stdout, stderr). Only the
+        first max_output bytes of stdout and of stderr are kept, the rest
+        is read and dropped. Raises socket.timeout if the command does
+        not complete within timeout seconds"""
+        chan = self._client.get_transport().open_session()
+        chan.exec_command(cmd)
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        out = []
+        err = []
+        sizes = [0, 0]
+        try:
+            while True:
+                while chan.recv_ready():
+                    self._keep(out,sizes,0,chan.recv(CHUNK_SIZE),max_output)
+                    self._check_deadline(cmd,deadline)
+                while chan.recv_stderr_ready():
+                    self._keep(err,sizes,1,chan.recv_stderr(CHUNK_SIZE),
+                               max_output)
+                    self._check_deadline(cmd,deadline)
+                if chan.exit_status_ready() and not chan.recv_ready() and\
+                        not chan.recv_stderr_ready():
+                    break
+                wait = 1
+                if deadline is not None:
+                    wait = min(self._check_deadline(cmd,deadline),1)
+                select.select([chan],[],[],wait)
+            status = chan.recv_exit_status()
+        finally:
+            chan.close()
+        return (status, "".join(out), "".join(err))
+
+    def _check_deadline(self,cmd,deadline):
+        """Raise socket.timeout if the deadline has passed, otherwise
+        return the seconds left (None without a deadline)"""
+        if deadline is None:
+            return None
+        left = deadline - time.time()
+        if left <= 0:
+            raise socket.timeout("%s timed out on %s" % (cmd,self._host))
+        return left
+
+    def _keep(self,buf,sizes,idx,data,max_output):
+        """Append data to buf without going past max_output bytes"""
+        room = max_output - sizes[idx]
+        if room > 0:
+            buf.append(data[:room])
+            sizes[idx] += len(buf[-1])
+        return
+
     def get_ssl_thumbprint(self):
         cmd = "openssl x509 -in /etc/vmware/ssl/rui.crt \
                 -fingerprint -sha1 -noout"
@@ -28,11 +103,26 @@ class Client:
         cl = paramiko.SSHClient()
         cl.load_system_host_keys()
         cl.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        cl.connect(self._host,username=self._user,
-            password=self._password)
+        timeouts = {}
+        if self._timeout is not None:
+            timeouts = {'timeout': self._timeout,
+                        'banner_timeout': self._timeout,
+                        'auth_timeout': self._timeout}
+        try:
+            cl.connect(self._host,username=self._user,
+                password=self._password,**timeouts)
+        except:
+            # do not leave the socket of a half open connection behind
+            cl.close()
+            raise
         self._client = cl
         return
 
+    def is_alive(self):
+        """Return True if the ssh transport is still connected"""
+        transport = self._client.get_transport()
+        return bool(transport and transport.is_active())
+
     def close(self):
         self._client.close()
 
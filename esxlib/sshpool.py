@@ -0,0 +1,179 @@
+"""
+Process wide pool of ssh sessions.
+
+Host objects are created anew by every get_host call, so a session kept
+on the object is lost and the next command pays the connect and login
+again. The pool keeps the sessions per key (host, user) across objects
+and threads
+
+    pool = sshpool.get_pool('ssh')
+    with pool.session((host, user), lambda: ssh.Client(host,user,pw)) as s:
+        s.execute(cmd)
+
+A session is handed to one thread at a time. At most max_per_key
+sessions are open per key, checkout waits for one to be returned when
+all of them are in use. Idle sessions are closed after idle_timeout and
+are checked with their is_alive() before being handed out. A factory
+that raises frees its slot again, it has to close whatever it opened
+itself. A session only needs is_alive() and close() methods.
+"""
+
+import contextlib
+import threading
+import time
+
+# open sessions per (host, user)
+MAX_PER_KEY = 4
+
+# seconds after which an unused session is closed
+IDLE_TIMEOUT = 300
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _close(session):
+    try:
+        session.close()
+    except Exception:
+        pass
+
+
+def _is_alive(session):
+    try:
+        return session.is_alive()
+    except Exception:
+        return False
+
+
+class SessionPool:
+    """Sessions keyed by (host, user)"""
+
+    def __init__(self,max_per_key=MAX_PER_KEY,idle_timeout=IDLE_TIMEOUT):
+        self._max_per_key = max_per_key
+        self._idle_timeout = idle_timeout
+        self._cond = threading.Condition()
+        # key -> list of (session, time returned), most recent last
+        self._idle = {}
+        # key -> number of open sessions, idle or checked out
+        self._open = {}
+
+    def _expire(self):
+        """Drop the idle sessions past the idle timeout. Returns the
+        sessions to close, called with the lock held"""
+        expired = []
+        now = time.time()
+        for key, idle in self._idle.items():
+            keep = []
+            for session, last_used in idle:
+                if now - last_used > self._idle_timeout:
+                    expired.append(session)
+                    self._open[key] -= 1
+                else:
+                    keep.append((session, last_used))
+            self._idle[key] = keep
+        return expired
+
+    def checkout(self,key,factory,timeout=None):
+        """Return a live session of the key, creating one with factory()
+        if none is idle. Blocks till a session is returned if
+        max_per_key sessions are open, raises RuntimeError if none is
+        available within the timeout (seconds)"""
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        while True:
+            session = None
+            with self._cond:
+                expired = self._expire()
+                while True:
+                    idle = self._idle.get(key)
+                    if idle:
+                        session = idle.pop()[0]
+                        break
+                    if self._open.get(key,0) < self._max_per_key:
+                        # reserve the slot, the connect happens unlocked
+                        self._open[key] = self._open.get(key,0) + 1
+                        break
+                    remaining = None
+                    if deadline is not None:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            raise RuntimeError("No ssh session to %s@%s "
+                                               "available" % (key[1],key[0]))
+                    self._cond.wait(remaining)
+            for s in expired:
+                _close(s)
+            if session is None:
+                try:
+                    return factory()
+                except:
+                    self._release(key)
+                    raise
+            if _is_alive(session):
+                return session
+            # dead session, drop it and try again
+            _close(session)
+            self._release(key)
+
+    def _release(self,key):
+        with self._cond:
+            self._open[key] -= 1
+            self._cond.notify()
+        return
+
+    def checkin(self,key,session,broken=False):
+        """Return the session to the pool. A broken session is closed"""
+        if broken:
+            _close(session)
+            self._release(key)
+            return
+        with self._cond:
+            self._idle.setdefault(key,[]).append((session, time.time()))
+            self._cond.notify()
+        return
+
+    @contextlib.contextmanager
+    def session(self,key,factory,timeout=None):
+        """Check out a session for the with block. The session is closed
+        instead of returned if the block raises"""
+        session = self.checkout(key,factory,timeout)
+        try:
+            yield session
+        except:
+            self.checkin(key,session,broken=True)
+            raise
+        self.checkin(key,session)
+
+    def close(self,key=None):
+        """Close the idle sessions of the key or of all the keys. Checked
+        out sessions are closed when they are returned broken or expire"""
+        with self._cond:
+            if key is None:
+                keys = self._idle.keys()
+            else:
+                keys = [key]
+            sessions = []
+            for k in keys:
+                for session, last_used in self._idle.pop(k,[]):
+                    sessions.append(session)
+                    self._open[k] -= 1
+            self._cond.notify_all()
+        for session in sessions:
+            _close(session)
+        return
+
+    def stats(self):
+        """Return a dict of key to (open sessions, idle sessions)"""
+        with self._cond:
+            return dict([(key, (count, len(self._idle.get(key,[]))))
+                         for key, count in self._open.items() if count])
+
+
+def get_pool(name):
+    """Return the process wide pool of the given name, e.g. ssh
+    for ssh.Client sessions and expect for expect.SSH sessions"""
+    with _pools_lock:
+        if name not in _pools:
+            _pools[name] = SessionPool()
+        return _pools[name]
@@ -6,22 +6,51 @@ class Task:
     def __init__(self,server_obj,task_mor=None):
         self._server = server_obj
         self.mor = task_mor
+        # filled in by the task waiter as the task progresses
+        self.state = None
+        self.error = None
+        self.timed_out = False
+        self.start_time = time.time()
+        self.end_time = None
+        # info.startTime and info.completeTime reported by the server
+        self.started = None
+        self.completed = None
+        # info.entity, the object the task operates on
+        self.entity = None
+        # called with the task object once the task completes
+        self._callbacks = []
 
-    def wait(self,state=None):
-        while True:
-            try:
-                if self.mor.info.state == "success" or\
-                        self.mor.info.state == "error":
-                    break
-            except:
-                # the taks might have already been deleted from the
-                # system, assume it has completed
-                print "The task probably completed, could not find "+\
-                    "it on the server"
-                break
-            else:
-                time.sleep(2)
-                continue
+    def get_moid(self, stringify=True):
+        moid = self.mor._moId
+        if stringify:
+            moid = str(moid)
+        return moid
+
+    def wait(self,state=None,timeout=None):
+        """Wait for the task to complete. If timeout (seconds) is given
+        and the task does not complete in time, timed_out is set"""
+        self._server.wait_for_tasks([self],timeout=timeout)
+        return
+
+    def duration(self):
+        """Seconds the task ran on the server, None if the start or the
+        completion time is not known"""
+        if self.started is None or self.completed is None:
+            return None
+        delta = self.completed - self.started
+        return delta.days * 86400 + delta.seconds +\
+            delta.microseconds / 1000000.0
+
+    def add_callback(self,func):
+        """Call func(task object) when the task is seen completing, by
+        any wait on it (wait_for_task, wait_for_all_tasks, task groups)"""
+        self._callbacks.append(func)
+        return
+
+    def run_callbacks(self):
+        callbacks, self._callbacks = self._callbacks, []
+        for func in callbacks:
+            func(self)
         return
 
     def __str__(self):
@@ -35,4 +64,3 @@ class Task:
 
     def update(self):
         updatemor.update(self)
-
@@ -0,0 +1,111 @@
+import taskwaiter
+
+
+class TaskGroup:
+    """Track many tasks at once and reap them in the order they
+    complete. Optional callbacks are run for each successful and each
+    failed (or timed out) task. Tasks that disappear from the server
+    before their final state is seen are kept apart as vanished and do
+    not run any callback"""
+
+    def __init__(self,server_obj,tasks=None,on_success=None,on_error=None,
+            timeout=None):
+        """timeout (seconds) is applied to every task added to the
+        group unless add is called with its own timeout"""
+        self._server = server_obj
+        self._waiter = taskwaiter.TaskWaiter(server_obj)
+        self._on_success = on_success
+        self._on_error = on_error
+        self._timeout = timeout
+        self._tasks = []
+        self.succeeded = []
+        self.failed = []
+        self.vanished = []
+        if tasks:
+            # register all the initial tasks in one filter
+            tk_objs = [self._server._get_task_obj(tk) for tk in tasks]
+            self._waiter.add(tk_objs,timeout)
+            self._tasks.extend(tk_objs)
+
+    def __len__(self):
+        """Number of tasks not yet reaped"""
+        return len(self._waiter)
+
+    def add(self,tk,timeout=None):
+        """Add a task mor or task object to the group. Tasks can be
+        added while iterating over as_completed. Returns the task
+        object"""
+        tk_obj = self._server._get_task_obj(tk)
+        if timeout is None:
+            timeout = self._timeout
+        self._waiter.add([tk_obj],timeout)
+        self._tasks.append(tk_obj)
+        return tk_obj
+
+    def _reap(self,tk_obj):
+        if tk_obj.state not in taskwaiter.FINAL_STATES and \
+                not tk_obj.timed_out:
+            # deleted from the server, the outcome is unknown
+            self.vanished.append(tk_obj)
+            return
+        if tk_obj.state == 'success':
+            self.succeeded.append(tk_obj)
+            if self._on_success:
+                self._on_success(tk_obj)
+        else:
+            self.failed.append(tk_obj)
+            if self._on_error:
+                self._on_error(tk_obj)
+        return
+
+    def wait_any(self,timeout=None):
+        """Block till at least one task of the group completes, run the
+        callbacks and return the list of completed task objects. Returns
+        an empty list if nothing completed within the timeout"""
+        done = self._waiter.wait_any(timeout)
+        for tk_obj in done:
+            self._reap(tk_obj)
+        return done
+
+    def as_completed(self,timeout=None):
+        """Generator that yields the task objects as they complete. If
+        timeout (seconds) is given, stop when no task completes within
+        that time"""
+        while len(self._waiter):
+            done = self.wait_any(timeout)
+            if not done:
+                break
+            for tk_obj in done:
+                yield tk_obj
+
+    def wait(self,timeout=None):
+        """Wait for all the tasks of the group and return the summary"""
+        for tk_obj in self.as_completed(timeout):
+            pass
+        return self.summary()
+
+    def summary(self):
+        """Return a dict with the successful, failed, vanished and
+        pending task objects and the duration in seconds of each
+        completed task keyed by the task moid. The durations are taken
+        from info.startTime and info.completeTime of the server, tasks
+        without both (timed out, vanished) have none. Vanished tasks were
+        removed from the server before they were seen completing, they
+        are neither counted as successful nor as failed"""
+        reaped = self.succeeded + self.failed + self.vanished
+        durations = {}
+        for tk_obj in reaped:
+            duration = tk_obj.duration()
+            if duration is not None:
+                durations[tk_obj.get_moid()] = duration
+        pending = [tk_obj for tk_obj in self._tasks
+                   if tk_obj not in reaped]
+        return {'success': list(self.succeeded),
+                'error': list(self.failed),
+                'vanished': list(self.vanished),
+                'pending': pending,
+                'durations': durations}
+
+    def close(self):
+        """Release the property collector used to watch the tasks"""
+        self._waiter.close()
@@ -0,0 +1,207 @@
+"""
+Event driven task completion using the PropertyCollector.
+
+Instead of reading info.state of every task every 2 seconds, the tasks
+are registered in one filter on a private property collector and the
+waiter blocks in WaitForUpdatesEx. The server returns as soon as any of
+the registered tasks changes its state, so one call wakes up every task
+that finished in the meantime.
+"""
+
+import math
+import time
+
+from pyVmomi import vim, vmodl
+
+# states in which a task is considered complete
+FINAL_STATES = ['success', 'error']
+
+# upper bound for each WaitForUpdatesEx call in seconds
+MAX_WAIT = 60
+
+
+class TaskWaiter:
+    """Wait for a set of task objects to complete"""
+
+    def __init__(self,server_obj,max_wait=MAX_WAIT):
+        self._server = server_obj
+        self._max_wait = max_wait
+        self._collector = None
+        self._version = ''
+        # moid -> task object of the tasks not yet completed
+        self._pending = {}
+        # moid -> time by which the task has to complete
+        self._deadlines = {}
+        # completed tasks not yet returned by wait_any
+        self._done = []
+
+    def __len__(self):
+        return len(self._pending) + len(self._done)
+
+    def _get_collector(self):
+        if not self._collector:
+            pc = self._server.mor.content.propertyCollector
+            self._collector = pc.CreatePropertyCollector()
+        return self._collector
+
+    def _filter_spec(self,tk_objs):
+        pc = vmodl.query.PropertyCollector
+        fspec = pc.FilterSpec()
+        fspec.objectSet = []
+        for tk_obj in tk_objs:
+            ospec = pc.ObjectSpec()
+            ospec.obj = tk_obj.mor
+            ospec.skip = False
+            fspec.objectSet.append(ospec)
+        pspec = pc.PropertySpec()
+        pspec.type = vim.Task
+        pspec.all = False
+        pspec.pathSet = ['info.state', 'info.error', 'info.startTime',
+                         'info.completeTime', 'info.entity']
+        fspec.propSet = [pspec]
+        return fspec
+
+    def _create_filter(self,tk_objs):
+        collector = self._get_collector()
+        try:
+            collector.CreateFilter(spec=self._filter_spec(tk_objs),
+                                   partialUpdates=True)
+        except vmodl.fault.ManagedObjectNotFound:
+            if len(tk_objs) == 1:
+                # the task might have already been deleted from the
+                # system, assume it has completed
+                print "The task probably completed, could not find "+\
+                    "it on the server"
+                self._finish(tk_objs[0].get_moid())
+                return
+            # find out which of the tasks is gone
+            for tk_obj in tk_objs:
+                self._create_filter([tk_obj])
+
+    def add(self,tk_objs,timeout=None):
+        """Register the given task objects. If timeout (seconds) is
+        given, the tasks that do not complete within the timeout are
+        returned with timed_out set"""
+        new_objs = []
+        for tk_obj in tk_objs:
+            moid = tk_obj.get_moid()
+            if moid in self._pending:
+                continue
+            self._pending[moid] = tk_obj
+            if timeout is not None:
+                self._deadlines[moid] = time.time() + timeout
+            new_objs.append(tk_obj)
+        if new_objs:
+            self._create_filter(new_objs)
+        return
+
+    def _finish(self,moid,timed_out=False):
+        tk_obj = self._pending.pop(moid, None)
+        self._deadlines.pop(moid, None)
+        if not tk_obj:
+            return
+        tk_obj.timed_out = timed_out
+        tk_obj.end_time = time.time()
+        self._done.append(tk_obj)
+        if self._server.cache:
+            # the task may have changed cached properties of its entity
+            self._server.cache.mark_dirty(tk_obj.entity)
+        if not timed_out:
+            tk_obj.run_callbacks()
+
+    def _expire(self):
+        now = time.time()
+        for moid, deadline in self._deadlines.items():
+            if deadline <= now:
+                self._finish(moid, timed_out=True)
+
+    def _apply(self,update):
+        for filter_update in update.filterSet:
+            for obj_update in filter_update.objectSet:
+                moid = str(obj_update.obj._moId)
+                tk_obj = self._pending.get(moid)
+                if not tk_obj:
+                    continue
+                if obj_update.kind == 'leave':
+                    # task removed from the server
+                    self._finish(moid)
+                    continue
+                for change in obj_update.changeSet:
+                    if change.name == 'info.state':
+                        tk_obj.state = change.val
+                    elif change.name == 'info.error':
+                        tk_obj.error = change.val
+                    elif change.name == 'info.startTime':
+                        tk_obj.started = change.val
+                    elif change.name == 'info.completeTime':
+                        tk_obj.completed = change.val
+                    elif change.name == 'info.entity':
+                        tk_obj.entity = change.val
+                if tk_obj.state in FINAL_STATES:
+                    self._finish(moid)
+
+    def _wait_seconds(self,end):
+        """Seconds to block in WaitForUpdatesEx, bounded by the nearest
+        task deadline and the end time of the wait call"""
+        deadlines = self._deadlines.values()
+        if end is not None:
+            deadlines.append(end)
+        wait = self._max_wait
+        if deadlines:
+            left = min(deadlines) - time.time()
+            wait = max(0, min(wait, int(math.ceil(left))))
+        return wait
+
+    def wait_any(self,timeout=None):
+        """Block till at least one of the registered tasks completes and
+        return the list of completed task objects. Returns an empty list
+        if nothing completed within the timeout"""
+        end = None
+        if timeout is not None:
+            end = time.time() + timeout
+        collector = None
+        while True:
+            self._expire()
+            if self._done:
+                done = self._done
+                self._done = []
+                return done
+            if not self._pending:
+                return []
+            if end is not None and time.time() >= end:
+                return []
+            if not collector:
+                collector = self._get_collector()
+            options = vmodl.query.PropertyCollector.WaitOptions()
+            options.maxWaitSeconds = self._wait_seconds(end)
+            update = collector.WaitForUpdatesEx(version=self._version,
+                                                options=options)
+            if update:
+                self._version = update.version
+                self._apply(update)
+
+    def wait_all(self,timeout=None):
+        """Block till all the registered tasks complete or time out.
+        Returns the list of task objects"""
+        end = None
+        if timeout is not None:
+            end = time.time() + timeout
+        done = []
+        while len(self):
+            left = None
+            if end is not None:
+                left = end - time.time()
+                if left <= 0:
+                    break
+            done.extend(self.wait_any(left))
+        return done
+
+    def close(self):
+        """Destroy the property collector and its filters"""
+        if self._collector:
+            try:
+                self._collector.DestroyPropertyCollector()
+            except Exception:
+                pass
+            self._collector = None
+        return
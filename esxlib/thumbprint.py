@@ -0,0 +1,101 @@
+"""
+SSL thumbprints of hosts for HostConnectSpec.sslThumbprint.
+
+Fetching the certificate is a blocking TLS handshake with the host. The
+thumbprints are cached per host and port for TTL seconds, and many of
+them can be fetched concurrently. A host that was reinstalled or got a
+new certificate within the ttl fails to add with SSLVerifyFault, the
+callers then invalidate it and fetch it again.
+"""
+
+import hashlib
+import socket
+import ssl
+import threading
+import time
+
+import workers
+
+# seconds a cached thumbprint is used
+TTL = 600
+
+# seconds for the connect and the handshake with a host
+TIMEOUT = 30
+
+# (host, port) -> (time fetched, thumbprint)
+_cache = {}
+_lock = threading.Lock()
+
+
+def fetch(host,port=443,timeout=TIMEOUT):
+    """Return the sha1 thumbprint of the host certificate as colon
+    separated hex pairs, e.g. 3f:0a:... Raises socket.timeout if the
+    host does not complete the handshake within timeout seconds"""
+    # see vim.host.ConnectSpec in the vSphere API reference
+    sock = socket.create_connection((host, port),timeout)
+    try:
+        tls = ssl.wrap_socket(sock,cert_reqs=ssl.CERT_NONE)
+        try:
+            der_cert = tls.getpeercert(True)
+        finally:
+            tls.close()
+    finally:
+        sock.close()
+    scsha1 = hashlib.sha1(der_cert).hexdigest()
+    return ':'.join([scsha1[i:i+2] for i in range(0,len(scsha1),2)])
+
+
+def get(host,port=443,refresh=False,timeout=TIMEOUT):
+    """Return the thumbprint of the host, from the cache unless refresh
+    is True or the entry is older than TTL"""
+    key = (host, port)
+    if not refresh:
+        with _lock:
+            entry = _cache.get(key)
+            if entry and time.time() - entry[0] < TTL:
+                return entry[1]
+    value = fetch(host,port,timeout)
+    with _lock:
+        _cache[key] = (time.time(), value)
+    return value
+
+
+def get_many(hosts,port=443,refresh=False,max_workers=workers.MAX_WORKERS,
+        timeout=TIMEOUT):
+    """Return a dict of host to thumbprint and a dict of host to the
+    error of the hosts whose certificate could not be fetched (or not
+    within timeout seconds)"""
+    thumbprints = {}
+    errors = {}
+    for host, value, error in workers.run_parallel(
+            lambda h: get(h,port,refresh,timeout),hosts,max_workers):
+        if error:
+            errors[host] = error
+        else:
+            thumbprints[host] = value
+    return thumbprints, errors
+
+
+def invalidate(host=None,port=443):
+    """Drop the cached thumbprint of the host or of all the hosts, e.g.
+    after a host got a new certificate"""
+    with _lock:
+        if host is None:
+            _cache.clear()
+        else:
+            _cache.pop((host, port),None)
+    return
+
+
+def is_verify_fault(error):
+    """Return True if the add host error is a certificate mismatch, the
+    cached thumbprint of the host is stale then"""
+    return error.__class__.__name__ == 'vim.fault.SSLVerifyFault'
+
+
+def check_task(tk_obj,host,port=443):
+    """Drop the cached thumbprint of the host if its add host task
+    failed with SSLVerifyFault, so the next add fetches it again"""
+    if is_verify_fault(tk_obj.error):
+        invalidate(host,port)
+    return
@@ -1,29 +1,16 @@
-import time
+def _get_server(obj):
+    if hasattr(obj, '_server'):
+        return obj._server
+    if hasattr(obj, '_dvs'):
+        return obj._dvs._server
+    return None
 
 
 def update(obj):
+    """Refresh the esxlib object. The properties are read from the
+    server or, if enabled, from the server's property cache which is
+    kept current in the background, so this is a local operation"""
+    server = _get_server(obj)
+    if server and server.cache and hasattr(obj, 'mor') and obj.mor:
+        server.cache.refresh(obj.mor)
     return
-    mor = None
-    if hasattr(obj, 'mor'):
-        mor = obj.mor
-    elif hasattr(obj, 'update'):
-        mor = obj
-    if not mor:
-        raise Exception('Cannot updated the obj. Its not mor', obj)
-
-    for i in range(1,4):
-        try:
-            mor.update()
-        except:
-            if hasattr(mor, 'name'):
-                print "Could not update mor %s" % mor.name
-            else:
-                print "Could not update mor %s" % mor
-            if i != 3:
-                print "Retrying.."
-                time.sleep(i*10)
-            continue
-        else:
-            # no error, update successful
-            break
-
@@ -1,5 +1,8 @@
 import dhcp
+import inventory
 import updatemor
+import vmdevices
+import vmreconfig
 
 class VirtualMachine:
 
@@ -8,6 +11,8 @@ class VirtualMachine:
         self.mor = vm_mor
         self._mgmt_ip = None
         self._mgmt_network = None
+        # device lookup tables of the last seen config version
+        self._devices = None
 
     def get_moid(self, stringify=True):
         moid = self.mor._moId
@@ -15,10 +20,15 @@ class VirtualMachine:
             moid = str(moid)
         return moid
 
+    def get_property(self,prop,max_age=None):
+        """Return the property path (e.g. runtime.powerState) of the vm,
+        from the server's property cache if enabled"""
+        return self._server.get_property(self.mor,prop,max_age)
+
     def power_off(self,wait=True):
         """ Power off the current vm"""
         self.update()
-        state = self.mor.runtime.powerState
+        state = self.get_property('runtime.powerState')
         tk = None
         if state != "poweredOff":
             tk = self.mor.PowerOffVM_Task()
@@ -31,7 +41,7 @@ class VirtualMachine:
     def power_on(self,wait=True):
         """ Power on the given vm"""
         self.update()
-        state = self.mor.runtime.powerState
+        state = self.get_property('runtime.powerState')
         tk = None
         if state != "poweredOn":
             tk = self.mor.PowerOnVM_Task()
@@ -44,7 +54,7 @@ class VirtualMachine:
     def suspend(self,wait=True):
         """ Suspend the current vm"""
         self.update()
-        state = self.mor.runtime.powerState
+        state = self.get_property('runtime.powerState')
         tk = None
         if state != "suspended":
             tk = self.mor.SuspendVM_Task()
@@ -54,14 +64,27 @@ class VirtualMachine:
                 tk = self._server.add_task(tk)
         return tk
 
-    def clone(self,name,dest_host=None,wait=True,datastore=None):
-        """Clone to the new name. If the dest_host object is provided,
-        the clone is added to the given dest_host. 
-        datastore is the destination datastore object. If its not
-        provided, then the clone is created in the same location as the
-        current vm.
-        It returns the task
-        object. (To get the new vm object use get_vm of the host)"""
+    def _get_vm_folder(self,dest_host=None):
+        """Return the vm folder of the datacenter of the dest_host
+        object or of the current vm if dest_host is not given"""
+        if dest_host:
+            mor = dest_host.mor.parent
+        else:
+            mor = self.mor.parent
+        # depending on cluster, compute resource or nested folders the
+        # datacenter is a different number of levels up
+        while mor and mor.__class__.__name__ != "vim.Datacenter":
+            mor = mor.parent
+        if not mor:
+            raise ValueError("Could not find the datacenter of %s" %
+                             (dest_host or self).mor.name)
+        return mor.vmFolder
+
+    def _clone_spec(self,dest_host=None,datastore=None,snapshot=None,
+            linked=False):
+        """Return the clone spec. If snapshot mor is given, the clone is
+        created from the state of that snapshot, as a linked clone if
+        linked is True"""
         rspec = self._server.new_spec("VirtualMachineRelocateSpec")
         if dest_host:
             rspec.host = dest_host.mor
@@ -73,28 +96,42 @@ class VirtualMachine:
         rspec.datastore = None
         if datastore:
             rspec.datastore = datastore.mor
+        if snapshot and linked:
+            # share the base disks of the snapshot, only the delta disk
+            # is created for the clone
+            rspec.diskMoveType = "createNewChildDiskBacking"
         cspec = self._server.new_spec("VirtualMachineCloneSpec")
         cspec.powerOn = False
-        cspec.snapshot = None
+        cspec.snapshot = snapshot
         cspec.template = False
         cspec.config = None
         cspec.customization = None
         cspec.location = rspec
-        # TODO this should be done better
-        # depending on cluster or root, this changes
-        if hasattr(self.mor.parent.parent, 'vmFolder'):
-            # not cluster
-            folder = self.mor.parent.parent.vmFolder # data center folder
-        if hasattr(self.mor.parent.parent.parent, 'vmFolder'):
-            # cluster
-            folder = self.mor.parent.parent.parent.vmFolder # data center folder
-        if dest_host:
-            if hasattr(dest_host.mor.parent.parent.parent, 'vmFolder'):
-                # not cluster
-                folder = dest_host.mor.parent.parent.parent.vmFolder # data center folder
-            if hasattr(dest_host.mor.parent.parent.parent.parent, 'vmFolder'):
-                # cluster
-                folder = dest_host.mor.parent.parent.parent.parent.vmFolder # data center folder
+        return cspec
+
+    def _current_snapshot(self):
+        """Return the current snapshot mor, a linked clone needs one"""
+        snapshot_info = self.mor.snapshot
+        if not snapshot_info or not snapshot_info.currentSnapshot:
+            raise ValueError("%s has no snapshot to create a linked clone "
+                             "from" % self.mor.name)
+        return snapshot_info.currentSnapshot
+
+    def clone(self,name,dest_host=None,wait=True,datastore=None,
+            linked=False):
+        """Clone to the new name. If the dest_host object is provided,
+        the clone is added to the given dest_host. 
+        datastore is the destination datastore object. If its not
+        provided, then the clone is created in the same location as the
+        current vm. If linked is True, a linked clone of the current
+        snapshot is created.
+        It returns the task
+        object. (To get the new vm object use get_vm of the host)"""
+        snapshot = None
+        if linked:
+            snapshot = self._current_snapshot()
+        cspec = self._clone_spec(dest_host,datastore,snapshot,linked)
+        folder = self._get_vm_folder(dest_host)
         tk = self.mor.CloneVM_Task(name=name,spec=cspec,folder=folder)
         if wait:
             tk = self._server.wait_for_task(tk)
@@ -102,15 +139,98 @@ class VirtualMachine:
             tk = self._server.add_task(tk)
         return tk
 
+    def clone_many(self,targets,max_per_host=4,max_per_datastore=4,
+            linked=False,snapshot=None,timeout=None):
+        """Clone the current vm to many targets. targets is a list of
+        (name, dest_host, datastore) tuples, dest_host and datastore can
+        be None like in clone. At most max_per_host clones are in flight
+        per destination host and max_per_datastore per datastore. If
+        linked is True, linked clones of the given snapshot mor (current
+        snapshot by default) are created, otherwise full clones of the
+        snapshot state if a snapshot is given.
+        This is a generator that yields (name, task object, error) as
+        each clone finishes. error is None if the clone succeeded"""
+        if max_per_host < 1 or max_per_datastore < 1:
+            raise ValueError("max_per_host and max_per_datastore must be "
+                             "at least 1")
+        if linked and not snapshot:
+            snapshot = self._current_snapshot()
+        folders = {}
+        host_count = {}
+        ds_count = {}
+        # task moid -> (name, host key, datastore key)
+        in_flight = {}
+        pending = list(targets)
+        group = self._server.task_group(timeout=timeout)
+        try:
+            while pending or in_flight:
+                waiting = []
+                failed = []
+                for target in pending:
+                    name, dest_host, datastore = target
+                    hkey = dest_host and dest_host.get_moid()
+                    dkey = datastore and datastore.get_moid()
+                    if host_count.get(hkey,0) >= max_per_host or\
+                            ds_count.get(dkey,0) >= max_per_datastore:
+                        waiting.append(target)
+                        continue
+                    # resolve the folder once per destination host
+                    if hkey not in folders:
+                        folders[hkey] = self._get_vm_folder(dest_host)
+                    cspec = self._clone_spec(dest_host,datastore,snapshot,
+                                             linked)
+                    try:
+                        tk = self.mor.CloneVM_Task(name=name,spec=cspec,
+                                                   folder=folders[hkey])
+                    except Exception as e:
+                        failed.append((name,None,e))
+                        continue
+                    tk_obj = group.add(tk)
+                    in_flight[tk_obj.get_moid()] = (name,hkey,dkey)
+                    host_count[hkey] = host_count.get(hkey,0) + 1
+                    ds_count[dkey] = ds_count.get(dkey,0) + 1
+                pending = waiting
+                for result in failed:
+                    yield result
+                if not in_flight:
+                    continue
+                for tk_obj in group.wait_any():
+                    name, hkey, dkey = in_flight.pop(tk_obj.get_moid())
+                    host_count[hkey] -= 1
+                    ds_count[dkey] -= 1
+                    error = None
+                    if tk_obj.state != "success":
+                        error = tk_obj.error
+                        if tk_obj.timed_out:
+                            error = "Timed out"
+                        elif error is None:
+                            # removed from the server before it was
+                            # seen completing
+                            error = "Task vanished"
+                    yield (name,tk_obj,error)
+        finally:
+            group.close()
+
     def delete(self,wait=True):
         """Delete the current vm"""
         self.power_off()
+        moids = [str(ds._moId) for ds in self.mor.datastore]
         tk = self.mor.Destroy_Task()
         if wait:
-            tk = self._server.wait_for_task(tk)
+            tk_obj = self._server._get_task_obj(tk)
         else:
-            tk = self._server.add_task(tk)
-        return tk
+            tk_obj = self._server.add_task(tk)
+        # the datastores change when the task completes, invalidating
+        # earlier would let a search during the task index them again
+        tk_obj.add_callback(lambda tk_obj: self._invalidate_ds_index(moids))
+        if wait:
+            tk_obj = self._server.wait_for_task(tk_obj)
+        return tk_obj
+
+    def _invalidate_ds_index(self,moids):
+        for moid in moids:
+            self._server.ds_index.invalidate(moid)
+        return
 
     def unregister(self):
         """Unregister the VM. The files are not deleted but just
@@ -122,6 +242,20 @@ class VirtualMachine:
     # another method to unregister
     detach = unregister
 
+    def get_devices(self):
+        """Return the device lookup tables (vmdevices.DeviceViews) of the
+        vm. They are rebuilt only when config.changeVersion changes, so
+        many lookups cost one device fetch"""
+        version = self.get_property('config.changeVersion')
+        if not self._devices or self._devices.version != version:
+            # fetch the version with the devices so that they match
+            props = inventory.get_properties(self._server,self.mor,
+                    ['config.changeVersion','config.hardware.device'])
+            self._devices = vmdevices.DeviceViews(
+                props.get('config.hardware.device'),
+                props.get('config.changeVersion'))
+        return self._devices
+
     def get_mgmt_mac(self):
         """Get the mac address of the interface connected to the
         management (VM Network) network or esx-mgmt-192 network.
@@ -129,24 +263,20 @@ class VirtualMachine:
         returns the first one found. If a vm has both the networks then
         VM Network interface is returned"""
         mac = None
-        for dev in self.mor.config.hardware.device:
-            if dev.deviceInfo.summary == "VM Network":
-                # found the vm network, so break after getting the mac
-                mac = dev.macAddress
-                self._mgmt_network = "VM Network"
-                break
-            if dev.deviceInfo.summary == "esx-mgmt-192":
-                mac = dev.macAddress
-                self._mgmt_network = "esx-mgmt-192"
-                # i might find a VM Network, so continue searching
+        devices = self.get_devices()
+        # VM Network is preferred over esx-mgmt-192
+        for network in ["VM Network", "esx-mgmt-192"]:
+            for dev in devices.get_nics(network):
+                if dev.deviceInfo.summary == network:
+                    self._mgmt_network = network
+                    return dev.macAddress
         return mac
         
     def get_all_macs(self):
         """Get all the mac addresses of the interfaces"""
         macs = {}
-        for dev in self.mor.config.hardware.device:
-            if hasattr(dev,'macAddress'):
-                macs[dev.deviceInfo.summary] = dev.macAddress
+        for dev in self.get_devices().nics:
+            macs[dev.deviceInfo.summary] = dev.macAddress
         return macs
         
     def get_dhcp_assigned_mgmt_ip(self):
@@ -157,8 +287,9 @@ class VirtualMachine:
         if not self._mgmt_ip:
             # based on the network type, the mapping has to be obtained
             # from a different server
-            if hasattr(self.mor.guest,'ipAddress') and self.mor.guest.ipAddress:
-                self._mgmt_ip = self.mor.guest.ipAddress
+            ip = self.get_property('guest.ipAddress')
+            if ip:
+                self._mgmt_ip = ip
             else:
                 mac = self.get_mgmt_mac()
                 mapping = dhcp.get_mac_mapping(self._mgmt_network)
@@ -191,30 +322,23 @@ class VirtualMachine:
                     ips.append(mapping.get(macs[network]))
         return ips
 
+    def reconfigure(self,wait=True):
+        """Return a Reconfig object that collects device and config
+        changes (add_nic, add_disk, change_nic, reserve_memory, ...) and
+        commits them as one ReconfigVM_Task. Use it as
+            with vm.reconfigure() as r:
+                r.add_nic(network)
+                r.reserve_cpu(1000)
+        or call commit() on it"""
+        return vmreconfig.Reconfig(self,wait)
+
     def add_nic(self,network=None,wait=True):
         """Adds a network adapter to the vm and maps it to the given
         network mor. The network mor is obtained from the call to the
         get_network under host"""
-        spec = self._server.new_spec('VirtualMachineConfigSpec')
-        spec.deviceChange = []
-        deviceChange = self._server.new_spec('VirtualDeviceConfigSpec')
-        deviceChange.operation = "add"
-        deviceChange.fileOperation = None
-        deviceChange.device = self._server.new_spec('VirtualE1000')
-        deviceChange.device.backing = self._server.new_spec('VirtualEthernetCardNetworkBackingInfo')
-        deviceChange.device.backing.network = network
-        deviceChange.device.backing.deviceName = network.name
-        #spec.deviceChange.device.connectable.connected = True
-        #spec.deviceChange.device.connectable.startConnected = True
-        #spec.deviceChange.device.connectable.allowGuestControl = True
-        spec.deviceChange.append(deviceChange)
-        tk = self.mor.ReconfigVM_Task(spec=spec)
-        if wait:
-            tk = self._server.wait_for_task(tk)
-            self.update()
-        else:
-            tk = self._server.add_task(tk)
-        return tk
+        r = self.reconfigure(wait)
+        r.add_nic(network)
+        return r.commit()
 
     def delete_nic(self, network=None, label=None, wait=True):
         """Deletes a network adapter on the vm thats on the given
@@ -222,248 +346,61 @@ class VirtualMachine:
         get_network under host. The first adapter matching the network
         is deleted. If a label is provided, the adapter matching the
         label is deleted"""
-        key = None
-        for dev in self.mor.config.hardware.device:
-            if network:
-                if dev.deviceInfo.summary == network.name:
-                    key = dev.key
-            elif label:
-                if dev.deviceInfo.label == label:
-                    key = dev.key
-            if key:
-                break
-        if not key:
+        r = self.reconfigure(wait)
+        if not r.delete_nic(network, label):
             return None
-        spec = self._server.new_spec('VirtualMachineConfigSpec')
-        spec.deviceChange = []
-        deviceChange = self._server.new_spec('VirtualDeviceConfigSpec')
-        deviceChange.operation = "remove"
-        deviceChange.fileOperation = None
-        deviceChange.device = self._server.new_spec('VirtualE1000')
-        deviceChange.device.key = key
-        spec.deviceChange.append(deviceChange)
-        tk = self.mor.ReconfigVM_Task(spec=spec)
-        if wait:
-            tk = self._server.wait_for_task(tk)
-            self.update()
-        else:
-            tk = self._server.add_task(tk)
-        return tk
+        return r.commit()
 
     def add_lsi_sas_controller(self):
-        spec = self._server.new_spec('VirtualMachineConfigSpec')
-        spec.deviceChange = []
-        deviceChange = self._server.new_spec('VirtualDeviceConfigSpec')
-        deviceChange.operation = "add"
-        deviceChange.fileOperation = None
-        deviceChange.device = self._server.new_spec('VirtualLsiLogicSASController')
-        deviceChange.device.sharedBus = 'noSharing'
-        spec.deviceChange.append(deviceChange)
-        tk = self.mor.ReconfigVM_Task(spec=spec)
-        tk = self._server.wait_for_task(tk)
-        self.update()
-        return tk
+        r = self.reconfigure()
+        r.add_lsi_sas_controller()
+        return r.commit()
 
-    def add_disk(self,size_kb,name=None,unit=0,wait=True):
-        """Adds a Hard disk of the given size in KB
+    def add_disk(self,size_kb,name=None,unit=None,wait=True):
+        """Adds a Hard disk of the given size in KB, on the next free unit
+        of the SCSI controller if unit is not given
         """
-        if not name:
-            name = self.mor.name
-        path = self.mor.summary.config.vmPathName.split("/")[:-1]
-        path = "/".join(path)
-        path += "/" + name + ".vmdk"
-        spec = self._server.new_spec('VirtualMachineConfigSpec')
-        spec.deviceChange = []
-        deviceChange = self._server.new_spec('VirtualDeviceConfigSpec')
-        deviceChange.operation = "add"
-        deviceChange.fileOperation = "create"
-        deviceChange.device = self._server.new_spec('VirtualDisk')
-        deviceChange.device.capacityInKB = size_kb
-        for cntrl in self.mor.config.hardware.device:
-            if cntrl.deviceInfo.label.startswith('SCSI'):
-                deviceChange.device.controllerKey = cntrl.key
-                break
-        deviceChange.device.backing = self._server.new_spec('VirtualDiskFlatVer2BackingInfo')
-        deviceChange.device.backing.fileName = path
-        deviceChange.device.backing.diskMode = "persistent"
-        deviceChange.device.backing.split = False
-        deviceChange.device.backing.writeThrough = False
-        deviceChange.device.backing.thinProvisioned = True
-        deviceChange.device.unitNumber = unit
-        spec.deviceChange.append(deviceChange)
-        tk = self.mor.ReconfigVM_Task(spec=spec)
-        if wait:
-            tk = self._server.wait_for_task(tk)
-            self.update()
-        else:
-            tk = self._server.add_task(tk)
-        return tk
+        r = self.reconfigure(wait)
+        r.add_disk(size_kb,name,unit)
+        return r.commit()
 
     def list_nic(self):
         nics = {}
-        for device in self.mor.config.hardware.device:
+        for device in self.get_devices().devices:
             if device.deviceInfo.label.startswith('Network'):
                 nics[device.deviceInfo.label] = device
         return nics
    
     def change_macs(self, nic_dict, wait=True):
         """Change the mac address of the given network adapters"""
-        spec = self._server.new_spec('VirtualMachineConfigSpec')
-        spec.deviceChange = []
-        for (nic, addrType, mac) in nic_dict:
-            deviceChange = self._server.new_spec('VirtualDeviceConfigSpec')
-            deviceChange.operation = "edit"
-            deviceChange.fileOperation = None
-            # find the nic device with the given name
-            nic_device = None
-            adapterType = None
-            for device in self.mor.config.hardware.device:
-                if device.deviceInfo.label == nic:
-                    adapterType = (device.__class__.__name__).split(".")[-1]
-                    nic_device = device
-                    break
-            if nic_device and adapterType:   
-                deviceChange.device = self._server.new_spec(adapterType)
-                deviceChange.device.key = nic_device.key
-                deviceChange.device.addressType = addrType
-                if mac:
-                    deviceChange.device.macAddress = mac
-                spec.deviceChange.append(deviceChange)
-    
-        tk = self.mor.ReconfigVM_Task(spec=spec)
-        if wait:
-            tk = self._server.wait_for_task(tk)
-            self.update()
-        else:
-            tk = self._server.add_task(tk)
-        return tk
+        r = self.reconfigure(wait)
+        r.change_macs(nic_dict)
+        return r.commit()
  
     def change_nics(self, nic_dict, wait=True):
         """Change a network adapter of the vm and maps it to the given
         network mor. The network mor is obtained from the call to the
         get_network under host"""
-        spec = self._server.new_spec('VirtualMachineConfigSpec')
-        spec.deviceChange = []
-        for nic, network in nic_dict.items():
-            deviceChange = self._server.new_spec('VirtualDeviceConfigSpec')
-            deviceChange.operation = "edit"
-            deviceChange.fileOperation = None
-            # find the nic device with the given name
-            nic_device = None
-            adapterType = None
-            for device in self.mor.config.hardware.device:
-                if device.deviceInfo.label == nic:
-                    adapterType = (device.__class__.__name__).split(".")[-1]
-                    nic_device = device
-                    break
-            if nic_device and adapterType:   
-                deviceChange.device = self._server.new_spec(adapterType)
-                deviceChange.device.key = nic_device.key
-                deviceChange.device.addressType = nic_device.addressType
-                deviceChange.device.macAddress = nic_device.macAddress
-                if network.__class__.__name__ == "vim.DistributedVirtualPortgroup" or \
-                   network.__class__.__name__ == "vim.dvs.DistributedVirtualPortgroup":
-                    deviceChange.device.backing = self._server.new_spec('VirtualEthernetCardDistributedVirtualPortBackingInfo')
-                    deviceChange.device.backing.port = self._server.new_spec('DistributedVirtualSwitchPortConnection')
-                    deviceChange.device.backing.port.portgroupKey = network.config.key
-                    deviceChange.device.backing.port.switchUuid = network.config.distributedVirtualSwitch.uuid
-                else:
-                    deviceChange.device.backing = self._server.new_spec('VirtualEthernetCardNetworkBackingInfo')
-                    deviceChange.device.backing.network = network
-                    deviceChange.device.backing.deviceName = network.name
-                deviceChange.device.connectable = self._server.new_spec('VirtualDeviceConnectInfo')
-                deviceChange.device.connectable.connected = True
-                deviceChange.device.connectable.startConnected = True
-                deviceChange.device.connectable.allowGuestControl = True
-                spec.deviceChange.append(deviceChange)
-        
-        tk = self.mor.ReconfigVM_Task(spec=spec)
-        if wait:
-            tk = self._server.wait_for_task(tk)
-            self.update()
-        else:
-            tk = self._server.add_task(tk)
-        return tk
+        r = self.reconfigure(wait)
+        r.change_nics(nic_dict)
+        return r.commit()
    
     def change_nic(self,nic,network=None,wait=True):
         """Change a network adapter of the vm and maps it to the given
         network mor. The network mor is obtained from the call to the
         get_network under host"""
-        spec = self._server.new_spec('VirtualMachineConfigSpec')
-        spec.deviceChange = []
-        deviceChange = self._server.new_spec('VirtualDeviceConfigSpec')
-        deviceChange.operation = "edit"
-        deviceChange.fileOperation = None
-        # find the nic device with the given name
-        nic_device = None
-        adapterType = None
-        for device in self.mor.config.hardware.device:
-            if device.deviceInfo.label == nic:
-                adapterType = (device.__class__.__name__).split(".")[-1]
-                nic_device = device
-                break
-        if nic_device and adapterType:
-            deviceChange.device = self._server.new_spec(adapterType)
-            deviceChange.device.key = nic_device.key
-            deviceChange.device.addressType = nic_device.addressType
-            deviceChange.device.macAddress = nic_device.macAddress
-            if network.__class__.__name__ == "vim.dvs.DistributedVirtualPortgroup":
-                deviceChange.device.backing = self._server.new_spec('VirtualEthernetCardDistributedVirtualPortBackingInfo')
-                deviceChange.device.backing.port = self._server.new_spec('DistributedVirtualSwitchPortConnection')
-                deviceChange.device.backing.port.portgroupKey = network.config.key
-                deviceChange.device.backing.port.switchUuid = network.config.distributedVirtualSwitch.uuid
-            else:
-                deviceChange.device.backing = self._server.new_spec('VirtualEthernetCardNetworkBackingInfo')
-                deviceChange.device.backing.network = network
-                deviceChange.device.backing.deviceName = network.name
-            deviceChange.device.connectable = self._server.new_spec('VirtualDeviceConnectInfo')
-            deviceChange.device.connectable.connected = True
-            deviceChange.device.connectable.startConnected = True
-            deviceChange.device.connectable.allowGuestControl = True
-            spec.deviceChange.append(deviceChange)
-            tk = self.mor.ReconfigVM_Task(spec=spec)
-            if wait:
-                tk = self._server.wait_for_task(tk)
-                self.update()
-            else:
-                tk = self._server.add_task(tk)
-            return tk
+        r = self.reconfigure(wait)
+        if r.change_nic(nic,network):
+            return r.commit()
         else:
             print "NIC Device",nic," not found"
         return
 
     def change_serial(self,serial,uri,wait=True):
         """Change a serial adapter of the vm"""
-        spec = self._server.new_spec('VirtualMachineConfigSpec')
-        spec.deviceChange = []
-        deviceChange = self._server.new_spec('VirtualDeviceConfigSpec')
-        deviceChange.operation = "edit"
-        # find the device with the given name
-        serial_device = None
-        for device in self.mor.config.hardware.device:
-            if device.deviceInfo.label == serial:
-                serial_device = device
-                break
-        if serial_device:
-            deviceChange.device = self._server.new_spec('VirtualSerialPort')
-            deviceChange.device.key = serial_device.key
-            deviceChange.device.backing = self._server.new_spec('VirtualSerialPortURIBackingInfo')
-            deviceChange.device.backing.serviceURI = uri
-            deviceChange.device.backing.direction = 'server'
-            """
-            deviceChange.device.connectable = self._server.new_spec('VirtualDeviceConnectInfo')
-            deviceChange.device.connectable.connected = True
-            deviceChange.device.connectable.startConnected = True
-            deviceChange.device.connectable.allowGuestControl = True
-            """
-            spec.deviceChange.append(deviceChange)
-            tk = self.mor.ReconfigVM_Task(spec=spec)
-            if wait:
-                tk = self._server.wait_for_task(tk)
-                self.update()
-            else:
-                tk = self._server.add_task(tk)
-            return tk
+        r = self.reconfigure(wait)
+        if r.change_serial(serial,uri):
+            return r.commit()
         else:
             print "Serial device", serial, "not found"
         return
@@ -471,85 +408,24 @@ class VirtualMachine:
     def change_name(self,name,wait=True):
         """Change the name of the VM
         """
-        spec = self._server.new_spec('VirtualMachineConfigSpec')
-        spec.name = name
-        tk = self.mor.ReconfigVM_Task(spec=spec)
-        if wait:
-            tk = self._server.wait_for_task(tk)
-            self.update()
-        else:
-            tk = self._server.add_task(tk)
-
-        return tk
+        r = self.reconfigure(wait)
+        r.change_name(name)
+        return r.commit()
 
     def disconnect_nic(self,nic,wait=True):
         """Disconnect a network adapter of the vm"""
-        spec = self._server.new_spec('VirtualMachineConfigSpec')
-        spec.deviceChange = []
-        deviceChange = self._server.new_spec('VirtualDeviceConfigSpec')
-        spec.deviceChange.append(deviceChange)
-        deviceChange.operation = "edit"
-        deviceChange.fileOperation = None
-        # find the nic device with the given name
-        nic_device = None
-        adapterType = None
-        for device in self.mor.config.hardware.device:
-            if device.deviceInfo.label == nic:
-                nic_device = device
-                adapterType = (device.__class__.__name__).split(".")[-1]
-                break
-        if nic_device and adapterType:   
-            deviceChange.device = self._server.new_spec(adapterType)
-            deviceChange.device.key = nic_device.key
-            deviceChange.device.macAddress = nic_device.macAddress
-            deviceChange.device.addressType = nic_device.addressType
-            deviceChange.device.connectable = self._server.new_spec('VirtualDeviceConnectInfo')
-            deviceChange.device.connectable.connected = False
-            deviceChange.device.connectable.startConnected = False
-            deviceChange.device.connectable.allowGuestControl = False
-            tk = self.mor.ReconfigVM_Task(spec=spec)
-            if wait:
-                tk = self._server.wait_for_task(tk)
-                self.update()
-            else:
-                tk = self._server.add_task(tk)
-            return tk
+        r = self.reconfigure(wait)
+        if r.disconnect_nic(nic):
+            return r.commit()
         else:
             print "NIC Device",nic," not found"
         return
 
     def reconnect_nic(self,nic,wait=True):
         """Reconnect a network adapter of the vm"""
-        spec = self._server.new_spec('VirtualMachineConfigSpec')
-        spec.deviceChange = []
-        deviceChange = self._server.new_spec('VirtualDeviceConfigSpec')
-        spec.deviceChange.append(deviceChange)
-        deviceChange.operation = "edit"
-        deviceChange.fileOperation = None
-        # find the nic device with the given name
-        nic_device = None
-        adapterType = None
-        for device in self.mor.config.hardware.device:
-            if device.deviceInfo.label == nic:
-                adapterType = (device.__class__.__name__).split(".")[-1]
-                nic_device = device
-                break
-        if nic_device and adapterType:   
-            deviceChange.device = self._server.new_spec(adapterType)
-            deviceChange.device.key = nic_device.key
-            deviceChange.device.macAddress = nic_device.macAddress
-            deviceChange.device.addressType = nic_device.addressType
-            deviceChange.device.connectable = self._server.new_spec('VirtualDeviceConnectInfo')
-            deviceChange.device.connectable.connected = True
-            deviceChange.device.connectable.startConnected = True
-            deviceChange.device.connectable.allowGuestControl = True
-            tk = self.mor.ReconfigVM_Task(spec=spec)
-            if wait:
-                tk = self._server.wait_for_task(tk)
-                self.update()
-            else:
-                tk = self._server.add_task(tk)
-            return tk
+        r = self.reconfigure(wait)
+        if r.reconnect_nic(nic):
+            return r.commit()
         else:
             print "NIC Device",nic," not found"
         return
@@ -558,7 +434,7 @@ class VirtualMachine:
         """Checks if a nic is available and connected to the given
         network. Network is mor obtained from the call to get_network
         under host"""
-        for device in self.mor.config.hardware.device:
+        for device in self.get_devices().get_nics(network.name):
             if device.__class__.__name__ != 'vim.vm.device.VirtualE1000':
                 continue
             if device.deviceInfo.summary == network.name:
@@ -597,26 +473,11 @@ class VirtualMachine:
         updatemor.update(self)
 
     def reserve_cpu(self, mHz, wait=True):
-        spec = self._server.new_spec("VirtualMachineConfigSpec")
-        spec.cpuAllocation.reservation = mHz
-        tk = self.mor.ReconfigVM_Task(spec=spec)
-        if wait:
-            tk = self._server.wait_for_task(tk)
-            self.update()
-        else:
-            tk = self._server.add_task(tk)
-        return tk
+        r = self.reconfigure(wait)
+        r.reserve_cpu(mHz)
+        return r.commit()
 
     def reserve_memory(self, mb, wait=True):
-        if mb == 0:
-            mb = self.mor.runtime.maxMemoryUsage
-        spec = self._server.new_spec("VirtualMachineConfigSpec")
-        spec.memoryAllocation.reservation = mb
-        tk = self.mor.ReconfigVM_Task(spec=spec)
-        if wait:
-            tk = self._server.wait_for_task(tk)
-            self.update()
-        else:
-            tk = self._server.add_task(tk)
-        return tk
-
+        r = self.reconfigure(wait)
+        r.reserve_memory(mb)
+        return r.commit()
@@ -0,0 +1,71 @@
+"""
+Indexed views of the devices of a virtual machine.
+
+Looking up a nic or a controller used to loop over
+config.hardware.device, fetching the whole device array from the
+server every time. DeviceViews indexes the array once by label, key,
+mac address, network and controller. The vm keeps the views of its
+current config.changeVersion and rebuilds them only when the version
+changes.
+"""
+
+
+class DeviceViews:
+    """Lookup tables of the device list of a vm for one config version"""
+
+    def __init__(self,devices,version=None):
+        self.version = version
+        self.devices = list(devices or [])
+        self.by_label = {}
+        self.by_key = {}
+        self.by_mac = {}
+        # network name / portgroup key -> list of nics
+        self.by_network = {}
+        # controller key -> list of devices on the controller
+        self.by_controller = {}
+        self.nics = []
+        self.controllers = []
+        for dev in self.devices:
+            label = dev.deviceInfo.label
+            # the first device of a label wins, like the old scans
+            self.by_label.setdefault(label,dev)
+            self.by_key[dev.key] = dev
+            if getattr(dev,'controllerKey',None) is not None:
+                self.by_controller.setdefault(dev.controllerKey,[]).append(dev)
+            if hasattr(dev,'busNumber'):
+                self.controllers.append(dev)
+            if not hasattr(dev,'macAddress'):
+                continue
+            self.nics.append(dev)
+            if dev.macAddress:
+                self.by_mac[dev.macAddress] = dev
+            for name in self._network_names(dev):
+                self.by_network.setdefault(name,[]).append(dev)
+
+    def _network_names(self,dev):
+        """Names under which a nic is indexed: the summary (network name
+        for standard portgroups), the backing device name and the
+        portgroup key for distributed portgroups"""
+        names = [dev.deviceInfo.summary]
+        backing = dev.backing
+        if getattr(backing,'deviceName',None):
+            names.append(backing.deviceName)
+        port = getattr(backing,'port',None)
+        if port and port.portgroupKey:
+            names.append(port.portgroupKey)
+        return set(names)
+
+    def get(self,label):
+        """Return the device with the given label or None"""
+        return self.by_label.get(label)
+
+    def get_nics(self,network):
+        """Return the nics on the given network name or portgroup key"""
+        return self.by_network.get(network,[])
+
+    def get_scsi_controller(self):
+        """Return the first SCSI controller or None"""
+        for cntrl in self.controllers:
+            if cntrl.deviceInfo.label.startswith('SCSI'):
+                return cntrl
+        return None
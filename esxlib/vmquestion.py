@@ -0,0 +1,65 @@
+"""
+Answer the pending questions of many vms at once.
+
+After a datastore is re-registered, every vm whose uuid no longer
+matches its location waits on the "moved or copied" question and will
+not power on till it is answered. runtime.question of all the vms under
+a container is read in one property fetch and only the vms with the
+question pending are answered, with at most max_workers AnswerVM calls
+in flight.
+
+The result is a dict with the vm names that were answered and the ones
+that failed (name -> error).
+"""
+
+import workers
+
+# message id of the "moved or copied" question
+MOVED_MESSAGE_ID = 'msg.uuid.altered'
+
+
+def _is_moved_question(question):
+    for msg in question.message or []:
+        if msg.id == MOVED_MESSAGE_ID:
+            return True
+    return 'moved' in (question.text or '') and \
+        'copied' in (question.text or '')
+
+
+def _choice(question,answer):
+    """Return the key of the choice whose label has the answer (moved or
+    copied), e.g. 'I moved it'"""
+    for choice in question.choice.choiceInfo:
+        if answer in choice.label.lower():
+            return choice.key
+    return None
+
+
+def answer_moved(server_obj,container,answer='moved',
+                 max_workers=workers.MAX_WORKERS):
+    """Answer the "moved or copied" question of all the vms under the
+    container mor with answer (moved keeps the vm uuid, copied
+    generates a new one)"""
+    result = {'answered': [], 'error': {}}
+    pending = []
+    for vm in server_obj.get_inventory('VirtualMachine',
+                                       ['runtime.question'],container):
+        question = vm['runtime.question']
+        if question and _is_moved_question(question):
+            pending.append(vm)
+
+    def answer_vm(vm):
+        question = vm['runtime.question']
+        key = _choice(question,answer)
+        if key is None:
+            raise ValueError("No '%s' choice in '%s'" % (answer,
+                                                          question.text))
+        vm['mor'].AnswerVM(questionId=question.id,answerChoice=key)
+
+    for vm, res, error in workers.run_parallel(answer_vm,pending,
+                                               max_workers):
+        if error:
+            result['error'][vm['name']] = error
+        else:
+            result['answered'].append(vm['name'])
+    return result
@@ -0,0 +1,293 @@
+"""
+Batched reconfiguration of a virtual machine.
+
+Every device or setting change of the vm used to be its own
+ReconfigVM_Task. The Reconfig object collects the deviceChange entries
+and config fields of many changes into one VirtualMachineConfigSpec and
+commits them as one task
+
+    with vm.reconfigure() as r:
+        r.add_nic(network)
+        r.add_disk(1024*1024, unit=1)
+        r.reserve_memory(1024)
+
+The spec is committed when the with block exits without an exception.
+"""
+
+# unit numbers of a SCSI controller, 7 is taken by the controller itself
+SCSI_UNITS = [u for u in range(16) if u != 7]
+
+
+class Reconfig:
+    """Collects the changes to a vm and commits them as one
+    ReconfigVM_Task"""
+
+    def __init__(self,vm_obj,wait=True):
+        self._vm = vm_obj
+        self._server = vm_obj._server
+        self._wait = wait
+        self._devices = None
+        # keys of the devices added by this spec are negative
+        self._new_key = 0
+        self._new_controllers = []
+        # controller key -> unit numbers taken by disks added in this spec
+        self._new_units = {}
+        self._changed = False
+        self.spec = self._server.new_spec('VirtualMachineConfigSpec')
+        self.spec.deviceChange = []
+        self.task = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        if exc_type is None:
+            self.commit()
+        return False
+
+    def _get_devices(self):
+        """Device lookup tables of the vm, fetched once per spec"""
+        if self._devices is None:
+            self._devices = self._vm.get_devices()
+        return self._devices
+
+    def _find_device(self,label):
+        return self._get_devices().get(label)
+
+    def _next_key(self):
+        self._new_key -= 1
+        return self._new_key
+
+    def _device_change(self,operation,device,file_operation=None):
+        change = self._server.new_spec('VirtualDeviceConfigSpec')
+        change.operation = operation
+        change.fileOperation = file_operation
+        change.device = device
+        self.spec.deviceChange.append(change)
+        self._changed = True
+        return change
+
+    def _edit_device(self,nic_device):
+        """Return a new device of the same type as nic_device to edit"""
+        adapterType = (nic_device.__class__.__name__).split(".")[-1]
+        device = self._server.new_spec(adapterType)
+        device.key = nic_device.key
+        return device
+
+    def _connectable(self,connected):
+        connectable = self._server.new_spec('VirtualDeviceConnectInfo')
+        connectable.connected = connected
+        connectable.startConnected = connected
+        connectable.allowGuestControl = connected
+        return connectable
+
+    def _nic_backing(self,network):
+        if network.__class__.__name__ == "vim.DistributedVirtualPortgroup" or \
+           network.__class__.__name__ == "vim.dvs.DistributedVirtualPortgroup":
+            backing = self._server.new_spec('VirtualEthernetCardDistributedVirtualPortBackingInfo')
+            backing.port = self._server.new_spec('DistributedVirtualSwitchPortConnection')
+            backing.port.portgroupKey = network.config.key
+            backing.port.switchUuid = network.config.distributedVirtualSwitch.uuid
+        else:
+            backing = self._server.new_spec('VirtualEthernetCardNetworkBackingInfo')
+            backing.network = network
+            backing.deviceName = network.name
+        return backing
+
+    def add_nic(self,network):
+        """Add a network adapter mapped to the given network mor"""
+        device = self._server.new_spec('VirtualE1000')
+        device.key = self._next_key()
+        device.backing = self._server.new_spec('VirtualEthernetCardNetworkBackingInfo')
+        device.backing.network = network
+        device.backing.deviceName = network.name
+        self._device_change("add",device)
+        return True
+
+    def delete_nic(self,network=None,label=None):
+        """Remove the first adapter on the given network mor or the
+        adapter with the given label. Returns False if not found"""
+        key = None
+        devices = self._get_devices()
+        if network:
+            for dev in devices.get_nics(network.name):
+                if dev.deviceInfo.summary == network.name:
+                    key = dev.key
+                    break
+        elif label:
+            dev = devices.get(label)
+            if dev:
+                key = dev.key
+        if not key:
+            return False
+        device = self._server.new_spec('VirtualE1000')
+        device.key = key
+        self._device_change("remove",device)
+        return True
+
+    def add_lsi_sas_controller(self):
+        """Add a LSI logic SAS controller. Disks added after this in the
+        same spec use it if the vm has no SCSI controller"""
+        device = self._server.new_spec('VirtualLsiLogicSASController')
+        device.key = self._next_key()
+        device.sharedBus = 'noSharing'
+        self._new_controllers.append(device.key)
+        self._device_change("add",device)
+        return True
+
+    def _free_unit(self,controller_key):
+        """Return the first unit number not used on the SCSI controller,
+        counting the disks already added in this spec"""
+        used = set(self._new_units.get(controller_key,[]))
+        for dev in self._get_devices().by_controller.get(controller_key,[]):
+            used.add(dev.unitNumber)
+        for unit in SCSI_UNITS:
+            if unit not in used:
+                return unit
+        raise ValueError("No free unit on the SCSI controller of %s" %
+                         self._vm.mor.name)
+
+    def add_disk(self,size_kb,name=None,unit=None):
+        """Add a thin provisioned hard disk of the given size in KB. If
+        unit is not given, the next free unit of the controller is
+        used"""
+        if not name:
+            name = self._vm.mor.name
+        path = self._vm.mor.summary.config.vmPathName.split("/")[:-1]
+        path = "/".join(path)
+        path += "/" + name + ".vmdk"
+        device = self._server.new_spec('VirtualDisk')
+        device.key = self._next_key()
+        device.capacityInKB = size_kb
+        cntrl = self._get_devices().get_scsi_controller()
+        if cntrl:
+            device.controllerKey = cntrl.key
+        elif self._new_controllers:
+            device.controllerKey = self._new_controllers[0]
+        device.backing = self._server.new_spec('VirtualDiskFlatVer2BackingInfo')
+        device.backing.fileName = path
+        device.backing.diskMode = "persistent"
+        device.backing.split = False
+        device.backing.writeThrough = False
+        device.backing.thinProvisioned = True
+        if device.controllerKey is not None:
+            if unit is None:
+                unit = self._free_unit(device.controllerKey)
+            self._new_units.setdefault(device.controllerKey,[]).append(unit)
+        elif unit is None:
+            unit = 0
+        device.unitNumber = unit
+        self._device_change("add",device,"create")
+        return True
+
+    def change_macs(self,nic_list):
+        """Change the mac address of the network adapters. nic_list is a
+        list of (label, address type, mac)"""
+        for (nic, addrType, mac) in nic_list:
+            nic_device = self._find_device(nic)
+            if not nic_device:
+                continue
+            device = self._edit_device(nic_device)
+            device.addressType = addrType
+            if mac:
+                device.macAddress = mac
+            self._device_change("edit",device)
+        return True
+
+    def change_nic(self,nic,network):
+        """Map the adapter with the label nic to the network mor. Returns
+        False if the adapter is not found"""
+        nic_device = self._find_device(nic)
+        if not nic_device:
+            return False
+        device = self._edit_device(nic_device)
+        device.addressType = nic_device.addressType
+        device.macAddress = nic_device.macAddress
+        device.backing = self._nic_backing(network)
+        device.connectable = self._connectable(True)
+        self._device_change("edit",device)
+        return True
+
+    def change_nics(self,nic_dict):
+        """Map the adapters to the networks. nic_dict is a dict of label
+        to network mor"""
+        for nic, network in nic_dict.items():
+            self.change_nic(nic,network)
+        return True
+
+    def _set_nic_connected(self,nic,connected):
+        nic_device = self._find_device(nic)
+        if not nic_device:
+            return False
+        device = self._edit_device(nic_device)
+        device.macAddress = nic_device.macAddress
+        device.addressType = nic_device.addressType
+        device.connectable = self._connectable(connected)
+        self._device_change("edit",device)
+        return True
+
+    def disconnect_nic(self,nic):
+        """Disconnect the adapter with the label nic. Returns False if the
+        adapter is not found"""
+        return self._set_nic_connected(nic,False)
+
+    def reconnect_nic(self,nic):
+        """Connect the adapter with the label nic. Returns False if the
+        adapter is not found"""
+        return self._set_nic_connected(nic,True)
+
+    def change_serial(self,serial,uri):
+        """Point the serial port with the label serial to the uri.
+        Returns False if the serial port is not found"""
+        serial_device = self._find_device(serial)
+        if not serial_device:
+            return False
+        device = self._server.new_spec('VirtualSerialPort')
+        device.key = serial_device.key
+        device.backing = self._server.new_spec('VirtualSerialPortURIBackingInfo')
+        device.backing.serviceURI = uri
+        device.backing.direction = 'server'
+        self._device_change("edit",device)
+        return True
+
+    def change_name(self,name):
+        self.spec.name = name
+        self._changed = True
+        return True
+
+    def reserve_cpu(self,mHz):
+        if not self.spec.cpuAllocation:
+            self.spec.cpuAllocation = self._server.new_spec('ResourceAllocationInfo')
+        self.spec.cpuAllocation.reservation = mHz
+        self._changed = True
+        return True
+
+    def reserve_memory(self,mb):
+        """Reserve the memory in MB, 0 reserves all of the vm memory"""
+        if mb == 0:
+            mb = self._vm.mor.runtime.maxMemoryUsage
+        if not self.spec.memoryAllocation:
+            self.spec.memoryAllocation = self._server.new_spec('ResourceAllocationInfo')
+        self.spec.memoryAllocation.reservation = mb
+        self._changed = True
+        return True
+
+    def commit(self):
+        """Send all the collected changes as one ReconfigVM_Task. Returns
+        the task (waited for if wait=True) or None if nothing changed"""
+        if not self._changed:
+            return None
+        tk = self._vm.mor.ReconfigVM_Task(spec=self.spec)
+        if self._wait:
+            tk = self._server.wait_for_task(tk)
+            self._vm.update()
+        else:
+            tk = self._server.add_task(tk)
+        self.task = tk
+        self._changed = False
+        self._devices = None
+        self._new_controllers = []
+        self._new_units = {}
+        self.spec = self._server.new_spec('VirtualMachineConfigSpec')
+        self.spec.deviceChange = []
+        return tk
@@ -0,0 +1,127 @@
+"""
+Background stream of property updates.
+
+A PropertyWatcher thread creates a private property collector with one
+filter over a container view and loops on WaitForUpdatesEx, passing the
+version string of the previous update. The first call returns the
+current value of the properties of every object (kind 'enter'), the
+following calls return only what changed. Each object update is handed
+to the callback as callback(kind, mor, changes), where changes is a dict
+of property path to new value (None if the property was removed).
+"""
+
+import threading
+import time
+
+from pyVmomi import vmodl
+
+import inventory
+
+# upper bound for each WaitForUpdatesEx call in seconds
+MAX_WAIT = 30
+
+
+class PropertyWatcher(threading.Thread):
+    """Thread that streams the property updates of all the objects of the
+    given types under the container (root folder by default)"""
+
+    def __init__(self,server_obj,type_props,callback,container=None,
+            max_wait=MAX_WAIT):
+        """type_props is a dict of type name (e.g. VirtualMachine) to the
+        list of property paths to watch"""
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self._server = server_obj
+        self._type_props = {}
+        for type_name, props in type_props.items():
+            self._type_props[inventory.get_type(type_name)] = props
+        self._callback = callback
+        self._container = container
+        self._max_wait = max_wait
+        self._stop_event = threading.Event()
+        self._collector = None
+        # set once the initial contents have been received
+        self.ready = threading.Event()
+        self.version = None
+        self.error = None
+        # time of the last reply from the server, the watched properties
+        # are known to be current as of this time
+        self.last_sync = None
+
+    def age(self):
+        """Seconds since the last reply from the server or None"""
+        if self.last_sync is None:
+            return None
+        return time.time() - self.last_sync
+
+    def is_ready(self):
+        """Return True if the initial contents have been received and
+        the thread is still receiving updates"""
+        return self.ready.is_set() and self.is_alive() and not self.error
+
+    def _apply(self,update):
+        for filter_update in update.filterSet:
+            for obj_update in filter_update.objectSet:
+                changes = {}
+                for change in obj_update.changeSet:
+                    if change.op in ['remove','indirectRemove']:
+                        changes[change.name] = None
+                    else:
+                        changes[change.name] = change.val
+                self._callback(obj_update.kind,obj_update.obj,changes)
+
+    def run(self):
+        view = None
+        try:
+            pc = self._server.mor.content.propertyCollector
+            self._collector = pc.CreatePropertyCollector()
+            view = inventory.create_view(self._server,
+                                         self._type_props.keys(),
+                                         self._container)
+            fspec = inventory.container_filter_spec(view,self._type_props)
+            self._collector.CreateFilter(spec=fspec,partialUpdates=True)
+            version = ''
+            while not self._stop_event.is_set():
+                options = vmodl.query.PropertyCollector.WaitOptions()
+                options.maxWaitSeconds = self._max_wait
+                update = self._collector.WaitForUpdatesEx(version=version,
+                                                          options=options)
+                if update:
+                    version = update.version
+                    self._apply(update)
+                    self.version = version
+                self.last_sync = time.time()
+                if not (update and update.truncated):
+                    # the initial contents can span several updates
+                    self.ready.set()
+        except vmodl.fault.RequestCanceled:
+            # stop was called
+            pass
+        except Exception as e:
+            if not self._stop_event.is_set():
+                print "Property watcher stopped", e
+                self.error = e
+        finally:
+            self.ready.set()
+            self._cleanup(view)
+        return
+
+    def _cleanup(self,view):
+        try:
+            if view:
+                view.Destroy()
+            if self._collector:
+                self._collector.DestroyPropertyCollector()
+        except Exception:
+            pass
+        return
+
+    def stop(self):
+        """Stop receiving updates"""
+        self._stop_event.set()
+        if self._collector:
+            try:
+                self._collector.CancelWaitForUpdates()
+            except Exception:
+                pass
+        return
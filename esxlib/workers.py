@@ -0,0 +1,52 @@
+"""
+Run blocking calls (synchronous vim methods, ssh commands, socket
+connects) on a bounded number of threads.
+"""
+
+import sys
+import threading
+import Queue
+
+# default number of threads
+MAX_WORKERS = 8
+
+
+def check_max_workers(max_workers):
+    """Raise ValueError if max_workers would not run anything"""
+    if max_workers < 1:
+        raise ValueError("max_workers must be at least 1, got %s" %
+                         max_workers)
+    return
+
+
+def run_parallel(func,items,max_workers=MAX_WORKERS):
+    """Call func(item) for every item using at most max_workers threads.
+    This is a generator that yields (item, result, error) as each call
+    completes. error is the exception raised by func, if any"""
+    check_max_workers(max_workers)
+    items = list(items)
+    if not items:
+        return
+    work = Queue.Queue()
+    results = Queue.Queue()
+    for item in items:
+        work.put(item)
+
+    def worker():
+        while True:
+            try:
+                item = work.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results.put((item,func(item),None))
+            except:
+                # anything, else the consumer waits for it forever
+                results.put((item,None,sys.exc_info()[1]))
+
+    for i in range(min(max_workers,len(items))):
+        th = threading.Thread(target=worker)
+        th.daemon = True
+        th.start()
+    for i in range(len(items)):
+        yield results.get()
@@ -8,13 +8,48 @@ import pexpect
 import sys
 import os
 
+# per user directory of the master connection sockets
+CONTROL_DIR = "~/.ssh"
+
+
+def control_options(master=True):
+    """
+    ssh options to share one master connection per (user, ip), so an scp
+    to an ip with an open multiplexed SSH skips the connect and login.
+    The master is the SSH session itself and closes with it, there is
+    no ControlPersist background master that would inherit the pty of
+    the spawned command. With master False an existing master is used
+    but none is started
+    """
+    control_dir = os.path.expanduser(CONTROL_DIR)
+    if not os.path.isdir(control_dir):
+        os.makedirs(control_dir, 0700)
+    path = os.path.join(control_dir, "cm-%r@%h:%p")
+    if master:
+        return "-o ControlMaster=auto -o ControlPath=%s" % path
+    return "-o ControlMaster=no -o ControlPath=%s" % path
+
+
+def session(pool, ip=None, user=None, password=None, prompt='(.+)[#>$] ?',
+            ssh_options="", timeout=None, multiplex=False):
+    """
+    Check out a pooled SSH session of (ip, user) for a with block. pool
+    is a session pool such as esxlib.sshpool.get_pool('expect'). The
+    session is shared with the other users of the pool and is closed
+    instead of returned if the block raises
+    """
+    return pool.session(
+        (ip, user), lambda: SSH(ip, user, password, prompt, ssh_options,
+                                multiplex),
+        timeout)
+
 
 class SSH(object):
     """
     SSH expect class
     """
     def __init__(self, ip=None, user=None, password=None,
-                 prompt='(.+)[#>$] ?', ssh_options=""):
+                 prompt='(.+)[#>$] ?', ssh_options="", multiplex=False):
         os.environ['TERM'] = 'dumb'
         self._ip = ip
         self._user = user
@@ -24,6 +59,7 @@ class SSH(object):
         self.last_output = ""
         self.last_prompt = ""
         self._ssh_options = ssh_options
+        self._multiplex = multiplex
         self._connect()
 
     def _connect(self):
@@ -34,6 +70,8 @@ class SSH(object):
         """
         ssh_options = self._ssh_options +\
             " -o UserKnownHostsFile=/dev/null -o StrictHostKeyChecking=no"
+        if self._multiplex:
+            ssh_options += " " + control_options()
         cmd = "ssh %s" % ssh_options
         if self._user:
             cmd += " -l %s" % self._user
@@ -41,6 +79,17 @@ class SSH(object):
 
         handle = pexpect.spawn(cmd, timeout=60)
         self._handle = handle
+        try:
+            self._login(handle)
+        except:
+            # do not leave the ssh process of a failed login behind
+            handle.close()
+            raise
+
+    def _login(self, handle):
+        """
+        Answer the host key and password prompts till the shell prompt
+        """
         loop_count = 0
         while True:
             # dont get into infinite loop
@@ -167,12 +216,28 @@ class SSH(object):
         self.flush()
         return self._handle.eof()
 
+    def is_alive(self):
+        """
+        Check if the ssh process is still running, without waiting on
+        the session like is_closed
+        """
+        return self._handle.isalive() and not self._handle.eof()
+
+    def close(self):
+        """
+        Close the session
+        """
+        self._handle.close()
+        return
+
 
 class SCP(object):
-    def __init__(self, ip=None, user=None, password=None):
+    def __init__(self, ip=None, user=None, password=None, multiplex=False):
         self._ip = ip
         self._user = user
         self._password = password
+        # reuse the master connection of a multiplexed SSH to the ip
+        self._multiplex = multiplex
 
     def _launch(self, cmd):
         handle = pexpect.spawn(cmd)
@@ -198,13 +263,20 @@ class SCP(object):
             break
         return output
 
+    def _options(self):
+        if self._multiplex:
+            return control_options(master=False) + " "
+        return ""
+
     def put(self, local, remote):
-        cmd = 'scp -r %s %s@%s:%s' % (local, self._user, self._ip, remote)
+        cmd = 'scp %s-r %s %s@%s:%s' % (self._options(), local, self._user,
+                                        self._ip, remote)
         output = self._launch(cmd)
         return output
 
     def get(self, remote, local):
-        cmd = 'scp -r %s@%s:%s %s' % (self._user, self._ip, remote, local)
+        cmd = 'scp %s-r %s@%s:%s %s' % (self._options(), self._user,
+                                        self._ip, remote, local)
         output = self._launch(cmd)
         return output
 
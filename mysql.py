@@ -1,75 +1,959 @@
 #! /usr/bin/python
 
+import collections
+import contextlib
+import re
+import threading
+import time
+
 import MySQLdb
+import MySQLdb.cursors
+
+# seconds after which an unused pooled connection is closed
+POOL_IDLE_TIMEOUT = 300
+
+# bytes of max_allowed_packet left free by the multi-row inserts
+PACKET_HEADROOM = 1024
+
+# seconds a cached select result is served
+CACHE_TTL = 60
+
+# statements that do not change any table, any other one (call, do,
+# handler, ...) may change tables that can not be told
+READ_STATEMENTS = ['select', 'show', 'set']
+
+# quoted strings are kept as they are, other whitespace is collapsed
+_NORMALIZE_RE = re.compile(r"""('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|`[^`]*`)"""
+                           r"|\s+")
+_LITERAL_RE = re.compile(r"""('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")""")
+_NAME = r"`?\w+`?(?:\.`?\w+`?)?"
+# words after a table name that start the next clause, not an alias
+_CLAUSE_WORDS = (r"(?:where|join|inner|left|right|outer|cross|natural|"
+                 r"straight_join|on|using|group|order|limit|having|union|"
+                 r"for|lock|into|procedure|window|partition|force|use|"
+                 r"ignore|set|values|select|as)\b")
+_TABLE_REF = (_NAME + r"(?:\s+(?:as\s+)?(?!" + _CLAUSE_WORDS +
+              r")`?\w+`?)?")
+# comma separated list of tables with optional aliases
+_TABLE_LIST = r"(" + _TABLE_REF + r"(?:\s*,\s*" + _TABLE_REF + r")*)"
+_READ_TABLES_RE = re.compile(r"\b(?:from|join)\s+" + _TABLE_LIST, re.I)
+_WRITE_TABLES_RE = re.compile(
+    r"^\s*(?:(?:insert|replace)(?:\s+(?:low_priority|delayed|"
+    r"high_priority|ignore))*(?:\s+into)?|update(?:\s+(?:low_priority|"
+    r"ignore))*|delete(?:\s+(?:low_priority|quick|ignore))*\s+from|"
+    r"truncate(?:\s+table)?|alter(?:\s+ignore)?\s+table|"
+    r"drop\s+table(?:\s+if\s+exists)?|"
+    r"load\s+data.*?\s+into\s+table)\s+" + _TABLE_LIST, re.I | re.S)
+# selects whose result depends on more than the tables they read, or
+# that lock or write
+_UNCACHEABLE_RE = re.compile(
+    r"\bfor\s+(?:update|share)\b|\block\s+in\s+share\s+mode\b|\binto\b|"
+    r"@|\b(?:now|sysdate|curdate|curtime|unix_timestamp|rand|uuid|"
+    r"uuid_short|last_insert_id|found_rows|row_count|connection_id|"
+    r"get_lock|release_lock|is_free_lock|is_used_lock|sleep|benchmark|"
+    r"user|database|schema)\s*\(|\b(?:current_(?:date|time|timestamp|"
+    r"user)|localtime(?:stamp)?|utc_(?:date|time|timestamp))\b", re.I)
+# prefix, the row placeholders and the on duplicate key clause of an
+# INSERT ... VALUES query
+_INSERT_VALUES_RE = re.compile(
+    r"^(\s*(?:insert|replace)\b.*?\bvalues\s*)(\((?:[^()]|\([^()]*\))*\))(.*)$",
+    re.I | re.S)
+# %s placeholders and %% escapes of a query string
+_PLACEHOLDER_RE = re.compile(r"%%|%s")
+_NAMED_PLACEHOLDER_RE = re.compile(r"(?<!%)(?:%%)*%\(\w+\)s")
+
+
+def _server_placeholders(string):
+    """Return the query string with the %s placeholders as ? and the %%
+    escapes as %, for PREPARE"""
+    return _PLACEHOLDER_RE.sub(
+        lambda m: "%" if m.group(0) == "%%" else "?", string)
+
+
+def _statement(string):
+    """Return the first word of the query in lower case"""
+    words = string.split(None, 1)
+    if not words:
+        return ""
+    return words[0].lower()
+
+
+def _table_names(table_list):
+    """Table names of a comma separated table list, without the
+    aliases, the backquotes and the db prefix"""
+    names = set()
+    for ref in table_list.split(","):
+        name = re.match(_NAME, ref.strip()).group(0)
+        names.add(name.strip("`").split(".")[-1].strip("`").lower())
+    return names
+
+
+def _is_multi_statement(string):
+    """Return True if the query string holds more than one statement,
+    string has its literals replaced already"""
+    string = re.sub(r"`[^`]*`", "``", string)
+    return ";" in string.strip().rstrip(";")
+
+
+def _read_tables(string):
+    """Return the tables named after from and join, None if a table
+    list could not be read to its end"""
+    tables = set()
+    for match in _READ_TABLES_RE.finditer(string):
+        rest = string[match.end():].lstrip()
+        if rest[:1] in (",", "("):
+            return None
+        tables |= _table_names(match.group(1))
+    return tables
+
+
+def _cacheable_tables(string):
+    """Return the tables read by the select, None if its result should
+    not be cached"""
+    string = _LITERAL_RE.sub("''", string)
+    if _UNCACHEABLE_RE.search(string) or _is_multi_statement(string):
+        return None
+    # a select without tables is not worth caching
+    return _read_tables(string) or None
+
+
+def _written_tables(string):
+    """Return the tables changed by the write query, None if they can
+    not be told"""
+    string = _LITERAL_RE.sub("''", string)
+    if _is_multi_statement(string):
+        return None
+    match = _WRITE_TABLES_RE.match(string)
+    if not match:
+        return None
+    # multi table updates and deletes name the others in joins
+    joined = _read_tables(string)
+    if joined is None:
+        return None
+    return _table_names(match.group(1)) | joined
+
+
+def _changes_tables(string):
+    """Return True if the query may change tables, all but the single
+    read statements"""
+    if _statement(string) not in READ_STATEMENTS:
+        return True
+    return _is_multi_statement(_LITERAL_RE.sub("''", string))
+
+
+class ResultCache(object):
+    """LRU cache of select results with a ttl. Every entry keeps the
+    tables the select read, so writes to a table drop its entries.
+
+    Every table has a generation that invalidate bumps. A select reads
+    the generations of its tables before it runs and put refuses its
+    rows if one changed meanwhile, so a select that raced with a write
+    does not cache the rows from before the write"""
+
+    def __init__(self, max_size=1000, ttl=CACHE_TTL):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        # key -> (expiry time, rows, tables), least recently used first
+        self._entries = collections.OrderedDict()
+        # table -> generation, and the generation of all the tables
+        self._generations = {}
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, string, args=None):
+        """Cache key of the query and its args"""
+        string = _NORMALIZE_RE.sub(lambda m: m.group(1) or " ", string)
+        return (string.strip().rstrip(";").strip(), repr(args))
+
+    def get(self, key):
+        """Return the cached rows of the key or None"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[0] < time.time():
+                self.misses += 1
+                return None
+            # put it back as the most recently used
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def _generations_of(self, tables):
+        return (self._generation,
+                dict([(t, self._generations.get(t, 0)) for t in tables]))
+
+    def generation(self, tables):
+        """Return the generation of the tables, to be passed to put"""
+        with self._lock:
+            return self._generations_of(tables)
+
+    def put(self, key, rows, tables, generation=None):
+        """Cache the rows unless the tables were invalidated since the
+        generation was read"""
+        with self._lock:
+            if generation is not None and\
+                    generation != self._generations_of(tables):
+                return
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + self._ttl, rows, tables)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, tables=None):
+        """Drop the entries that read any of the tables, all of them if
+        tables is None"""
+        with self._lock:
+            if tables is None:
+                self._generation += 1
+                self._entries.clear()
+                return
+            for t in tables:
+                self._generations[t] = self._generations.get(t, 0) + 1
+            for key, entry in self._entries.items():
+                if entry[2] & tables:
+                    del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions,
+                    'size': len(self._entries)}
+
+
+class _State(object):
+    """Connection and cursor used by the queries"""
+    connection = None
+    cursor = None
+    in_transaction = False
+    broken = False
+    # rows of the last query if it was served from the result cache
+    cached = None
+    # tables written in the current transaction
+    tx_tables = None
+    # autocommit was turned off on the connection
+    autocommit_off = False
+
+
+class _LocalState(threading.local):
+    """Connection and cursor of the current thread in pooled mode"""
+    connection = None
+    cursor = None
+    in_transaction = False
+    broken = False
+    # rows of the last query if it was served from the result cache
+    cached = None
+    # tables written in the current transaction
+    tx_tables = None
+    # autocommit was turned off on the connection
+    autocommit_off = False
+
+
+class Pool(object):
+    """Bounded pool of database connections. Connections are checked
+    out by one thread at a time, pinged before being handed out and
+    closed after idle_timeout seconds unused, keeping at least min_size
+    of them open. There is no reaper thread, the idle connections are
+    expired on every checkout and checkin, so a pool that is not used at
+    all keeps its connections till the next use or expire()"""
+
+    def __init__(self, connect, min_size=0, max_size=8,
+                 idle_timeout=POOL_IDLE_TIMEOUT):
+        self._connect = connect
+        self._min_size = min_size
+        self._max_size = max_size
+        self._idle_timeout = idle_timeout
+        self._cond = threading.Condition()
+        # (connection, time returned), most recent last
+        self._idle = []
+        # connections open, idle or checked out
+        self._open = 0
+        self._filled = False
+
+    def _fill(self):
+        """Open min_size connections on first use. The slots are
+        reserved with the lock held, the connects run without it"""
+        with self._cond:
+            if self._filled:
+                return
+            self._filled = True
+            count = max(0, self._min_size - self._open)
+            self._open += count
+        conns = []
+        try:
+            for i in range(count):
+                conns.append(self._connect())
+        finally:
+            with self._cond:
+                self._open -= count - len(conns)
+                now = time.time()
+                self._idle.extend([(conn, now) for conn in conns])
+                self._cond.notify_all()
+
+    def _expire(self):
+        """Drop the connections idle past the timeout, called with the
+        lock held. Returns the connections to close"""
+        expired = []
+        now = time.time()
+        keep = []
+        # the oldest connections are first in the list
+        for conn, last_used in self._idle:
+            if now - last_used > self._idle_timeout and\
+                    self._open > self._min_size:
+                expired.append(conn)
+                self._open -= 1
+            else:
+                keep.append((conn, last_used))
+        self._idle = keep
+        return expired
+
+    def _is_alive(self, conn):
+        try:
+            conn.ping()
+        except MySQLdb.Error:
+            return False
+        return True
+
+    def checkout(self, timeout=None):
+        """Return a live connection. Blocks till one is returned if
+        max_size connections are open, raises RuntimeError if none is
+        available within the timeout (seconds)"""
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        if not self._filled:
+            self._fill()
+        while True:
+            conn = None
+            with self._cond:
+                expired = self._expire()
+                while True:
+                    if self._idle:
+                        conn = self._idle.pop()[0]
+                        break
+                    if self._open < self._max_size:
+                        # reserve the slot, connect without the lock
+                        self._open += 1
+                        break
+                    remaining = None
+                    if deadline is not None:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            raise RuntimeError('No database connection '
+                                               'available')
+                    self._cond.wait(remaining)
+            for c in expired:
+                self._close(c)
+            if conn is None:
+                try:
+                    return self._connect()
+                except:
+                    self._release()
+                    raise
+            if self._is_alive(conn):
+                return conn
+            self._close(conn)
+            self._release()
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except MySQLdb.Error:
+            pass
+
+    def _release(self):
+        with self._cond:
+            self._open -= 1
+            self._cond.notify()
+
+    def checkin(self, conn, broken=False, reset=False):
+        """Return the connection to the pool. A broken connection is
+        closed. With reset an open transaction is rolled back and
+        autocommit turned back on, so the next user gets a clean
+        session"""
+        if reset and not broken:
+            try:
+                conn.rollback()
+                conn.autocommit(True)
+            except MySQLdb.Error:
+                broken = True
+        if broken:
+            self._close(conn)
+            self._release()
+            return
+        with self._cond:
+            self._idle.append((conn, time.time()))
+            self._cond.notify()
+            # a burst is over once its connections sit idle
+            expired = self._expire()
+        for c in expired:
+            self._close(c)
+
+    def expire(self):
+        """Close the connections idle past the idle timeout now"""
+        with self._cond:
+            expired = self._expire()
+        for c in expired:
+            self._close(c)
+
+    def close(self):
+        """Close the idle connections"""
+        with self._cond:
+            idle = self._idle
+            self._idle = []
+            self._open -= len(idle)
+            self._filled = False
+            self._cond.notify_all()
+        for conn, last_used in idle:
+            self._close(conn)
 
 
 class Db(object):
-    """Basic Mysql class to operate with the mysql database"""
+    """Basic Mysql class to operate with the mysql database.
 
-    def __init__(self, host="", user="", passwd="", db=""):
+    With pool_size the Db is shared by many threads. Every thread checks
+    out its own connection from a pool of at most pool_size connections,
+    for the with block of connection() or for a single query()
+    otherwise. get_row/get_all_rows return the rows of the thread's last
+    query.
+
+    With cache_size the results of select queries are cached for
+    cache_ttl seconds, up to cache_size results with the least recently
+    used dropped first. Writes made through this Db drop the cached
+    results of the tables they change, all of them if the tables can not
+    be told. Every statement but a single select, show or set counts as
+    a write, e.g. call or a string of many statements. Selects inside a
+    transaction or with autocommit off, selects that lock rows, and
+    selects without tables or with session dependent functions (now(),
+    last_insert_id(), @variables, ...) are not cached. The tables
+    written with autocommit off are dropped again on commit, rollback
+    and when autocommit is turned back on"""
+
+    def __init__(self, host="", user="", passwd="", db="", pool_size=0,
+                 pool_min=0, pool_idle_timeout=POOL_IDLE_TIMEOUT,
+                 cache_size=0, cache_ttl=CACHE_TTL):
         self._host = host
         self._user = user
         self._passwd = passwd
         self._db = db
-        self._connection = None
-        self._cursor = None
-
-    def _connect(self):
-        """Connect to the database. This method is called automatically
-        if no connection is made to the database."""
+        self._pool = None
+        # longest multi-row insert statement, from max_allowed_packet
+        self._max_stmt_length = None
+        # name -> query template, see register
+        self._templates = {}
+        self._templates_lock = threading.Lock()
+        self._cache = None
+        if cache_size:
+            self._cache = ResultCache(cache_size, cache_ttl)
+        if pool_size:
+            self._pool = Pool(self._open, pool_min, pool_size,
+                              pool_idle_timeout)
+            self._state = _LocalState()
+        else:
+            self._state = _State()
 
+    def _open(self):
+        """Return a new connection to the database"""
         if not self._host:
             raise Exception('Server host not defined')
-        self._connection = MySQLdb.connect(
+        conn = MySQLdb.connect(
             host=self._host,
             user=self._user,
             passwd=self._passwd,
             db=self._db)
-        self._cursor = self._connection.cursor(MySQLdb.cursors.DictCursor)
+        if self._pool:
+            conn.autocommit(True)
+        return conn
+
+    def _connect(self):
+        """Connect to the database. This method is called automatically
+        if no connection is made to the database."""
+
+        self._state.connection = self._open()
+        self._state.cursor = self._state.connection.cursor(
+            MySQLdb.cursors.DictCursor)
         # backward compatibility
         self.enable_auto_commit()
 
-    def query(self, string):
-        """Execute the given string as query on the database"""
+    @contextlib.contextmanager
+    def connection(self, timeout=None):
+        """Check out a pooled connection for the current thread for the
+        with block. All the queries of the thread in the block run on it.
+        Without a pool, the block uses the shared connection"""
+        state = self._state
+        if not self._pool or state.connection:
+            # no pool or nested block, keep the current connection
+            yield self
+            return
+        state.connection = self._pool.checkout(timeout)
+        state.cursor = state.connection.cursor(MySQLdb.cursors.DictCursor)
+        broken = False
+        try:
+            yield self
+        except MySQLdb.OperationalError:
+            broken = True
+            raise
+        finally:
+            conn = state.connection
+            state.connection = None
+            broken = broken or state.broken
+            state.broken = False
+            reset = state.autocommit_off
+            if reset:
+                # rolled back by the checkin
+                self._invalidate_tx()
+            state.autocommit_off = False
+            # the cursor keeps the fetched rows for get_row/get_all_rows
+            self._pool.checkin(conn, broken, reset)
+
+    def query(self, string, args=None):
+        """Execute the given string as query on the database. args is a
+        tuple or dict of parameters for the %s or %(name)s placeholders
+        in the string, escaped by the driver. Returns the number of rows
+        affected"""
+
+        state = self._state
+        state.cached = None
+        if self._cache is None:
+            return self._query(string, args)
+        statement = _statement(string)
+        tables = None
+        if statement == "select" and not state.in_transaction and\
+                not state.autocommit_off:
+            # the uncommitted rows of this connection are not for others
+            tables = _cacheable_tables(string)
+        if tables:
+            key = self._cache.key(string, args)
+            rows = self._cache.get(key)
+            if rows is None:
+                generation = self._cache.generation(tables)
+                self._query(string, args)
+                rows = list(state.cursor.fetchall())
+                self._cache.put(key, rows, tables, generation)
+            # the caller gets copies, the cached rows stay as read
+            state.cached = collections.deque([dict(row) for row in rows])
+            return len(rows)
+        try:
+            return self._query(string, args)
+        finally:
+            if _changes_tables(string):
+                self._invalidate(string)
+
+    def _invalidate(self, string):
+        """Drop the cached results of the tables the write query
+        changes"""
+        if self._cache is None:
+            return
+        tables = _written_tables(string)
+        state = self._state
+        if state.autocommit_off:
+            # dropped again on commit, other threads may cache the old
+            # rows till then
+            if tables is None or state.tx_tables is None:
+                state.tx_tables = None
+            else:
+                state.tx_tables |= tables
+        self._cache.invalidate(tables)
+
+    def _query(self, string, args=None, retry=True):
+        if self._pool and not self._state.connection:
+            with self.connection():
+                return self._query(string, args, retry)
 
         # if the connection to database is not done, connect now
-        if not self._connection:
+        if not self._state.connection:
             self._connect()
 
         try:
-            self._cursor.execute(string)
+            self._state.cursor.execute(string, args)
         except MySQLdb.OperationalError:
+            if self._state.in_transaction or not retry:
+                # the statements before this one are lost with the
+                # connection, dont run this one on its own
+                raise
+            self._reconnect()
+            self._state.cursor.execute(string, args)
+
+        return self._state.cursor.rowcount
+
+    def _get_max_stmt_length(self):
+        if self._max_stmt_length is None:
+            cursor = self._state.connection.cursor()
+            cursor.execute("select @@max_allowed_packet")
+            size = cursor.fetchone()[0]
+            cursor.close()
+            self._max_stmt_length = int(size) - PACKET_HEADROOM
+        return self._max_stmt_length
+
+    def _multi_row_inserts(self, string, rows):
+        """Return the rows of the INSERT ... VALUES query as multi-row
+        insert statements, each as large as max_allowed_packet allows.
+        None if the query is not such an insert. The rows are escaped
+        here, the driver's own batching is not used because older
+        MySQLdb versions ignore max_stmt_length"""
+        match = _INSERT_VALUES_RE.match(string)
+        if not match:
+            return None
+        prefix, values, suffix = match.groups()
+        conn = self._state.connection
+        limit = self._get_max_stmt_length()
+        statements = []
+        chunk = []
+        length = len(prefix) + len(suffix)
+        for row in rows:
+            # item by item like cursor.execute, newer drivers return one
+            # string for literal(tuple)
+            if isinstance(row, dict):
+                escaped = dict([(key, conn.literal(item))
+                                for key, item in row.items()])
+            else:
+                escaped = tuple([conn.literal(item) for item in row])
+            value = values % escaped
+            if chunk and length + len(value) + 1 > limit:
+                statements.append(prefix + ",".join(chunk) + suffix)
+                chunk = []
+                length = len(prefix) + len(suffix)
+            chunk.append(value)
+            length += len(value) + 1
+        if chunk:
+            statements.append(prefix + ",".join(chunk) + suffix)
+        return statements
+
+    def executemany(self, string, rows):
+        """Execute the query once for every tuple (or dict) of parameters
+        in rows. An INSERT ... VALUES query is sent as multi-row inserts,
+        each statement as large as max_allowed_packet allows. Returns the
+        number of rows affected"""
+        if self._pool and not self._state.connection:
+            with self.connection():
+                return self.executemany(string, rows)
+        if not self._state.connection:
             self._connect()
-            self._cursor.execute(string)
+        if isinstance(string, unicode):
+            string = string.encode(
+                self._state.connection.character_set_name())
+        cursor = self._state.cursor
+        self._state.cached = None
+        count = 0
+        try:
+            statements = self._multi_row_inserts(string, rows)
+            if statements is None:
+                for row in rows:
+                    cursor.execute(string, row)
+                    count += cursor.rowcount
+            else:
+                for statement in statements:
+                    cursor.execute(statement)
+                    count += cursor.rowcount
+        finally:
+            self._invalidate(string)
+        return count
 
-        return self._cursor.rowcount
+    def insert_many(self, table, columns, rows):
+        """Insert the rows (tuples in the order of columns) into the
+        table with multi-row inserts. Returns the number of rows
+        inserted"""
+        for name in [table] + list(columns):
+            if not re.match(r'^\w+$', name):
+                raise ValueError("%s is not a valid table or column name"
+                                 % name)
+        string = "insert into `%s` (%s) values (%s)" % (
+            table, ", ".join(["`%s`" % c for c in columns]),
+            ", ".join(["%s"] * len(columns)))
+        return self.executemany(string, rows)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Run the queries of the with block in one transaction with
+        autocommit off. The transaction is committed when the block
+        exits and rolled back if it raises. In pooled mode the block
+        holds one connection of the pool"""
+        with self.connection():
+            state = self._state
+            if state.in_transaction:
+                # nested block, part of the outer transaction
+                yield self
+                return
+            self.disable_auto_commit()
+            state.in_transaction = True
+            try:
+                yield self
+            except:
+                state.in_transaction = False
+                try:
+                    self.rollback()
+                    self.enable_auto_commit()
+                except MySQLdb.Error:
+                    # dont hand out a connection left in the transaction
+                    state.broken = True
+                raise
+            state.in_transaction = False
+            self.commit()
+            self.enable_auto_commit()
+
+    def register(self, name, string, prepare=False):
+        """Register the query string under the name, to be run with
+        execute(name, args). string uses %s placeholders for the args.
+
+        With prepare the query is prepared on the server (PREPARE ...
+        FROM) once per connection and run with EXECUTE ... USING, so the
+        server parses it only once. MySQLdb has no binary protocol
+        prepared statements, so the args are still sent as text in a SET
+        before every EXECUTE. That is an extra round trip, worth it only
+        for statements that are costly to parse. Only positional args
+        (a tuple or list) and %s placeholders are supported with
+        prepare, ValueError is raised for %(name)s ones"""
+        if not re.match(r'^\w+$', name):
+            raise ValueError("Template name %s is not a valid identifier"
+                             % name)
+        if prepare and _NAMED_PLACEHOLDER_RE.search(string):
+            raise ValueError("Template %s is prepared, it can only use %%s "
+                             "placeholders" % name)
+        with self._templates_lock:
+            self._templates[name] = {
+                'string': string,
+                'prepare': prepare,
+                'count': 0,
+                'errors': 0,
+                'total_time': 0.0,
+                'max_time': 0.0,
+            }
+
+    def _run_prepared(self, name, string, args):
+        """Prepare the template on the current connection if it is not
+        yet, set the args and execute it. None of the statements is
+        retried on a new connection, it would not have the statement
+        prepared or the variables set"""
+        conn = self._state.connection
+        # name -> string prepared on the server under tpl_<name>
+        prepared = getattr(conn, '_prepared_templates', None)
+        if prepared is None:
+            prepared = conn._prepared_templates = {}
+        stmt = "tpl_" + name
+        # a name registered again with another string is prepared again
+        if prepared.get(name) != string:
+            # a failed prepare also drops the statement of that name
+            prepared.pop(name, None)
+            self._query("prepare %s from %%s" % stmt,
+                        (_server_placeholders(string),), retry=False)
+            prepared[name] = string
+        if not args:
+            return self._query("execute %s" % stmt, retry=False)
+        variables = ["@%s_%d" % (stmt, i) for i in range(len(args))]
+        self._query("set " + ", ".join(["%s = %%s" % v for v in variables]),
+                    tuple(args), retry=False)
+        return self._query("execute %s using %s" %
+                           (stmt, ", ".join(variables)), retry=False)
+
+    def _execute_prepared(self, name, template, args):
+        if args is not None and not isinstance(args, (tuple, list)):
+            raise TypeError("Template %s is prepared, args must be a tuple "
+                            "or list" % name)
+        string = template['string']
+        self._state.cached = None
+        try:
+            try:
+                return self._run_prepared(name, string, args)
+            except MySQLdb.OperationalError:
+                if self._state.in_transaction:
+                    raise
+                # all of it again on a new connection
+                self._reconnect()
+                return self._run_prepared(name, string, args)
+        finally:
+            # the execute does not name the tables, the template does
+            if _changes_tables(string):
+                self._invalidate(string)
+
+    def execute(self, name, args=None):
+        """Run the query template registered under the name with the
+        args. Returns the number of rows affected, the rows are read with
+        get_row/get_all_rows"""
+        template = self._templates[name]
+        elapsed = 0.0
+        ok = False
+        try:
+            with self.connection():
+                if not self._state.connection:
+                    self._connect()
+                # the stats are of the statement, not of the checkout
+                start = time.time()
+                try:
+                    if template['prepare']:
+                        count = self._execute_prepared(name, template, args)
+                    else:
+                        count = self.query(template['string'], args)
+                finally:
+                    elapsed = time.time() - start
+            ok = True
+        finally:
+            with self._templates_lock:
+                template['count'] += 1
+                template['total_time'] += elapsed
+                template['max_time'] = max(template['max_time'], elapsed)
+                if not ok:
+                    template['errors'] += 1
+        return count
+
+    def template_stats(self):
+        """Return a dict of template name to its execution count, errors,
+        total, average and max time in seconds"""
+        stats = {}
+        with self._templates_lock:
+            for name, template in self._templates.items():
+                stats[name] = {
+                    'count': template['count'],
+                    'errors': template['errors'],
+                    'total_time': template['total_time'],
+                    'avg_time': template['total_time'] /
+                    max(template['count'], 1),
+                    'max_time': template['max_time'],
+                }
+        return stats
+
+    def _reconnect(self):
+        if self._pool:
+            try:
+                self._state.connection.close()
+            except MySQLdb.Error:
+                pass
+        self._connect()
 
     def get_row(self):
         """Returns one row from a previous query. The row
         returned is a dict with column names as the keys"""
-        return self._cursor.fetchone()
+        cached = self._state.cached
+        if cached is not None:
+            if not cached:
+                return None
+            return cached.popleft()
+        return self._state.cursor.fetchone()
 
     def get_all_rows(self):
         """Returns all the rows from a previous query as list of dicts.
         The keys in the dict are the column names"""
-        return list(self._cursor.fetchall())
+        cached = self._state.cached
+        if cached is not None:
+            self._state.cached = collections.deque()
+            return list(cached)
+        return list(self._state.cursor.fetchall())
+
+    def stream(self, string, args=None, batch_size=None, tuples=False,
+               timeout=None):
+        """Execute the given string as query and yield the rows as they
+        are read from the server, without holding the result set in
+        memory. With batch_size the rows are yielded as lists of up to
+        batch_size rows. With tuples the rows are tuples in the column
+        order instead of dicts. The query runs on its own connection
+        (from the pool in pooled mode), so other queries can run while
+        the rows are read. Being another connection, it does not see the
+        uncommitted changes of the caller's transaction.
+
+        timeout (seconds) bounds the wait for a pooled connection,
+        RuntimeError is raised if none is free in time. Pass one when
+        calling this inside connection() or transaction(), the thread
+        then holds a pooled connection itself and could otherwise wait
+        for it forever"""
+        if self._pool:
+            if self._state.connection and self._pool._max_size == 1:
+                raise RuntimeError("stream needs a second pooled "
+                                   "connection, the pool has one and this "
+                                   "thread holds it")
+            conn = self._pool.checkout(timeout)
+        else:
+            conn = self._open()
+        if tuples:
+            cursor = conn.cursor(MySQLdb.cursors.SSCursor)
+        else:
+            cursor = conn.cursor(MySQLdb.cursors.SSDictCursor)
+        done = False
+        try:
+            cursor.execute(string, args)
+            while True:
+                if batch_size:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield list(rows)
+                else:
+                    row = cursor.fetchone()
+                    if row is None:
+                        break
+                    yield row
+            cursor.close()
+            done = True
+        finally:
+            # a result that was not read to the end would have to be
+            # drained from the server, drop the connection instead
+            if self._pool:
+                self._pool.checkin(conn, broken=not done)
+            else:
+                conn.close()
 
     def get_insert_id(self):
         """Returns the auto_increment id of the last query, if any"""
-        return self._cursor.lastrowid
+        return self._state.cursor.lastrowid
 
     def close(self):
-        """Close the database connection"""
-        self._connection.close()
+        """Close the database connection, or the idle connections of the
+        pool"""
+        if self._pool:
+            self._pool.close()
+            return
+        self._state.connection.close()
+
+    def cache_stats(self):
+        """Returns the hits, misses, evictions and size of the result
+        cache, None if the cache is not enabled"""
+        if self._cache is None:
+            return None
+        return self._cache.stats()
+
+    def clear_cache(self):
+        """Drop all the cached results, e.g. after the tables were
+        changed by something other than this Db"""
+        if self._cache is not None:
+            self._cache.invalidate()
+
+    def _check_connection(self, name):
+        """In pooled mode the session calls only make sense on the
+        connection of a connection() or transaction() block, outside of
+        it every query may run on another connection"""
+        if self._pool and not self._state.connection:
+            raise RuntimeError("%s needs a connection() or transaction() "
+                               "block with a pool" % name)
+
+    def _invalidate_tx(self):
+        """Drop the cached results of the tables written since autocommit
+        was turned off or the last commit or rollback"""
+        state = self._state
+        if self._cache is not None and state.autocommit_off:
+            self._cache.invalidate(state.tx_tables)
+        state.tx_tables = set()
 
     def commit(self):
-        self._connection.commit()
+        self._check_connection("commit")
+        self._state.connection.commit()
+        self._invalidate_tx()
 
     def rollback(self):
-        self._connection.rollback()
+        self._check_connection("rollback")
+        self._state.connection.rollback()
+        self._invalidate_tx()
 
     def enable_auto_commit(self):
+        self._check_connection("enable_auto_commit")
         self.query("set autocommit=1")
+        # turning it on commits the open transaction
+        self._invalidate_tx()
+        self._state.autocommit_off = False
 
     def disable_auto_commit(self):
+        """Turn autocommit off. In pooled mode it is turned back on when
+        the connection is returned to the pool"""
+        self._check_connection("disable_auto_commit")
         self.query("set autocommit=0")
+        self._state.tx_tables = set()
+        self._state.autocommit_off = True